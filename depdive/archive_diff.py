@@ -0,0 +1,258 @@
+import hashlib
+import io
+import json
+import subprocess
+import tarfile
+import uuid
+import zlib
+from zipfile import ZipFile
+from git import Repo
+from package_locator.common import CARGO
+from version_differ.common import COMPOSER, NPM, PIP
+from version_differ.download import CARGO_TOML, CARGO_TOML_ORIG
+from version_differ.version_differ import get_diff_stats_from_git_diff
+from depdive.common import git_blob_id
+
+ZIP_ARCHIVE = "zip"
+TAR_ARCHIVE = "tar"
+GEM_ARCHIVE = "gem"
+
+# the same as git, a file with a NUL byte in its first 8000 bytes is binary
+BINARY_SNIFF_BYTES = 8000
+
+# always kept in memory, for the git sha of the artifact
+GIT_SHA_FILES = [".cargo_vcs_info.json"]
+
+# refs the versions' files are imported under, deleted once diffed
+ARCHIVE_DIFF_REF = "refs/depdive/archive-diff/{}/{}"
+
+
+def open_archive(archive):
+    """archive content, or path to it, as a binary file"""
+    if isinstance(archive, bytes):
+        return io.BytesIO(archive)
+    return open(archive, "rb")
+
+
+def iter_zip_members(f):
+    with ZipFile(f) as z:
+        for info in z.infolist():
+            if not info.is_dir():
+                with z.open(info) as member:
+                    yield info.filename, member.read()
+
+
+def iter_tar_members(f, mode="r|*"):
+    with tarfile.open(fileobj=f, mode=mode) as t:
+        for info in t:
+            if info.isfile():
+                yield info.name, t.extractfile(info).read()
+
+
+def iter_gem_members(f):
+    # a gem is a plain tar of metadata and a data.tar.gz holding the package files
+    with tarfile.open(fileobj=f, mode="r|") as gem:
+        for gem_info in gem:
+            if gem_info.name == "data.tar.gz":
+                yield from iter_tar_members(gem.extractfile(gem_info), mode="r|gz")
+
+
+ARCHIVE_MEMBER_READERS = {ZIP_ARCHIVE: iter_zip_members, TAR_ARCHIVE: iter_tar_members, GEM_ARCHIVE: iter_gem_members}
+
+
+def iter_archive_members(archive, kind):
+    """(member path, member content) of the regular files of the archive, read in a single pass"""
+    read_members = ARCHIVE_MEMBER_READERS.get(kind)
+    if read_members:
+        with open_archive(archive) as f:
+            yield from read_members(f)
+
+
+def get_package_path(ecosystem, package, kind, member):
+    """
+    path of an archive member within the package, None for registry generated files,
+    the same as version_differ's download_package_source does on the extracted archive
+    """
+    while member.startswith("./"):
+        member = member[2:]
+    parts = member.split("/")
+    if ecosystem == COMPOSER or ecosystem == NPM or ecosystem == CARGO or (ecosystem == PIP and kind != ZIP_ARCHIVE):
+        # single top level directory
+        parts = parts[1:]
+    if not parts or not parts[-1]:
+        return None
+
+    if ecosystem == PIP:
+        if kind == ZIP_ARCHIVE:
+            # wheel metadata
+            if parts[0].endswith(".dist-info"):
+                return None
+        else:
+            if parts == ["PKG-INFO"] or "{}.egg-info".format(package.replace("-", "_")) in parts[:-1]:
+                return None
+    return "/".join(parts)
+
+
+def get_member_git_sha(ecosystem, contents):
+    """commit the artifact was published from, only recorded by cargo, the same as version_differ"""
+    try:
+        if ecosystem == CARGO and ".cargo_vcs_info.json" in contents:
+            return json.loads(contents[".cargo_vcs_info.json"])["git"]["sha1"]
+    except:
+        return None
+    return None
+
+
+def is_binary(content):
+    return b"\0" in content[:BINARY_SNIFF_BYTES]
+
+
+def is_binary_content(content):
+    """binary as the registry file filter sees it, to git or not UTF-8"""
+    if is_binary(content):
+        return True
+    try:
+        content.decode("utf-8")
+    except UnicodeDecodeError:
+        return True
+    return False
+
+
+def quote_path(path):
+    """path as git fast-import reads it, C-style quoted"""
+    quoted = path.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return '"{}"'.format(quoted).encode("utf-8", "surrogateescape")
+
+
+def import_versions(repo, *versions):
+    """
+    refs to commits holding the given path -> content dicts as their trees,
+    written into the git repository by a single git fast-import
+    """
+    refs = [ARCHIVE_DIFF_REF.format(uuid.uuid4().hex, i) for i in range(len(versions))]
+    process = repo.git.fast_import("--quiet", as_process=True, istream=subprocess.PIPE)
+    stream = process.proc.stdin
+    for ref, files in zip(refs, versions):
+        stream.write(b"commit %s\ncommitter depdive <depdive@localhost> 0 +0000\ndata 0\n" % ref.encode())
+        for path, content in files.items():
+            stream.write(b"M 100644 inline %s\ndata %d\n" % (quote_path(path), len(content)))
+            stream.write(content)
+            stream.write(b"\n")
+        stream.write(b"\n")
+    stream.close()
+    process.wait()
+    return refs
+
+
+def get_git_diff(repo_path, old_files, new_files):
+    """version_differ's diff stats between two path -> content dicts, diffed by git"""
+    repo = Repo(repo_path)
+    refs = import_versions(repo, old_files, new_files)
+    try:
+        uni_diff_text = repo.git.diff(*refs, ignore_blank_lines=True, ignore_space_at_eol=True)
+    finally:
+        # kept referenced until diffed, so that a concurrent gc does not prune them
+        for ref in refs:
+            repo.git.update_ref("-d", ref)
+    return get_diff_stats_from_git_diff(uni_diff_text)
+
+
+class ArchiveDiff:
+    """
+    diff between two registry artifacts, read from the archives' member streams without extracting them.
+
+    each archive is read once. the old version's members are held compressed until
+    the new version's sizes and digests tell which differ. only those are written as blobs
+    into the git repository at repo_path, e.g., the artifact cache's, and diffed by git,
+    renames included, the same as version_differ does on the extracted packages.
+    unlike version_differ, files ignored by the package's own .gitignore are not left out
+    """
+
+    def __init__(self, ecosystem, package, old_archive, old_kind, new_archive, new_kind, repo_path):
+        self.ecosystem = ecosystem
+        self.package = package
+        self.old_archive, self.old_kind = old_archive, old_kind
+        self.new_archive, self.new_kind = new_archive, new_kind
+        self.repo_path = repo_path
+
+        # files with the same size and digest in both versions, never diffed
+        self.identical_files = 0
+        # changed files with binary content in either version, see is_binary_content
+        self.binary_files: set[str] = set()
+
+        # path -> git blob id of the package files of each version
+        self.old_blobs: dict[str, str] = {}
+        self.new_blobs: dict[str, str] = {}
+
+    def _read(self, archive, kind, blobs):
+        """yields (path, content, (size, digest)) of the package files, blobs is filled with path -> git blob id"""
+        original_cargo_toml = False
+        for member, content in iter_archive_members(archive, kind):
+            path = get_package_path(self.ecosystem, self.package, kind, member)
+            if not path:
+                continue
+            if self.ecosystem == CARGO and path in [CARGO_TOML, CARGO_TOML_ORIG]:
+                # cargo normalizes Cargo.toml on publishing, the original one takes its place
+                if path == CARGO_TOML_ORIG:
+                    path, original_cargo_toml = CARGO_TOML, True
+                elif original_cargo_toml:
+                    continue
+
+            blobs[path] = git_blob_id(content)
+            yield path, content, (len(content), hashlib.sha256(content).digest())
+
+    def _read_old(self):
+        """path -> (size, digest) of the old version's files, and (size, digest) -> compressed content"""
+        digests, packed = {}, {}
+        for path, content, digest in self._read(self.old_archive, self.old_kind, self.old_blobs):
+            digests[path] = digest
+            if digest not in packed:
+                packed[digest] = zlib.compress(content, 1)
+        return digests, packed
+
+    def _read_new(self, old_digests):
+        """path -> (size, digest) of the new version's files, and path -> content of those not in the old one"""
+        digests, contents = {}, {}
+        for path, content, digest in self._read(self.new_archive, self.new_kind, self.new_blobs):
+            digests[path] = digest
+            if path in GIT_SHA_FILES or old_digests.get(path) != digest:
+                contents[path] = content
+            else:
+                contents.pop(path, None)
+        return digests, contents
+
+    def diff(self):
+        """(diff, old git sha, new git sha, old file list, new file list)"""
+        old_digests, old_packed = self._read_old()
+        new_digests, new_contents = self._read_new(old_digests)
+        old_contents = {
+            path: zlib.decompress(old_packed[digest])
+            for path, digest in old_digests.items()
+            if path in GIT_SHA_FILES or new_digests.get(path) != digest
+        }
+        del old_packed
+        self.identical_files = sum(1 for path, digest in new_digests.items() if old_digests.get(path) == digest)
+
+        removed = [path for path in old_digests if path not in new_digests]
+        added = [path for path in new_digests if path not in old_digests]
+        changed = [path for path in new_digests if path in old_digests and old_digests[path] != new_digests[path]]
+        self.binary_files = {
+            path
+            for path in removed + added + changed
+            if any(is_binary_content(contents.get(path, b"")) for contents in [old_contents, new_contents])
+        }
+
+        differing = set(removed + added + changed)
+        diff = get_git_diff(
+            self.repo_path,
+            {path: content for path, content in old_contents.items() if path in differing},
+            {path: content for path, content in new_contents.items() if path in differing},
+        )
+
+        return (
+            diff,
+            get_member_git_sha(self.ecosystem, old_contents),
+            get_member_git_sha(self.ecosystem, new_contents),
+            set(old_digests.keys()),
+            set(new_digests.keys()),
+        )
@@ -0,0 +1,123 @@
+from array import array
+from collections.abc import MutableMapping
+from depdive.common import LineDelta
+
+# (commit id, additions, deletions) per row
+ROW_WIDTH = 3
+
+
+class CommitIds:
+    """small integer ids of commit shas, so that the line tables of a diff do not each hold 40-char keys"""
+
+    __slots__ = ("ids", "commits")
+
+    def __init__(self):
+        self.ids: dict[str, int] = {}
+        self.commits: list[str] = []
+
+    def id(self, commit):
+        i = self.ids.get(commit)
+        if i is None:
+            i = self.ids[commit] = len(self.commits)
+            self.commits.append(commit)
+        return i
+
+    def commit(self, i):
+        return self.commits[i]
+
+
+class CommitDeltas(MutableMapping):
+    """
+    commit -> LineDelta of a single line, backed by a flat integer array of rows.
+    deltas are copied in and out, changing a returned LineDelta does not change the table
+    """
+
+    __slots__ = ("rows", "commit_ids")
+
+    def __init__(self, rows, commit_ids):
+        self.rows: array = rows
+        self.commit_ids: CommitIds = commit_ids
+
+    def _row(self, commit):
+        i = self.commit_ids.ids.get(commit)
+        if i is None:
+            return None
+        try:
+            return self.rows[::ROW_WIDTH].index(i) * ROW_WIDTH
+        except ValueError:
+            return None
+
+    def __getitem__(self, commit):
+        row = self._row(commit)
+        if row is None:
+            raise KeyError(commit)
+        return LineDelta(self.rows[row + 1], self.rows[row + 2])
+
+    def __setitem__(self, commit, delta):
+        row = self._row(commit)
+        if row is None:
+            self.rows.extend((self.commit_ids.id(commit), delta.additions, delta.deletions))
+        else:
+            self.rows[row + 1], self.rows[row + 2] = delta.additions, delta.deletions
+
+    def __delitem__(self, commit):
+        row = self._row(commit)
+        if row is None:
+            raise KeyError(commit)
+        del self.rows[row : row + ROW_WIDTH]
+
+    def __contains__(self, commit):
+        return self._row(commit) is not None
+
+    def __iter__(self):
+        return (self.commit_ids.commit(i) for i in self.rows[::ROW_WIDTH])
+
+    def __len__(self):
+        return len(self.rows) // ROW_WIDTH
+
+
+class ChangedLines(MutableMapping):
+    """
+    line -> commit -> LineDelta, i.e., a dict[str, dict[str, LineDelta]],
+    stored as one integer array per line with commits as ids of a CommitIds table.
+    lines are kept as given, i.e., the identities from the LineTable of the analysis
+    """
+
+    __slots__ = ("lines", "commit_ids")
+
+    def __init__(self, commit_ids=None):
+        self.lines: dict[str, array] = {}
+        self.commit_ids: CommitIds = commit_ids or CommitIds()
+
+    def __getitem__(self, line):
+        return CommitDeltas(self.lines[line], self.commit_ids)
+
+    def __setitem__(self, line, deltas):
+        if isinstance(deltas, CommitDeltas):
+            if deltas.rows is self.lines.get(line):
+                return
+            if deltas.commit_ids is self.commit_ids:
+                self.lines[line] = array(deltas.rows.typecode, deltas.rows)
+                return
+        rows = array("i")
+        for commit, delta in deltas.items():
+            rows.extend((self.commit_ids.id(commit), delta.additions, delta.deletions))
+        self.lines[line] = rows
+
+    def __delitem__(self, line):
+        del self.lines[line]
+
+    def __contains__(self, line):
+        return line in self.lines
+
+    def __iter__(self):
+        return iter(self.lines)
+
+    def __len__(self):
+        return len(self.lines)
+
+    def setdefault(self, line, default=None):
+        """CommitDeltas of the line, added empty if not there yet"""
+        if line not in self.lines:
+            self[line] = default or {}
+        return self[line]
@@ -1,17 +1,20 @@
+import os
 from version_differ.version_differ import FileDiff
-from package_locator.locator import get_repository_url_and_subdir
-from depdive.common import LineDelta, process_whitespace
-from depdive.registry_diff import get_registry_version_diff
+from depdive.common import LineDelta, LineTable
+from depdive.registry_diff import RegistryFileFilter, SummarizedFile, get_registry_version_diff
 from depdive.repository_diff import (
     RepositoryDiff,
     SingleCommitFileChangeData,
+    get_repository_blob_ids,
     get_repository_file_list,
+    resolve_symlink,
     UncertainSubdir,
     sort_commits_by_commit_date,
 )
 from depdive.code_review_checker import CommitReviewInfo
-from git import Repo
-import os
+from depdive.repository_resolution import DEFAULT_RESOLUTION_TTL, RepositoryResolutionCache
+
+DEFAULT_BLAME_WORKERS = os.cpu_count() or 1
 
 
 class PackageDirectoryChanged(Exception):
@@ -30,6 +33,10 @@ class DepdiveStats:
         phantom_files,
         files_with_phantom_lines,
         phantome_lines,
+        identical_files=0,
+        summarized_files=0,
+        git_command_spawns=0,
+        saved_git_spawns=0,
     ) -> None:
         self.added_reviewed_lines = added_reviewed_lines
         self.added_non_reviewed_lines = added_non_reviewed_lines
@@ -49,6 +56,16 @@ class DepdiveStats:
         self.files_with_phantom_lines = files_with_phantom_lines
         self.phantom_lines = phantome_lines
 
+        # changed files identical to the repository in both versions, skipped by the phantom line check
+        self.identical_files = identical_files
+
+        # changed registry files left out of line counting, e.g., lockfiles, minified bundles and binaries
+        self.summarized_files = summarized_files
+
+        # git processes the repository side of the analysis started, and those the object database sessions saved
+        self.git_command_spawns = git_command_spawns
+        self.saved_git_spawns = saved_git_spawns
+
     def print(self):
         print(self.reviewed_commits, self.non_reviewed_commits)
         print(
@@ -57,17 +74,72 @@ class DepdiveStats:
             self.removed_reviewed_lines,
             self.removed_non_reviewed_lines,
         )
-        print(self.phantom_files, self.files_with_phantom_lines, self.phantom_lines)
+        print(self.phantom_files, self.files_with_phantom_lines, self.phantom_lines, self.identical_files)
+        print(self.summarized_files)
+        print(self.git_command_spawns, self.saved_git_spawns)
         print(self.reviewed_lines, self.non_reviewed_lines, self.total_commit_count, self.reviewed_commit_count)
 
 
 class CodeReviewAnalysis:
-    def __init__(self, ecosystem, package, old_version, new_version, repository=None, directory=None):
+    def __init__(
+        self,
+        ecosystem,
+        package,
+        old_version,
+        new_version,
+        repository=None,
+        directory=None,
+        cache_dir=None,
+        blame_workers=DEFAULT_BLAME_WORKERS,
+        hash_lines=False,
+        diff_memory_files=None,
+        scoped=False,
+        refresh_repository=False,
+        repository_mapping=None,
+        resolution_ttl=DEFAULT_RESOLUTION_TTL,
+        registry_mirror=None,
+        streaming_registry_diff=False,
+        registry_file_filter=None,
+    ):
         self.ecosystem: str = ecosystem
         self.package: str = package
         self.old_version: str = old_version
         self.new_version: str = new_version
 
+        # directory for caches persisted across analyses
+        self.cache_dir: str = cache_dir
+
+        # number of files blamed concurrently, 1 blames one file at a time
+        self.blame_workers: int = blame_workers
+
+        # changed lines from the registry, the repository and blame are identified through one table,
+        # with hash_lines by 64-bit hashes rather than their text
+        self.lines: LineTable = LineTable(hashed=hash_lines)
+
+        # if given, the repository side keeps change data of at most this many files in memory,
+        # files are paged in from disk as the analysis gets to them
+        self.diff_memory_files: int = diff_memory_files
+
+        # limit the repository side to the package directory and the paths registry files map to outside of it
+        self.scoped: bool = scoped
+
+        # package -> repository resolutions, kept under cache_dir for resolution_ttl seconds,
+        # preloaded from the repository_mapping file if given, and re-resolved if refresh_repository
+        self.refresh_repository: bool = refresh_repository
+        self.repository_resolution = RepositoryResolutionCache(
+            cache_dir, ttl=resolution_ttl, mapping_file=repository_mapping
+        )
+
+        # local directory laid out as a registry mirror, registry artifacts are read from it if given
+        self.registry_mirror: str = registry_mirror
+
+        # diff registry artifacts from their archives' member streams, without extracting them to disk
+        self.streaming_registry_diff: bool = streaming_registry_diff
+
+        # pre-filter of registry files, if not given only the registry's generated files are left out,
+        # see RegistryFileFilter.for_ecosystem(summarize=True) to leave out lockfiles, minified bundles, and more
+        self.registry_file_filter: RegistryFileFilter = registry_file_filter
+
         self.repository: str = repository
         self.directory: str = directory
         if not self.repository:
@@ -93,6 +165,13 @@ class CodeReviewAnalysis:
         # that are only present in registry
         self.phantom_lines: dict[str, dict[str, LineDelta]] = {}
 
+        # changed files in the registry that are byte-identical to the repository
+        # in both the old and the new version, no phantom lines to look for
+        self.identical_files: set[str] = set()
+
+        # registry files left out of line counting by the pre-filter
+        self.summarized_files: dict[str, SummarizedFile] = {}
+
         # code to commit mapping
         self.added_loc_to_commit_map: dict[str, dict[str, list(str)]] = {}
         self.removed_loc_to_commit_map: dict[str, dict[str, list(str)]] = {}
@@ -100,12 +179,24 @@ class CodeReviewAnalysis:
         # commit to review map
         self.commit_review_info: dict[str, CommitReviewInfo] = {}
 
+        # git process usage of the repository side, see GitSession.stats
+        self.git_stats: dict[str, int] = {}
+
         self.stats: DepdiveStats = None
 
         self.run_analysis()
 
     def _locate_repository(self):
-        self.repository, self.directory = get_repository_url_and_subdir(self.ecosystem, self.package)
+        self.repository, self.directory = self.repository_resolution.resolve(
+            self.ecosystem, self.package, refresh=self.refresh_repository
+        )
+
+    def _get_extra_repository_paths(self, registry_diff):
+        """repository paths outside the package directory that registry files may map to"""
+        # see the LICENSE hack in get_repo_path_from_registry_path
+        if "LICENSE" in registry_diff.new_version_filelist or "LICENSE" in registry_diff.diff:
+            return ["LICENSE"]
+        return []
 
     def get_repo_path_from_registry_path(self, filepath, repository_diff):
 
@@ -118,12 +209,18 @@ class CodeReviewAnalysis:
                 return filepath
 
         # check if symlink
-        fullpath = os.path.join(repository_diff.repo_path, repo_f)
-        if os.path.islink(fullpath):
-            target_link = os.path.realpath(os.path.join(fullpath, os.readlink(fullpath)))
-            repo_f = os.path.relpath(target_link, os.path.realpath(repository_diff.repo_path))
+        return resolve_symlink(repository_diff.repo_path, repo_f, repository_diff.new_version_commit)
 
-        return repo_f
+    def _materialize_submodules(self, registry_diff, repository_diff):
+        """fetch only the submodules that files changed in the registry map into"""
+        for f in registry_diff.diff.keys():
+            for registry_f in [f, registry_diff.diff[f].source_file, registry_diff.diff[f].target_file]:
+                if not registry_f:
+                    continue
+                repo_f = self.get_repo_path_from_registry_path(registry_f, repository_diff)
+                submodule_path = repository_diff.get_submodule_path(repo_f)
+                if submodule_path:
+                    repository_diff.materialize_submodule(submodule_path)
 
     def _process_phantom_files(self, registry_diff, repository_diff):
         """
@@ -135,6 +232,10 @@ class CodeReviewAnalysis:
         """
         for f in registry_diff.new_version_filelist:
             repo_f = self.get_repo_path_from_registry_path(f, repository_diff)
+            submodule_path = repository_diff.get_submodule_path(repo_f)
+            if submodule_path and submodule_path not in repository_diff.materialized_submodules:
+                # unchanged file within a submodule we did not fetch, taken to be present
+                continue
             if repo_f not in repository_diff.new_version_filelist:
                 self.phantom_files.add(f)
 
@@ -160,26 +261,48 @@ class CodeReviewAnalysis:
 
     def _get_registry_file_line_counter(self, f):
         lc = {}
-        for l in [process_whitespace(l) for l in f.added_lines]:
+        for l in [self.lines(l) for l in f.added_lines]:
             lc[l] = lc.get(l, LineDelta())
             lc[l].additions += 1
 
-        for l in [process_whitespace(l) for l in f.removed_lines]:
+        for l in [self.lines(l) for l in f.removed_lines]:
             lc[l] = lc.get(l, LineDelta())
             lc[l].deletions += 1
 
         return lc
 
+    def _is_identical_to_repository(self, f, registry_diff, repository_diff):
+        """whether the registry file has the same git blob id as the repository file in both versions"""
+        if registry_diff.old_version_blobs is None or registry_diff.new_version_blobs is None:
+            return False
+
+        registry_file_diff = registry_diff.diff[f]
+        if not registry_file_diff.target_file:
+            return False
+        repo_f = self.get_repo_path_from_registry_path(f, repository_diff)
+        new_blobs = get_repository_blob_ids(repository_diff.repo_path, repository_diff.new_version_commit)
+        if registry_diff.new_version_blobs.get(f) != new_blobs.get(repo_f, False):
+            return False
+
+        old_blobs = get_repository_blob_ids(repository_diff.repo_path, repository_diff.old_version_commit)
+        if not registry_file_diff.source_file:
+            # newly added to the registry, and to the repository as well
+            return repo_f not in old_blobs
+        old_repo_f = self.get_repo_path_from_registry_path(registry_file_diff.source_file, repository_diff)
+        return registry_diff.old_version_blobs.get(registry_file_diff.source_file) == old_blobs.get(old_repo_f, False)
+
     def _proccess_phantom_lines(self, registry_diff, repository_diff):
         new_version_repo_filelist = get_repository_file_list(
             repository_diff.repo_path, repository_diff.new_version_commit
         )
 
-        repo = Repo(repository_diff.repo_path)
-        head = repo.head.object.hexsha
-        repo.git.checkout(repository_diff.new_version_commit, force=True)
-
+        # the new version commit may have moved since the last pass
+        self.identical_files = set()
         for f in registry_diff.diff.keys():
+            if self._is_identical_to_repository(f, registry_diff, repository_diff):
+                self.identical_files.add(f)
+                continue
+
             registry_file_diff = self._get_registry_file_line_counter(registry_diff.diff[f])
             self.registry_diff[f] = registry_file_diff
 
@@ -210,19 +333,16 @@ class CodeReviewAnalysis:
             phantom_lines = self._get_phantom_lines_in_a_file(registry_file_diff, single_diff)
             if phantom_lines:
                 # try looking beyond the initial commit boundary
-                repo.git.checkout(head, force=True)
                 has_commit_boundary_changed = repository_diff.traverse_beyond_new_version_commit(
                     repo_f,
                     phantom_lines.copy(),
                 )
                 if has_commit_boundary_changed:
                     return False
-                repo.git.checkout(repository_diff.new_version_commit, force=True)
 
             if phantom_lines:
                 self.phantom_lines[f] = phantom_lines
 
-        repo.git.checkout(head, force=True)
         return True
 
     def _filter_out_phantom_files(self, registry_diff):
@@ -238,7 +358,17 @@ class CodeReviewAnalysis:
         if not self.repository:
             self._locate_repository()
 
-        registry_diff = get_registry_version_diff(self.ecosystem, self.package, self.old_version, self.new_version)
+        registry_diff = get_registry_version_diff(
+            self.ecosystem,
+            self.package,
+            self.old_version,
+            self.new_version,
+            cache_dir=self.cache_dir,
+            registry_mirror=self.registry_mirror,
+            streaming=self.streaming_registry_diff,
+            file_filter=self.registry_file_filter,
+        )
+        self.summarized_files = registry_diff.summarized_files
         repository_diff = RepositoryDiff(
             self.ecosystem,
             self.package,
@@ -247,6 +377,11 @@ class CodeReviewAnalysis:
             self.new_version,
             old_version_commit=registry_diff.old_version_git_sha,
             new_version_commit=registry_diff.new_version_git_sha,
+            cache_dir=self.cache_dir,
+            line_table=self.lines,
+            diff_memory_files=self.diff_memory_files,
+            scoped=self.scoped,
+            extra_paths=self._get_extra_repository_paths(registry_diff),
         )
 
         # checking package directory
@@ -257,6 +392,7 @@ class CodeReviewAnalysis:
         if repository_diff.new_version_subdir != self.directory:
             self.directory = repository_diff.new_version_subdir
 
+        self._materialize_submodules(registry_diff, repository_diff)
         self._process_phantom_files(registry_diff, repository_diff)
         self._filter_out_phantom_files(registry_diff)
 
@@ -282,8 +418,9 @@ class CodeReviewAnalysis:
                         if commit not in self.commit_review_info:
                             self.commit_review_info[commit] = CommitReviewInfo(self.repository, commit)
 
-        self.stats = self.get_stats()
         repository_diff.cleanup()
+        self.git_stats = repository_diff.git_stats or {}
+        self.stats = self.get_stats()
 
     def map_commit_to_added_lines(self, repository_diff, registry_diff):
         def map_submdule_to_added_lines(f, repo_f):
@@ -295,7 +432,7 @@ class CodeReviewAnalysis:
                     assert commits, "no commit found for submodule {}".format(path)
                     commit = commits[-1]
 
-                    added_lines = [process_whitespace(l) for l in registry_diff.diff[f].added_lines]
+                    added_lines = [self.lines(l) for l in registry_diff.diff[f].added_lines]
                     added_lines = [l for l in added_lines if l]
                     self.added_loc_to_commit_map[f] = {commit: added_lines}
                     return True
@@ -306,7 +443,8 @@ class CodeReviewAnalysis:
             if registry_diff.diff[f].target_file and registry_diff.diff[f].added_lines:
                 files_with_added_lines.add(registry_diff.diff[f].target_file)
 
-        for f in files_with_added_lines:
+        files_to_blame = []
+        for f in sorted(files_with_added_lines):
             repo_f = self.get_repo_path_from_registry_path(f, repository_diff)
 
             # ignore files with only phantom line changes
@@ -317,13 +455,17 @@ class CodeReviewAnalysis:
             if map_submdule_to_added_lines(f, repo_f):
                 continue
 
-            c2c = repository_diff.git_blame(repo_f, repository_diff.new_version_commit)
+            files_to_blame.append((f, repo_f))
 
+        blames = repository_diff.git_blame_files(
+            [repo_f for f, repo_f in files_to_blame], repository_diff.new_version_commit, workers=self.blame_workers
+        )
+        for (f, repo_f), c2c in zip(files_to_blame, blames):
             for commit in list(c2c.keys()):
                 if commit not in repository_diff.diff[repo_f].commits:
                     c2c.pop(commit)
                 else:
-                    c2c[commit] = [process_whitespace(l) for l in c2c[commit]]
+                    c2c[commit] = [self.lines(l) for l in c2c[commit]]
                     c2c[commit] = [l for l in c2c[commit] if l]
 
             self.added_loc_to_commit_map[f] = c2c
@@ -338,7 +480,7 @@ class CodeReviewAnalysis:
                     assert commits, "no commit found for submodule {}".format(path)
                     commit = commits[0]
 
-                    removed_lines = [process_whitespace(l) for l in registry_diff.diff[f].removed_lines]
+                    removed_lines = [self.lines(l) for l in registry_diff.diff[f].removed_lines]
                     removed_lines = [l for l in removed_lines if l]
                     self.removed_loc_to_commit_map[f] = {commit: removed_lines}
                     return True
@@ -353,11 +495,8 @@ class CodeReviewAnalysis:
             if registry_diff.diff[f].source_file and registry_diff.diff[f].removed_lines:
                 files_with_removed_lines.add(registry_diff.diff[f].source_file)
 
-        repo = Repo(repository_diff.repo_path)
-        head = repo.head.object.hexsha
-        repo.git.checkout(repository_diff.common_ancestor_commit_new_and_old_version, force=True)
-
-        for f in files_with_removed_lines:
+        files_to_blame = []
+        for f in sorted(files_with_removed_lines):
             repo_f = self.get_repo_path_from_registry_path(f, repository_diff)
 
             # file may not be in version diff in repo
@@ -370,18 +509,23 @@ class CodeReviewAnalysis:
             if map_submdule_to_removed_lines(f, repo_f):
                 continue
 
-            c2c = repository_diff.git_blame_delete(
-                repo_f, repository_diff.common_ancestor_commit_new_and_old_version, repository_diff.new_version_commit
-            )
+            files_to_blame.append((f, repo_f))
+
+        blames = repository_diff.git_blame_delete_files(
+            [repo_f for f, repo_f in files_to_blame],
+            repository_diff.common_ancestor_commit_new_and_old_version,
+            repository_diff.new_version_commit,
+            workers=self.blame_workers,
+        )
+        for (f, repo_f), c2c in zip(files_to_blame, blames):
             for commit in list(c2c.keys()):
                 if commit not in repository_diff.commits:
                     c2c.pop(commit)
                 else:
-                    c2c[commit] = [process_whitespace(l) for l in c2c[commit]]
+                    # lines of git_blame_delete() are already identified
                     c2c[commit] = [l for l in c2c[commit] if l]
 
             self.removed_loc_to_commit_map[f] = c2c
-        repo.git.checkout(head, force=True)
 
     def get_stats(self):
         added_reviewed_lines = added_non_reviewed_lines = 0
@@ -430,4 +574,8 @@ class CodeReviewAnalysis:
             phantom_files,
             files_with_phantom_lines,
             phantom_lines,
+            identical_files=len(self.identical_files),
+            summarized_files=len(self.summarized_files),
+            git_command_spawns=self.git_stats.get("command_spawns", 0),
+            saved_git_spawns=self.git_stats.get("saved_spawns", 0),
         )
@@ -0,0 +1,165 @@
+import os
+from depdive.git_session import GitObjectNotFound, get_git_session
+
+# %H, %P, author, author time, committer, committer time
+COMMIT_GRAPH_FORMAT = "%H%x1f%P%x1f%an <%ae>%x1f%at%x1f%cn <%ce>%x1f%ct"
+
+# bytearray of 0/1 flags -> '0'/'1' digits
+_BIT_DIGITS = bytes.maketrans(b"\x00\x01", b"01")
+
+
+class UnknownCommit(Exception):
+    def __init__(self, rev):
+        self.rev = rev
+
+    def message(self):
+        return "commit not in commit graph: {}".format(self.rev)
+
+
+class CommitGraph:
+    """
+    parents, dates and identities of every commit reachable from
+    the branches, tags and HEAD of a repository, read by a single git log.
+
+    commits are indexed in date order, i.e., children always come before their parents.
+    ancestry is kept as bitsets over that index, computed on first use,
+    so range and ancestor queries are answered without running git.
+    queries are safe to run from several threads
+    """
+
+    # memory held by cached ancestor bitsets, each of them a bit per commit
+    MAX_ANCESTOR_CACHE_BYTES = 64 << 20
+
+    def __init__(self, repo_path):
+        self.repo_path = repo_path
+
+        self.commits: list[str] = []
+        self.index: dict[str, int] = {}
+        self.parents: list[tuple] = []
+        self.authors: list[str] = []
+        self.author_times: list[int] = []
+        self.committers: list[str] = []
+        self.committer_times: list[int] = []
+
+        self._ancestors: dict[int, int] = {}
+
+        self._build()
+        # bits of the bitset, plus the overhead of an int and its dict slot
+        entry_bytes = len(self.commits) // 8 + 64
+        self.max_cached_ancestors = max(1, self.MAX_ANCESTOR_CACHE_BYTES // entry_bytes)
+
+    def _build(self):
+        output = get_git_session(self.repo_path).run(
+            "log", "--branches", "--tags", "--remotes", "HEAD", "--date-order", "--format=" + COMMIT_GRAPH_FORMAT
+        )
+        identities = {}
+        parent_shas = []
+        for line in output.split("\n"):
+            if not line:
+                continue
+            sha, parents, author, author_time, committer, committer_time = line.split("\x1f")
+            self.index[sha] = len(self.commits)
+            self.commits.append(sha)
+            parent_shas.append(parents.split())
+            self.authors.append(identities.setdefault(author, author))
+            self.author_times.append(int(author_time))
+            self.committers.append(identities.setdefault(committer, committer))
+            self.committer_times.append(int(committer_time))
+
+        # parents missing from the graph, e.g., in shallow clones, are left out
+        self.parents = [tuple(self.index[p] for p in parents if p in self.index) for parents in parent_shas]
+
+    def __len__(self):
+        return len(self.commits)
+
+    def __contains__(self, rev):
+        try:
+            self.lookup(rev)
+            return True
+        except UnknownCommit:
+            return False
+
+    def lookup(self, rev):
+        """index of the given commit, raises UnknownCommit if it is not in the graph"""
+        if rev in self.index:
+            return self.index[rev]
+        try:
+            sha = get_git_session(self.repo_path).resolve("{}^{{commit}}".format(rev))
+        except GitObjectNotFound:
+            raise UnknownCommit(rev)
+        if sha not in self.index:
+            # e.g., a dangling commit not reachable from any ref
+            raise UnknownCommit(rev)
+        return self.index[sha]
+
+    def ancestors(self, i):
+        """bitset of the commit at index i and all of its ancestors"""
+        bits = self._ancestors.get(i)
+        if bits is not None:
+            return bits
+
+        visited = bytearray(len(self.commits))
+        visited[i] = 1
+        known = 0  # union of already computed ancestor bitsets we ran into
+        stack = [i]
+        while stack:
+            for p in self.parents[stack.pop()]:
+                if visited[p]:
+                    continue
+                visited[p] = 1
+                parent_bits = self._ancestors.get(p)
+                if parent_bits is not None:
+                    known |= parent_bits
+                else:
+                    stack.append(p)
+        bits = int(visited.translate(_BIT_DIGITS)[::-1], 2) | known
+
+        if len(self._ancestors) >= self.max_cached_ancestors:
+            self._ancestors.clear()
+        self._ancestors[i] = bits
+        return bits
+
+    def _commits_of(self, bits):
+        """commits in the bitset, newest first"""
+        digits = bin(bits)[:1:-1]
+        commits = []
+        i = digits.find("1")
+        while i != -1:
+            commits.append(self.commits[i])
+            i = digits.find("1", i + 1)
+        return commits
+
+    def range(self, commit_a, commit_b="HEAD"):
+        """commits reachable from commit_b but not from commit_a, i.e., commit_a..commit_b, newest first"""
+        a, b = self.lookup(commit_a), self.lookup(commit_b or "HEAD")
+        return self._commits_of(self.ancestors(b) & ~self.ancestors(a))
+
+    def is_ancestor(self, commit_a, commit_b):
+        """whether commit_a is reachable from commit_b"""
+        a, b = self.lookup(commit_a), self.lookup(commit_b)
+        return bool(self.ancestors(b) >> a & 1)
+
+    def first_parent(self, commit):
+        parents = self.parents[self.lookup(commit)]
+        return self.commits[parents[0]] if parents else None
+
+    def committer_time(self, commit):
+        return self.committer_times[self.lookup(commit)]
+
+    def sort_by_commit_date(self, commits):
+        return sorted(commits, key=self.committer_time)
+
+
+# one graph per repository path
+_commit_graphs: dict[str, CommitGraph] = {}
+
+
+def get_commit_graph(repo_path):
+    key = os.path.realpath(repo_path)
+    if key not in _commit_graphs:
+        _commit_graphs[key] = CommitGraph(repo_path)
+    return _commit_graphs[key]
+
+
+def clear_commit_graph(repo_path):
+    _commit_graphs.pop(os.path.realpath(repo_path), None)
@@ -1,7 +1,10 @@
+import hashlib
 import re
 
 
 class LineDelta:
+    __slots__ = ("additions", "deletions")
+
     def __init__(self, additions=0, deletions=0):
         self.additions = additions
         self.deletions = deletions
@@ -21,9 +24,45 @@ class LineDelta:
         return self.additions == 0 and self.deletions == 0
 
 
+WHITESPACE_RUN = re.compile(" {2,}")
+
+
+def git_blob_id(content):
+    """object id of the content as a git blob, to compare files with repository trees without reading them"""
+    h = hashlib.sha1(b"blob %d\0" % len(content))
+    h.update(content)
+    return h.hexdigest()
+
+
 def process_whitespace(l):
     # git diff can mess up with whitespaces
     # therefore compressing whitespace for the sake of comparison
-    l = re.sub(" +", " ", l)
-    l = l.strip()
+    if "  " in l:
+        l = WHITESPACE_RUN.sub(" ", l)
     return l.strip()
+
+
+class LineTable:
+    """
+    identities of normalized lines, shared by the registry diff, commit diffs,
+    file reads and blame output of an analysis.
+    by default a line is its normalized text, kept once however often it shows up.
+    with hashed, it is a 64-bit hash of the text instead, the text itself is not kept
+    """
+
+    def __init__(self, hashed=False):
+        self.hashed: bool = hashed
+        self._lines: dict[str, str] = {}
+
+    def identity(self, line):
+        """identity of an already normalized line, empty lines stay empty"""
+        if not line:
+            return line
+        if self.hashed:
+            digest = hashlib.blake2b(line.encode("utf-8", "surrogateescape"), digest_size=8).digest()
+            return int.from_bytes(digest, "big")
+        return self._lines.setdefault(line, line)
+
+    def __call__(self, line):
+        """identity of a raw line"""
+        return self.identity(process_whitespace(line))
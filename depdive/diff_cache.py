@@ -0,0 +1,155 @@
+import hashlib
+import marshal
+import os
+import tempfile
+import zlib
+from collections import OrderedDict
+from os.path import join
+from depdive.repository_cache import normalize_repository_url
+
+DIFF_CACHE_DIR = "diffs"
+DIFF_CACHE_FORMAT_VERSION = 2
+DEFAULT_MAX_DISK_BYTES = 1 << 30
+DEFAULT_MAX_MEMORY_ENTRIES = 1024
+
+
+class CommitDiffCache:
+    """
+    parsed per-commit diffs, keyed by (repository, commit sha, reverse).
+    a commit's diff never changes, so entries never go stale.
+    diffs limited to pathspecs are kept apart from full ones, per scope
+
+    entries are kept in memory for the current analysis,
+    and on disk under cache_dir as zlib compressed marshal records,
+    evicted least recently used first once the cache grows beyond max_disk_bytes
+    """
+
+    def __init__(
+        self,
+        repository,
+        cache_dir=None,
+        max_disk_bytes=DEFAULT_MAX_DISK_BYTES,
+        max_memory_entries=DEFAULT_MAX_MEMORY_ENTRIES,
+        scope=None,
+    ):
+        self.max_disk_bytes = max_disk_bytes
+        self.max_memory_entries = max_memory_entries
+        self._memory = OrderedDict()
+
+        self.root = None
+        self.path = None
+        if cache_dir:
+            self.root = join(cache_dir, DIFF_CACHE_DIR)
+            key = normalize_repository_url(repository)
+            if scope:
+                key += "\0" + "\0".join(sorted(scope))
+            repository_key = hashlib.sha256(key.encode()).hexdigest()[:16]
+            self.path = join(self.root, repository_key)
+            os.makedirs(self.path, exist_ok=True)
+        self._disk_bytes = None  # computed on first write
+
+        self.hits = 0
+        self.misses = 0
+
+    def _entry_path(self, commit, reverse):
+        return join(self.path, commit[:2], "{}{}".format(commit, ".r" if reverse else ""))
+
+    def contains(self, commit, reverse=False):
+        if (commit, reverse) in self._memory:
+            return True
+        return bool(self.path) and os.path.exists(self._entry_path(commit, reverse))
+
+    def get(self, commit, reverse=False):
+        key = (commit, reverse)
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            self.hits += 1
+            return self._memory[key]
+
+        records = self._read(commit, reverse) if self.path else None
+        if records is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self._remember(key, records)
+        return records
+
+    def put(self, commit, records, reverse=False, persist=True):
+        self._remember((commit, reverse), records)
+        if self.path and persist:
+            self._write(commit, reverse, records)
+
+    def discard(self, commit, reverse=False):
+        self._memory.pop((commit, reverse), None)
+        if self.path:
+            try:
+                os.remove(self._entry_path(commit, reverse))
+            except FileNotFoundError:
+                pass
+
+    def _remember(self, key, records):
+        self._memory[key] = records
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+
+    def _read(self, commit, reverse):
+        entry = self._entry_path(commit, reverse)
+        try:
+            with open(entry, "rb") as f:
+                version, records = marshal.loads(zlib.decompress(f.read()))
+        except:
+            # not cached, or unreadable entry
+            return None
+        if version != DIFF_CACHE_FORMAT_VERSION:
+            return None
+        # mark as recently used
+        try:
+            os.utime(entry)
+        except FileNotFoundError:
+            # evicted by another process since, the records read are still good
+            pass
+        return records
+
+    def _write(self, commit, reverse, records):
+        entry = self._entry_path(commit, reverse)
+        os.makedirs(os.path.dirname(entry), exist_ok=True)
+        data = zlib.compress(marshal.dumps((DIFF_CACHE_FORMAT_VERSION, records)))
+
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(entry))
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(temp_path, entry)
+
+        if self._disk_bytes is None:
+            self._disk_bytes = sum(size for path, size, mtime in self._disk_entries())
+        else:
+            self._disk_bytes += len(data)
+        if self._disk_bytes > self.max_disk_bytes:
+            self.evict()
+
+    def _disk_entries(self):
+        for root, dirs, files in os.walk(self.root):
+            for file in files:
+                path = join(root, file)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    # evicted by another process
+                    continue
+                yield path, stat.st_size, stat.st_mtime
+
+    def evict(self, target_fraction=0.8):
+        """drop least recently used entries across all repositories until below target_fraction of the limit"""
+        entries = sorted(self._disk_entries(), key=lambda x: x[2])
+        total = sum(size for path, size, mtime in entries)
+        for path, size, mtime in entries:
+            if total <= self.max_disk_bytes * target_fraction:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+        self._disk_bytes = total
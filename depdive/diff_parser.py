@@ -0,0 +1,183 @@
+import re
+from depdive.common import process_whitespace
+
+# same header patterns as unidiff, so that paths come out the same
+GIT_DIFF_HEADERS = [
+    re.compile(r'^diff --git (?P<source>"?a/[^\t\n]+"?) (?P<target>"?b/[^\t\n]+"?)'),
+    re.compile(r"^diff --git (?P<source>.*://[^\t\n]+) (?P<target>.*://[^\t\n]+)"),
+    re.compile(r"^diff --git (?P<source>[^\t\n]+) (?P<target>[^\t\n]+)"),
+]
+HUNK_HEADER = re.compile(r"^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@")
+PATCH_FILE_PREFIX = re.compile(r"^[abciow12]/")
+DEV_NULL = "/dev/null"
+
+
+def process_patch_filepath(filepath):
+    filepath = filepath.removeprefix("a/")
+    filepath = filepath.removeprefix("b/")
+    if filepath == DEV_NULL:
+        filepath = None
+    return filepath
+
+
+class PatchedFile:
+    def __init__(self, source_file, target_file):
+        self.source_file = source_file
+        self.target_file = target_file
+        # normalized line -> count, in order of first appearance
+        self.additions = {}
+        self.deletions = {}
+
+    def is_rename(self):
+        return (
+            self.source_file != DEV_NULL
+            and self.target_file != DEV_NULL
+            and self.source_file[2:] != self.target_file[2:]
+        )
+
+    def path(self):
+        filepath = self.source_file
+        if filepath == DEV_NULL or (self.is_rename() and self.target_file != DEV_NULL):
+            filepath = self.target_file
+
+        quoted = filepath.startswith('"') and filepath.endswith('"')
+        if quoted:
+            filepath = filepath[1:-1]
+        if PATCH_FILE_PREFIX.match(filepath):
+            filepath = filepath[2:]
+        if quoted:
+            filepath = '"{}"'.format(filepath)
+        return filepath
+
+    def record(self):
+        changed_lines = {line: [0, count] for line, count in self.deletions.items()}
+        for line, count in self.additions.items():
+            changed_lines.setdefault(line, [0, 0])[0] += count
+        return (
+            self.path(),
+            process_patch_filepath(self.source_file),
+            process_patch_filepath(self.target_file),
+            self.is_rename(),
+            [(line, additions, deletions) for line, (additions, deletions) in changed_lines.items()],
+        )
+
+
+class DiffParser:
+    """
+    incremental parser of git's unified diff output, fed one line at a time.
+    keeps only the normalized line counters of each file instead of the patch,
+    and gives the same result as walking a unidiff PatchSet of the whole text
+    """
+
+    def __init__(self):
+        self.files: list[PatchedFile] = []
+        # whether a gitlink changed, the diff then depends on
+        # whether the submodule was available locally when diffing
+        self.moves_submodule = False
+
+        self._file = None
+        self._in_header = False  # between diff --git and the first hunk
+        self._source_left = self._target_left = 0  # lines left in the current hunk
+
+    def feed(self, line):
+        """line of the diff, without the line break"""
+        if self._source_left > 0 or self._target_left > 0:
+            self._feed_hunk_line(line)
+        elif line.startswith("diff --git ") and self._start_git_file(line):
+            return
+        elif line.startswith("@@ ") and self._start_hunk(line):
+            return
+        elif self._in_header:
+            self._feed_git_header_line(line)
+        else:
+            self._feed_header_line(line)
+
+    def _start_git_file(self, line):
+        for header in GIT_DIFF_HEADERS:
+            m = header.match(line)
+            if m:
+                self._file = PatchedFile(m.group("source"), m.group("target"))
+                self.files.append(self._file)
+                self._in_header = True
+                return True
+        return False
+
+    def _start_hunk(self, line):
+        m = HUNK_HEADER.match(line)
+        if not m or not self._file:
+            return False
+        self._in_header = False
+        self._source_left = int(m.group(2)) if m.group(2) is not None else 1
+        self._target_left = int(m.group(4)) if m.group(4) is not None else 1
+        return True
+
+    def _feed_git_header_line(self, line):
+        """extended header line, between diff --git and the first hunk"""
+        if line.startswith("Submodule "):
+            self.moves_submodule = True
+        elif line.startswith("new file mode "):
+            self._file.source_file = DEV_NULL
+        elif line.startswith("deleted file mode "):
+            self._file.target_file = DEV_NULL
+        elif line.startswith("Binary files ") or line == "GIT binary patch":
+            self._file, self._in_header = None, False
+
+    def _feed_header_line(self, line):
+        """line outside of a git header or hunk"""
+        if line.startswith("Submodule "):
+            self.moves_submodule = True
+            self._file = None
+        elif line.startswith("--- "):
+            # plain unified diff without a git header
+            self._file = PatchedFile(line[4:].split("\t")[0], None)
+        elif line.startswith("+++ ") and self._file and self._file.target_file is None:
+            self._file.target_file = line[4:].split("\t")[0]
+            self.files.append(self._file)
+
+    def _feed_hunk_line(self, line):
+        line_type = line[:1]
+        if line_type == "+":
+            self._target_left -= 1
+            counter = self._file.additions
+        elif line_type == "-":
+            self._source_left -= 1
+            counter = self._file.deletions
+        elif line_type == "\\":
+            # no newline at end of file
+            return
+        else:
+            # context, possibly an empty line
+            self._source_left -= 1
+            self._target_left -= 1
+            return
+
+        line = process_whitespace(line[1:].strip())
+        if line:
+            counter[line] = counter.get(line, 0) + 1
+
+    def records(self):
+        """
+        changed files as (path, source file, target file, is rename, [(line, additions, deletions)]),
+        see repository_diff.file_diffs_from_records
+        """
+        records = {}
+        for f in self.files:
+            record = f.record()
+            # the last diff of a path wins
+            records[record[0]] = record
+        return list(records.values())
+
+
+def parse_diff(uni_diff_text):
+    parser = DiffParser()
+    for line in uni_diff_text.split("\n"):
+        parser.feed(line)
+    return parser
+
+
+def parse_diff_stream(stream):
+    """parse_diff() over the binary lines of a stream, such as the stdout of a git process"""
+    parser = DiffParser()
+    for line in stream:
+        parser.feed(line.decode("utf-8", "surrogateescape").removesuffix("\n"))
+    return parser
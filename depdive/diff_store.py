@@ -0,0 +1,135 @@
+import marshal
+import sqlite3
+import tempfile
+import threading
+import zlib
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from os.path import join
+
+DEFAULT_MAX_MEMORY_FILES = 1024
+
+
+class FileChangeStore(MutableMapping):
+    """
+    path -> file change data, i.e., a dict as RepositoryDiff.diff and single_diff,
+    kept in a SQLite database on disk with at most max_memory_files entries in memory.
+
+    entries are converted to and from marshal-able records with encode and decode.
+    an entry stays in memory, and is changed in place by callers, until it is the least
+    recently used one, it is then written back to disk and read in again on the next access.
+    so do not hold on to an entry across accesses to many other paths of the store.
+
+    a path can be made an alias of another one, it then shares that path's entry,
+    and the same object is returned for both, whether the entry was spilled or not
+    """
+
+    def __init__(self, encode, decode, max_memory_files=DEFAULT_MAX_MEMORY_FILES):
+        self.encode = encode
+        self.decode = decode
+        self.max_memory_files = max(max_memory_files, 2)
+
+        # every path of the store, in insertion order
+        self._paths: dict[str, None] = {}
+        # alias path -> path whose entry it shares
+        self._aliases: dict[str, str] = {}
+        self._memory = OrderedDict()
+        self._lock = threading.RLock()
+
+        self._temp_dir = tempfile.TemporaryDirectory()
+        # entries are read from the blame worker threads as well
+        self._db = sqlite3.connect(join(self._temp_dir.name, "files.sqlite"), check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode = OFF")
+        self._db.execute("PRAGMA synchronous = OFF")
+        self._db.execute("CREATE TABLE files (path TEXT PRIMARY KEY, data BLOB)")
+
+        self.reads = 0
+        self.writes = 0
+
+    def __getitem__(self, path):
+        with self._lock:
+            if path not in self._paths:
+                raise KeyError(path)
+            return self._load(self._root(path))
+
+    def __setitem__(self, path, f):
+        with self._lock:
+            root = self._root(path)
+            if root != path and self._memory.get(root) is f:
+                # the shared entry set again through an alias
+                self._memory.move_to_end(root)
+                return
+            self._aliases.pop(path, None)
+            self._paths[path] = None
+            self._remember(path, f)
+
+    def __delitem__(self, path):
+        with self._lock:
+            del self._paths[path]
+            if self._aliases.pop(path, None) is not None:
+                return
+            aliases = [alias for alias, root in self._aliases.items() if root == path]
+            f = self._load(path) if aliases else None
+            self._memory.pop(path, None)
+            self._db.execute("DELETE FROM files WHERE path = ?", (path,))
+            if aliases:
+                # the entry lives on under the first of its aliases
+                del self._aliases[aliases[0]]
+                for alias in aliases[1:]:
+                    self._aliases[alias] = aliases[0]
+                self._remember(aliases[0], f)
+
+    def alias(self, path, root):
+        """path shares the entry of root from now on, an entry of its own is dropped"""
+        with self._lock:
+            root = self._root(root)
+            if root == path:
+                return
+            self._aliases.pop(path, None)
+            self._memory.pop(path, None)
+            self._db.execute("DELETE FROM files WHERE path = ?", (path,))
+            self._paths[path] = None
+            self._aliases[path] = root
+
+    def __contains__(self, path):
+        return path in self._paths
+
+    def __iter__(self):
+        return iter(self._paths)
+
+    def __len__(self):
+        return len(self._paths)
+
+    def _root(self, path):
+        while path in self._aliases:
+            path = self._aliases[path]
+        return path
+
+    def _load(self, path):
+        if path in self._memory:
+            self._memory.move_to_end(path)
+            return self._memory[path]
+        (data,) = self._db.execute("SELECT data FROM files WHERE path = ?", (path,)).fetchone()
+        self.reads += 1
+        f = self.decode(marshal.loads(zlib.decompress(data)))
+        self._remember(path, f)
+        return f
+
+    def _remember(self, path, f):
+        self._memory[path] = f
+        self._memory.move_to_end(path)
+        while len(self._memory) > self.max_memory_files:
+            self._spill(*self._memory.popitem(last=False))
+
+    def _spill(self, path, f):
+        data = zlib.compress(marshal.dumps(self.encode(f)), 1)
+        self._db.execute("INSERT OR REPLACE INTO files (path, data) VALUES (?, ?)", (path, data))
+        self.writes += 1
+
+    def close(self):
+        with self._lock:
+            self._memory.clear()
+            self._paths.clear()
+            self._aliases.clear()
+            self._db.close()
+            self._temp_dir.cleanup()
@@ -0,0 +1,218 @@
+import atexit
+import os
+import subprocess
+import threading
+from git import Repo
+
+
+class GitObjectNotFound(Exception):
+    def __init__(self, rev):
+        self.rev = rev
+
+    def message(self):
+        return "object not found: {}".format(self.rev)
+
+
+class CommitInfo:
+    def __init__(self, hexsha):
+        self.hexsha: str = hexsha
+        self.tree: str = None
+        self.parents: list[str] = []
+        self.author: str = None
+        self.author_time: int = None
+        self.committer: str = None
+        self.committer_time: int = None
+
+
+def parse_identity(value):
+    """splits 'Name <email> <unix time> <tz>' into identity and time"""
+    identity, timestamp, tz = value.rsplit(" ", 2)
+    return identity, int(timestamp)
+
+
+def parse_commit(hexsha, data):
+    commit = CommitInfo(hexsha)
+    for line in data.decode("utf-8", "surrogateescape").split("\n"):
+        if not line:
+            # end of headers
+            break
+        if line.startswith(" "):
+            # continuation of a multi-line header, e.g., gpgsig
+            continue
+        key, value = line.split(" ", 1)
+        if key == "tree":
+            commit.tree = value
+        elif key == "parent":
+            commit.parents.append(value)
+        elif key == "author":
+            commit.author, commit.author_time = parse_identity(value)
+        elif key == "committer":
+            commit.committer, commit.committer_time = parse_identity(value)
+    return commit
+
+
+def parse_tree(data):
+    """maps entry name to (mode, object id) from a raw tree object"""
+    entries = {}
+    i = 0
+    while i < len(data):
+        space = data.index(b" ", i)
+        nul = data.index(b"\0", space)
+        mode = data[i:space].decode()
+        name = data[space + 1 : nul].decode("utf-8", "surrogateescape")
+        entries[name] = (mode.zfill(6), data[nul + 1 : nul + 21].hex())
+        i = nul + 21
+    return entries
+
+
+class GitSession:
+    """
+    long-lived git processes for one repository.
+    object, commit and tree lookups are served over
+    persistent cat-file --batch / --batch-check processes
+    instead of spawning git for each of them
+    """
+
+    MAX_CACHED_TREES = 4096
+
+    def __init__(self, repo_path):
+        self.repo_path = repo_path
+        self.repo = Repo(repo_path)
+
+        self._batch = None
+        self._batch_check = None
+        self._lock = threading.Lock()
+
+        self._commits: dict[str, CommitInfo] = {}
+        self._trees: dict[str, dict] = {}
+
+        # bookkeeping to report process spawns
+        self.persistent_spawns = 0  # cat-file processes started
+        self.command_spawns = 0  # one-off git commands
+        self.lookups = 0  # lookups served by the persistent processes
+
+    def _start(self, option):
+        self.persistent_spawns += 1
+        return subprocess.Popen(
+            ["git", "cat-file", option],
+            cwd=self.repo_path,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+        )
+
+    def _request(self, process, rev):
+        process.stdin.write("{}\n".format(rev).encode())
+        process.stdin.flush()
+        header = process.stdout.readline().decode().split()
+        if len(header) != 3:
+            # <rev> missing or <rev> ambiguous
+            raise GitObjectNotFound(rev)
+        return header
+
+    def object_info(self, rev):
+        """returns (object id, type, size) of the given revision"""
+        with self._lock:
+            if not self._batch_check:
+                self._batch_check = self._start("--batch-check")
+            self.lookups += 1
+            object_id, object_type, size = self._request(self._batch_check, rev)
+        return object_id, object_type, int(size)
+
+    def read_object(self, rev):
+        """returns (object id, type, content) of the given revision"""
+        with self._lock:
+            if not self._batch:
+                self._batch = self._start("--batch")
+            self.lookups += 1
+            object_id, object_type, size = self._request(self._batch, rev)
+            data = self._batch.stdout.read(int(size))
+            self._batch.stdout.read(1)  # trailing newline
+        return object_id, object_type, data
+
+    def exists(self, rev, object_type=None):
+        try:
+            object_id, found_type, size = self.object_info(rev)
+        except GitObjectNotFound:
+            return False
+        return not object_type or found_type == object_type
+
+    def resolve(self, rev):
+        return self.object_info(rev)[0]
+
+    def commit(self, rev):
+        """parsed commit, cached by commit sha as commits never change"""
+        if rev in self._commits:
+            return self._commits[rev]
+        object_id, object_type, data = self.read_object("{}^{{commit}}".format(rev))
+        if object_id not in self._commits:
+            self._commits[object_id] = parse_commit(object_id, data)
+        return self._commits[object_id]
+
+    def tree(self, object_id):
+        if object_id not in self._trees:
+            if len(self._trees) >= self.MAX_CACHED_TREES:
+                self._trees.clear()
+            self._trees[object_id] = parse_tree(self.read_object(object_id)[2])
+        return self._trees[object_id]
+
+    def run(self, command, *args, git_options=None, **kwargs):
+        """one-off git command for anything that cannot be answered from the object database"""
+        self.command_spawns += 1
+        git = self.repo.git(**git_options) if git_options else self.repo.git
+        return getattr(git, command)(*args, **kwargs)
+
+    def blame(self, rev, filepath, **kwargs):
+        self.command_spawns += 1
+        return self.repo.blame(rev, filepath, **kwargs)
+
+    def saved_spawns(self):
+        # each lookup would have cost a git process on its own
+        return max(0, self.lookups - self.persistent_spawns)
+
+    def stats(self):
+        return {
+            "lookups": self.lookups,
+            "persistent_spawns": self.persistent_spawns,
+            "command_spawns": self.command_spawns,
+            "saved_spawns": self.saved_spawns(),
+        }
+
+    def close(self):
+        for process in [self._batch, self._batch_check]:
+            if process:
+                process.stdin.close()
+                process.wait()
+        self._batch = self._batch_check = None
+        self.repo.close()
+
+
+# one session per repository path
+_sessions: dict[str, GitSession] = {}
+
+
+def get_git_session(repo_path):
+    key = os.path.realpath(repo_path)
+    if key not in _sessions:
+        _sessions[key] = GitSession(repo_path)
+    return _sessions[key]
+
+
+def close_git_session(repo_path):
+    """
+    closes the session of the repository and of any submodule within it,
+    returns their summed up stats
+    """
+    repo_path = os.path.realpath(repo_path)
+    stats = None
+    for key in [k for k in _sessions.keys() if k == repo_path or k.startswith(repo_path + os.sep)]:
+        session = _sessions.pop(key)
+        session.close()
+        stats = {k: v + (stats or {}).get(k, 0) for k, v in session.stats().items()}
+    return stats
+
+
+@atexit.register
+def close_all_git_sessions():
+    for repo_path in list(_sessions.keys()):
+        close_git_session(repo_path)
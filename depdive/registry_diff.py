@@ -1,31 +1,748 @@
+import fcntl
+import fnmatch
+import hashlib
+import io
+import json
+import os
+import shutil
+import tarfile
+import tempfile
+from contextlib import contextmanager
+from os.path import join, relpath
+from zipfile import ZipFile
+import requests
+from git import Git, Repo
+from git.util import hex_to_bin
 from package_locator.common import CARGO, PYPI
-from version_differ.common import PIP
-from version_differ.version_differ import get_version_diff_stats
+from depdive.archive_diff import GEM_ARCHIVE, TAR_ARCHIVE, ZIP_ARCHIVE, ArchiveDiff, is_binary_content
+from depdive.common import git_blob_id
+from version_differ.common import COMPOSER, GO, MAVEN, NPM, NUGET, PIP, RUBYGEMS
+from version_differ.download import CARGO_TOML, CARGO_TOML_ORIG, get_egg_info_path, get_package_version_source_url
+from version_differ.version_differ import (
+    VersionDifferOutput,
+    get_diff_stats_from_git_diff,
+    get_git_sha_from_cargo_crate,
+    get_version_diff_stats,
+    get_version_diff_stats_registry_with_package_code,
+)
+
+REGISTRY_CACHE_DIR = "registry"
+REGISTRY_CACHE_FORMAT_VERSION = 2
+DEFAULT_MAX_REGISTRY_DISK_BYTES = 4 << 30
+
+MIRROR_ARTIFACT_EXTENSIONS = [".crate", ".tgz", ".tar.gz", ".gem", ".whl", ".zip"]
+
+# files the registry generates on publishing, left out of both the diff and the file list
+REGISTRY_GENERATED_FILES = {
+    CARGO: ["/.cargo_vcs_info.json", "/Cargo.lock"],
+}
+
+# lockfiles, minified bundles and source maps, kept in the file list but not line counted
+SUMMARIZED_FILES = ["*.min.js", "*.min.css", "*.map"]
+ECOSYSTEM_SUMMARIZED_FILES = {
+    COMPOSER: ["composer.lock"],
+    NPM: ["package-lock.json", "npm-shrinkwrap.json", "yarn.lock", "pnpm-lock.yaml"],
+    PIP: ["Pipfile.lock", "poetry.lock"],
+    RUBYGEMS: ["Gemfile.lock"],
+}
+
+DEFAULT_MAX_CHANGED_LINES = 20000
+DEFAULT_MAX_LINE_LENGTH = 2000
+
+# reasons a file is summarized rather than line counted
+GENERATED = "generated"
+SUMMARIZED = "summarized"
+BINARY = "binary"
+OVERSIZED = "oversized"
+
+# fixed identity and date, so that the same extracted tree always makes the same commit
+ARTIFACT_COMMIT_ENV = {
+    "GIT_AUTHOR_NAME": "depdive",
+    "GIT_AUTHOR_EMAIL": "depdive@localhost",
+    "GIT_AUTHOR_DATE": "1970-01-01T00:00:00Z",
+    "GIT_COMMITTER_NAME": "depdive",
+    "GIT_COMMITTER_EMAIL": "depdive@localhost",
+    "GIT_COMMITTER_DATE": "1970-01-01T00:00:00Z",
+}
 
 
 class VersionDifferError(Exception):
     pass
 
 
-def get_registry_version_diff(ecosystem, package, old, new):
+class SummarizedFile:
+    """a registry file left out of line counting, with why and how many lines changed"""
+
+    __slots__ = ("reason", "loc_added", "loc_removed")
+
+    def __init__(self, reason, loc_added=0, loc_removed=0):
+        self.reason = reason
+        self.loc_added = loc_added
+        self.loc_removed = loc_removed
+
+
+def match_path(path, pattern):
+    """gitignore-like, patterns with a slash match the path from the package root, others the file name"""
+    if "/" in pattern:
+        return fnmatch.fnmatchcase(path, pattern.lstrip("/"))
+    return fnmatch.fnmatchcase(path.rsplit("/", 1)[-1], pattern)
+
+
+class RegistryFileFilter:
+    """
+    pre-filter of registry files ahead of line counting and the phantom line check.
+
+    generated files are dropped from both the diff and the file list.
+    opt-in, summarized files, binary files, and files with more than max_changed_lines changed lines
+    or a changed line longer than max_line_length, e.g., minified bundles, are dropped from the diff only,
+    so that they are still checked for being phantom files, but their lines are not.
+    binary files are told from their content, with a NUL byte or not UTF-8, including those git leaves out of the diff.
+    every file left out is reported in the version diff's summarized_files, path -> SummarizedFile
+    """
+
+    def __init__(
+        self,
+        generated=(),
+        summarized=(),
+        binary=False,
+        max_changed_lines=None,
+        max_line_length=None,
+    ):
+        self.generated = list(generated)
+        self.summarized = list(summarized)
+        self.binary = binary
+        self.max_changed_lines = max_changed_lines
+        self.max_line_length = max_line_length
+
+    @classmethod
+    def for_ecosystem(cls, ecosystem, summarize=False, **kwargs):
+        """
+        the rules of the ecosystem, with any of the constructor's arguments overridden,
+        by default only the registry's generated files are left out,
+        if summarize, lockfiles, minified bundles, binary and oversized files too
+        """
+        kwargs.setdefault("generated", REGISTRY_GENERATED_FILES.get(ecosystem, []))
+        if summarize:
+            kwargs.setdefault("summarized", SUMMARIZED_FILES + ECOSYSTEM_SUMMARIZED_FILES.get(ecosystem, []))
+            kwargs.setdefault("binary", True)
+            kwargs.setdefault("max_changed_lines", DEFAULT_MAX_CHANGED_LINES)
+            kwargs.setdefault("max_line_length", DEFAULT_MAX_LINE_LENGTH)
+        return cls(**kwargs)
+
+    def is_generated(self, path):
+        return any(match_path(path, pattern) for pattern in self.generated)
+
+    def get_reason(self, path, file_diff, binary_files=()):
+        """
+        why the changed file is to be summarized, None if it is to be line counted,
+        binary_files being the changed files with binary content, see archive_diff.is_binary_content
+        """
+        if self.is_generated(path):
+            return GENERATED
+        if any(match_path(path, pattern) for pattern in self.summarized):
+            return SUMMARIZED
+        if self.binary and path in binary_files:
+            return BINARY
+
+        lines = file_diff.added_lines + file_diff.removed_lines
+        if self.max_changed_lines is not None and len(lines) > self.max_changed_lines:
+            return OVERSIZED
+        if self.max_line_length is not None and any(len(l) > self.max_line_length for l in lines):
+            return OVERSIZED
+        return None
+
+    def apply(self, version_diff):
+        version_diff.summarized_files = {}
+        if version_diff.diff is None:
+            # the registry lacks one of the versions
+            return version_diff
+
+        for path in list(version_diff.diff.keys()):
+            file_diff = version_diff.diff[path]
+            reason = self.get_reason(path, file_diff, version_diff.binary_files)
+            if reason:
+                version_diff.diff.pop(path)
+                version_diff.summarized_files[path] = SummarizedFile(reason, file_diff.loc_added, file_diff.loc_removed)
+
+        if self.binary:
+            # git leaves binary files with a NUL byte out of the diff altogether
+            for path in version_diff.binary_files:
+                if not self.is_generated(path):
+                    version_diff.summarized_files.setdefault(path, SummarizedFile(BINARY))
+
+        for path in [f for f in version_diff.new_version_filelist if self.is_generated(f)]:
+            version_diff.new_version_filelist.discard(path)
+            version_diff.summarized_files.setdefault(path, SummarizedFile(GENERATED))
+        return version_diff
+
+
+def get_archive_kind(url, ecosystem):
+    """how version_differ's download_package_source unpacks the artifact at url"""
+    if url.endswith(".whl") or url.endswith(".jar") or url.endswith(".zip"):
+        return ZIP_ARCHIVE
+    elif url.endswith(".gz") or url.endswith(".crate") or url.endswith(".tgz"):
+        return TAR_ARCHIVE
+    elif url.endswith(".gem"):
+        return GEM_ARCHIVE
+    elif ecosystem == COMPOSER or ecosystem == MAVEN:
+        return ZIP_ARCHIVE
+    elif ecosystem == NPM or ecosystem == PIP or ecosystem == CARGO:
+        return TAR_ARCHIVE
+    return None
+
+
+def unpack_artifact(content, kind, dir_path):
+    """extracts the artifact content into dir_path, the same as version_differ's download_zipped and download_tar"""
+    with io.BytesIO(content) as f:
+        if kind == ZIP_ARCHIVE:
+            with ZipFile(f) as z:
+                z.extractall(dir_path)
+        elif kind == TAR_ARCHIVE:
+            with tarfile.open(fileobj=f) as t:
+                t.extractall(dir_path)
+        elif kind == GEM_ARCHIVE:
+            # a gem is a plain tar of metadata and a data.tar.gz holding the package files
+            with tarfile.open(fileobj=f) as gem:
+                with tarfile.open(fileobj=gem.extractfile("data.tar.gz")) as t:
+                    t.extractall(dir_path)
+
+
+def get_pip_package_root(package, dir_path):
+    files = os.listdir(dir_path)
+    if len(files) == 1:
+        # sdist, a single top level directory
+        path = join(dir_path, files[0])
+        egginfo = get_egg_info_path(path, package)
+        if egginfo:
+            shutil.rmtree(egginfo, ignore_errors=True)
+        if "PKG-INFO" in os.listdir(path):
+            os.remove(join(path, "PKG-INFO"))
+        return path
+    # assuming wheel file
+    distinfo = next((f for f in files if f.endswith(".dist-info")), None)
+    if distinfo:
+        shutil.rmtree(join(dir_path, distinfo), ignore_errors=True)
+        return dir_path
+    return None
+
+
+def get_package_root(ecosystem, package, dir_path):
+    """
+    package directory within an unpacked artifact, with registry generated files dropped,
+    the same as version_differ's download_package_source
+    """
+    path = None
+    if ecosystem == COMPOSER or ecosystem == NPM or ecosystem == CARGO:
+        files = os.listdir(dir_path)
+        assert len(files) == 1
+        path = join(dir_path, files[0])
+        if ecosystem == CARGO and CARGO_TOML in os.listdir(path) and CARGO_TOML_ORIG in os.listdir(path):
+            os.remove(join(path, CARGO_TOML))
+            os.rename(join(path, CARGO_TOML_ORIG), join(path, CARGO_TOML))
+    elif ecosystem == PIP:
+        path = get_pip_package_root(package, dir_path)
+    elif ecosystem == MAVEN or ecosystem == RUBYGEMS:
+        path = dir_path
+    assert path, "cannot extract {}-{}".format(ecosystem, package)
+    return path
+
+
+def extract_artifact(ecosystem, package, content, kind, dir_path):
+    """package directory of the artifact content extracted into dir_path, with registry generated files dropped"""
+    unpack_artifact(content, kind, dir_path)
+    return get_package_root(ecosystem, package, dir_path)
+
+
+def get_package_file_list(path):
+    """files of an extracted package, the same as version_differ's get_repository_file_list"""
+    filelist = set()
+    for root, dirs, files in os.walk(path):
+        if relpath(root, path).startswith(".git"):
+            continue
+        for file in files:
+            filelist.add(relpath(join(root, file), path))
+    return filelist
+
+
+def get_package_blob_ids(path):
+    """path -> git blob id of the files of an extracted package"""
+    blobs = {}
+    for root, dirs, files in os.walk(path):
+        if relpath(root, path).startswith(".git"):
+            continue
+        for file in files:
+            file_path = join(root, file)
+            if os.path.islink(file_path):
+                continue
+            with open(file_path, "rb") as f:
+                blobs[relpath(file_path, path)] = git_blob_id(f.read())
+    return blobs
+
+
+def get_changed_binary_files(old_blobs, new_blobs, read_old, read_new):
+    """
+    changed files with binary content in either version, see archive_diff.is_binary_content,
+    from path -> git blob id of each version, contents read with read_old(path) and read_new(path)
+    """
+    binary_files = set()
+    for path in set(old_blobs) | set(new_blobs):
+        if old_blobs.get(path) == new_blobs.get(path):
+            continue
+        if (path in old_blobs and is_binary_content(read_old(path))) or (
+            path in new_blobs and is_binary_content(read_new(path))
+        ):
+            binary_files.add(path)
+    return binary_files
+
+
+def read_package_file(path, filepath):
+    with open(join(path, filepath), "rb") as f:
+        return f.read()
+
+
+def read_blob(repo, blob_id):
+    return repo.odb.stream(hex_to_bin(blob_id)).read()
+
+
+def get_tree_blob_ids(repo_path, commit):
+    """path -> git blob id of the files in the tree of the given commit"""
+    blobs = {}
+    for entry in Repo(repo_path).git.ls_tree("-r", "-z", commit).split("\0"):
+        if entry:
+            info, path = entry.split("\t", 1)
+            mode, object_type, object_id = info.split(" ")
+            if object_type == "blob":
+                blobs[path] = object_id
+    return blobs
+
+
+def get_artifact_git_sha(ecosystem, path):
+    """commit the artifact was published from, only recorded by cargo, the same as version_differ"""
+    if ecosystem == CARGO:
+        return get_git_sha_from_cargo_crate(path)
+    return None
+
+
+class RegistrySource:
+    """artifacts of package versions from the live registries"""
+
+    def fetch(self, ecosystem, package, version):
+        """(archive content, archive kind), None if the registry has no artifact of the version"""
+        url = get_package_version_source_url(ecosystem, package, version)
+        if not url:
+            return None
+        r = requests.get(url)
+        r.raise_for_status()
+        return r.content, get_archive_kind(url, ecosystem)
+
+
+class RegistryMirror(RegistrySource):
+    """
+    artifacts of package versions from a local directory laid out as a registry mirror,
+    <ecosystem>/<package>/<version>.{crate,tgz,tar.gz,gem,whl,zip},
+    for runs without network access, or without download variance.
+    ecosystem directories are matched case insensitively, pypi and pip being the same
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def _ecosystem_dir(self, ecosystem):
+        names = {ecosystem.lower()}
+        if ecosystem.lower() in [PIP.lower(), PYPI.lower()]:
+            names = {PIP.lower(), PYPI.lower()}
+        for name in os.listdir(self.path):
+            if name.lower() in names:
+                return join(self.path, name)
+        return None
+
+    def artifact_path(self, ecosystem, package, version):
+        """path of the mirrored artifact of the version, None if not mirrored"""
+        ecosystem_dir = self._ecosystem_dir(ecosystem)
+        if not ecosystem_dir:
+            return None
+        for extension in MIRROR_ARTIFACT_EXTENSIONS:
+            path = join(ecosystem_dir, package, version + extension)
+            if os.path.isfile(path):
+                return path
+        return None
+
+    def fetch(self, ecosystem, package, version):
+        path = self.artifact_path(ecosystem, package, version)
+        if not path:
+            return None
+        with open(path, "rb") as f:
+            return f.read(), get_archive_kind(path, ecosystem)
+
+
+class RegistryArtifactCache:
+    """
+    registry artifacts of package versions, keyed by (ecosystem, package, version, artifact digest),
+    so that a version shared by consecutive updates is downloaded and unpacked only once.
+
+    under cache_dir, each artifact keeps its archive and a metadata record,
+    i.e., git sha and file list, named by the sha256 of the archive.
+    the normalized extracted tree of each artifact is a commit in a bare repository shared by all of them,
+    so that identical files are stored once and version diffs are plain tree to tree git diffs.
+    artifacts are evicted least recently used first once the cache grows beyond max_disk_bytes
+    """
+
+    def __init__(self, cache_dir, max_disk_bytes=DEFAULT_MAX_REGISTRY_DISK_BYTES, source=None):
+        self.max_disk_bytes = max_disk_bytes
+        self.source = source or RegistrySource()
+        self.root = join(cache_dir, REGISTRY_CACHE_DIR)
+        self.artifacts_path = join(self.root, "artifacts")
+        self.trees_path = join(self.root, "trees.git")
+        self.index_path = join(self.root, "versions.json")
+        self._lock_path = join(self.root, "registry.lock")
+
+        os.makedirs(self.artifacts_path, exist_ok=True)
+        with self._lock():
+            if not os.path.isdir(self.trees_path):
+                Repo.init(self.trees_path, bare=True)
+
+        self.hits = 0
+        self.misses = 0
+
+    @contextmanager
+    def _lock(self):
+        # serialize index updates, tree imports and eviction across processes
+        with open(self._lock_path, "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    @staticmethod
+    def _key(ecosystem, package, version):
+        return "{}/{}/{}".format(ecosystem, package, version)
+
+    def _archive_path(self, digest):
+        return join(self.artifacts_path, digest[:2], digest)
+
+    def _metadata_path(self, digest):
+        return self._archive_path(digest) + ".json"
+
+    def _read_index(self):
+        try:
+            with open(self.index_path) as f:
+                return json.load(f)
+        except:
+            # no cache yet, or unreadable
+            return {}
+
+    def _write_json(self, path, data):
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f)
+        os.replace(temp_path, path)
+
+    def _read_metadata(self, digest):
+        path = self._metadata_path(digest)
+        try:
+            with open(path) as f:
+                metadata = json.load(f)
+        except:
+            # evicted, or unreadable entry
+            return None
+        if metadata.get("format") != REGISTRY_CACHE_FORMAT_VERSION:
+            return None
+        # mark as recently used
+        os.utime(path)
+        return metadata
+
+    def get(self, ecosystem, package, version):
+        """metadata of the cached artifact of the version, None if not cached"""
+        digest = self._read_index().get(self._key(ecosystem, package, version))
+        return self._read_metadata(digest) if digest else None
+
+    def archive_path(self, metadata):
+        return self._archive_path(metadata["digest"])
+
+    def fetch(self, ecosystem, package, version, extract=True):
+        """
+        metadata of the artifact of the version, fetched from the source on a miss, None if it has none.
+        unless extract, only the archive is kept, without its extracted tree
+        """
+        metadata = self.get(ecosystem, package, version)
+        if metadata and (metadata.get("commit") or not extract):
+            self.hits += 1
+            return metadata
+
+        self.misses += 1
+        if metadata:
+            # archive cached by a streaming diff, not extracted yet
+            with open(self.archive_path(metadata), "rb") as f:
+                artifact = f.read(), metadata["kind"]
+        else:
+            artifact = self.source.fetch(ecosystem, package, version)
+        if not artifact:
+            return None
+        content, kind = artifact
+        return self.put(ecosystem, package, version, content, kind, extract=extract)
+
+    def put(self, ecosystem, package, version, content, kind, extract=True):
+        """cache the artifact content of the version, returns its metadata"""
+        digest = hashlib.sha256(content).hexdigest()
+        with self._lock():
+            metadata = self._read_metadata(digest)
+            if not metadata or (extract and not metadata.get("commit")):
+                metadata = self._import_artifact(ecosystem, package, digest, content, kind, extract)
+
+            index = self._read_index()
+            index[self._key(ecosystem, package, version)] = digest
+            self._write_json(self.index_path, index)
+
+            if self._disk_bytes() > self.max_disk_bytes:
+                self._evict(keep=digest)
+        return metadata
+
+    def _import_artifact(self, ecosystem, package, digest, content, kind, extract=True):
+        archive_path = self._archive_path(digest)
+        os.makedirs(os.path.dirname(archive_path), exist_ok=True)
+        with open(archive_path, "wb") as f:
+            f.write(content)
+
+        metadata = {
+            "format": REGISTRY_CACHE_FORMAT_VERSION,
+            "digest": digest,
+            "kind": kind,
+        }
+        if extract:
+            with tempfile.TemporaryDirectory() as temp_dir:
+                path = extract_artifact(ecosystem, package, content, kind, temp_dir)
+                metadata["git_sha"] = get_artifact_git_sha(ecosystem, path)
+                metadata["commit"] = self._import_tree(path, digest)
+                metadata["filelist"] = sorted(get_package_file_list(path))
+
+        self._write_json(self._metadata_path(digest), metadata)
+        return metadata
+
+    def _import_tree(self, path, digest):
+        # the same tree as version_differ's init_git_repo, files ignored by the package's own .gitignore left out
+        with tempfile.TemporaryDirectory() as temp_dir:
+            env = dict(
+                ARTIFACT_COMMIT_ENV,
+                GIT_DIR=self.trees_path,
+                GIT_WORK_TREE=path,
+                GIT_INDEX_FILE=join(temp_dir, "index"),
+            )
+            git = Git(path)
+            git.execute(["git", "add", "--all", "."], env=env)
+            tree = git.execute(["git", "write-tree"], env=env)
+            commit = git.execute(["git", "commit-tree", tree, "-m", digest], env=env)
+        Repo(self.trees_path).git.update_ref("refs/artifacts/{}".format(digest), commit)
+        return commit
+
+    def get_version_diff(self, ecosystem, package, old, new, streaming=False):
+        """
+        the same version diff as version_differ's get_version_diff_stats, from cached artifacts,
+        if streaming, from the cached archives without extracting them
+        """
+        output = VersionDifferOutput()
+        output.old_version = old
+        output.new_version = new
+
+        old_artifact = self.fetch(ecosystem, package, old, extract=not streaming)
+        if not old_artifact:
+            return output
+        new_artifact = self.fetch(ecosystem, package, new, extract=not streaming)
+        if not new_artifact:
+            return output
+
+        if streaming:
+            return get_archive_version_diff(
+                ecosystem,
+                package,
+                old,
+                new,
+                (self.archive_path(old_artifact), old_artifact["kind"]),
+                (self.archive_path(new_artifact), new_artifact["kind"]),
+                self.trees_path,
+            )
+
+        output.old_version_git_sha = old_artifact["git_sha"]
+        output.new_version_git_sha = new_artifact["git_sha"]
+
+        uni_diff_text = Repo(self.trees_path).git.diff(
+            old_artifact["commit"], new_artifact["commit"], ignore_blank_lines=True, ignore_space_at_eol=True
+        )
+        output.diff = get_diff_stats_from_git_diff(uni_diff_text)
+
+        output.new_version_filelist = set(new_artifact["filelist"])
+        output.old_version_filelist = set(old_artifact["filelist"])
+
+        output.old_version_blobs = get_tree_blob_ids(self.trees_path, old_artifact["commit"])
+        output.new_version_blobs = get_tree_blob_ids(self.trees_path, new_artifact["commit"])
+        repo = Repo(self.trees_path)
+        output.binary_files = get_changed_binary_files(
+            output.old_version_blobs,
+            output.new_version_blobs,
+            lambda path: read_blob(repo, output.old_version_blobs[path]),
+            lambda path: read_blob(repo, output.new_version_blobs[path]),
+        )
+        return output
+
+    def _artifact_entries(self):
+        for root, dirs, files in os.walk(self.artifacts_path):
+            for file in files:
+                if file.endswith(".json"):
+                    continue
+                try:
+                    archive_size = os.path.getsize(join(root, file))
+                    stat = os.stat(join(root, file + ".json"))
+                except FileNotFoundError:
+                    # evicted, or still being imported
+                    continue
+                yield file, archive_size + stat.st_size, stat.st_mtime
+
+    def _tree_store_bytes(self):
+        total = 0
+        for root, dirs, files in os.walk(join(self.trees_path, "objects")):
+            for file in files:
+                total += os.path.getsize(join(root, file))
+        return total
+
+    def _disk_bytes(self):
+        return sum(size for digest, size, mtime in self._artifact_entries()) + self._tree_store_bytes()
+
+    def evict(self, target_fraction=0.8):
+        """drop least recently used artifacts until below target_fraction of the limit"""
+        with self._lock():
+            self._evict(target_fraction=target_fraction)
+
+    def _evict(self, target_fraction=0.8, keep=None):
+        entries = sorted(self._artifact_entries(), key=lambda x: x[2])
+        artifact_bytes = sum(size for digest, size, mtime in entries)
+        # extracted trees share objects, assume each artifact holds a share of the store proportional to its size
+        scale = 1 + self._tree_store_bytes() / max(artifact_bytes, 1)
+
+        total = artifact_bytes * scale
+        evicted = set()
+        for digest, size, mtime in entries:
+            if total <= self.max_disk_bytes * target_fraction:
+                break
+            if digest == keep:
+                continue
+            for path in [self._metadata_path(digest), self._archive_path(digest)]:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            evicted.add(digest)
+            total -= size * scale
+
+        if not evicted:
+            return
+        index = self._read_index()
+        self._write_json(self.index_path, {key: digest for key, digest in index.items() if digest not in evicted})
+
+        # drop the trees of evicted artifacts, objects still used by other artifacts are kept
+        repo = Repo(self.trees_path)
+        for digest in evicted:
+            repo.git.update_ref("-d", "refs/artifacts/{}".format(digest))
+        repo.git.gc("--prune=now", "--quiet")
+
+
+def get_archive_version_diff(ecosystem, package, old, new, old_artifact, new_artifact, repo_path):
+    """
+    version diff between two artifacts, (archive content or path, archive kind), read without extracting them,
+    the files that differ are diffed by git in the repository at repo_path
+    """
+    output = VersionDifferOutput()
+    output.old_version = old
+    output.new_version = new
+    archive_diff = ArchiveDiff(ecosystem, package, *old_artifact, *new_artifact, repo_path)
+    (
+        output.diff,
+        output.old_version_git_sha,
+        output.new_version_git_sha,
+        output.old_version_filelist,
+        output.new_version_filelist,
+    ) = archive_diff.diff()
+    output.old_version_blobs = archive_diff.old_blobs
+    output.new_version_blobs = archive_diff.new_blobs
+    output.binary_files = archive_diff.binary_files
+    return output
+
+
+def get_extracted_version_diff(ecosystem, package, old, new):
+    """version_differ's version diff, with the git blob ids of the extracted packages' files"""
+    output = get_version_diff_stats_registry_with_package_code(ecosystem, package, old, new)
+    try:
+        if output.old_version_path and output.new_version_path:
+            output.old_version_blobs = get_package_blob_ids(output.old_version_path)
+            output.new_version_blobs = get_package_blob_ids(output.new_version_path)
+            output.binary_files = get_changed_binary_files(
+                output.old_version_blobs,
+                output.new_version_blobs,
+                lambda path: read_package_file(output.old_version_path, path),
+                lambda path: read_package_file(output.new_version_path, path),
+            )
+    finally:
+        output.cleanup()
+    return output
+
+
+def get_streaming_version_diff(ecosystem, package, old, new, source):
+    """
+    version diff streamed from the artifacts held in memory without extracting them,
+    only the files that differ are written, into a temporary git repository to diff them
+    """
+    old_artifact = source.fetch(ecosystem, package, old)
+    new_artifact = source.fetch(ecosystem, package, new) if old_artifact else None
+    if not old_artifact or not new_artifact:
+        output = VersionDifferOutput()
+        output.old_version = old
+        output.new_version = new
+        return output
+    with tempfile.TemporaryDirectory() as repo_path:
+        Repo.init(repo_path, bare=True)
+        return get_archive_version_diff(ecosystem, package, old, new, old_artifact, new_artifact, repo_path)
+
+
+def get_registry_version_diff(
+    ecosystem, package, old, new, cache_dir=None, registry_mirror=None, streaming=False, file_filter=None
+):
+    """
+    version diff of the package in its registry, with old_version_blobs and new_version_blobs,
+    path -> git blob id of the files of each version, None if not available,
+    and binary_files, the changed files with binary content.
+    artifacts are read from the registry_mirror directory rather than the live registry if given,
+    and kept across calls under cache_dir if given.
+    if streaming, artifacts are diffed from their archives' member streams rather than extracted.
+    files are then pre-filtered with file_filter, by default RegistryFileFilter.for_ecosystem,
+    which only leaves out the registry's generated files
+    """
     if ecosystem == PYPI:
         ecosystem = PIP
 
+    source = RegistryMirror(registry_mirror) if registry_mirror else RegistrySource()
     try:
-        version_diff = get_version_diff_stats(ecosystem, package, old, new)
+        if cache_dir:
+            version_diff = RegistryArtifactCache(cache_dir, source=source).get_version_diff(
+                ecosystem, package, old, new, streaming=streaming
+            )
+        elif streaming:
+            version_diff = get_streaming_version_diff(ecosystem, package, old, new, source)
+        elif registry_mirror:
+            with tempfile.TemporaryDirectory() as temp_dir:
+                version_diff = RegistryArtifactCache(temp_dir, source=source).get_version_diff(
+                    ecosystem, package, old, new
+                )
+        elif ecosystem == GO or ecosystem == NUGET:
+            version_diff = get_version_diff_stats(ecosystem, package, old, new)
+        else:
+            version_diff = get_extracted_version_diff(ecosystem, package, old, new)
     except:
         raise VersionDifferError
 
-    # preprocess auto-gen files respective to each registry
-    if ecosystem == CARGO:
-        preprocess_cargo_crate_files(version_diff)
-
-    return version_diff
+    for attribute, default in [("old_version_blobs", None), ("new_version_blobs", None), ("binary_files", set())]:
+        if not hasattr(version_diff, attribute):
+            setattr(version_diff, attribute, default)
 
+    # keep generated files, and any other the filter opts into, out of line counting
+    (file_filter or RegistryFileFilter.for_ecosystem(ecosystem)).apply(version_diff)
 
-def preprocess_cargo_crate_files(version_diff):
-    # filter out auto-generated files
-    auto_gen_files = [".cargo_vcs_info.json", "Cargo.lock"]
-    for f in auto_gen_files:
-        version_diff.diff.pop(f, None)
-        version_diff.new_version_filelist.discard(f)
+    return version_diff
@@ -0,0 +1,126 @@
+import fcntl
+import hashlib
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+from os.path import join
+from urllib.parse import urlparse
+from git import Repo
+from depdive.tag_index import TagIndex
+
+MIRROR_DIR = "mirrors"
+
+
+def normalize_repository_url(repository):
+    """
+    different spellings of the same repository url
+    should share one mirror, e.g.,
+    https://github.com/tokio-rs/tokio.git and git@github.com:tokio-rs/tokio
+    """
+    url = repository.strip().rstrip("/")
+
+    if "://" not in url:
+        if ":" in url and not os.path.exists(url):
+            # scp-like syntax, e.g., git@github.com:owner/repo
+            host, path = url.split(":", 1)
+            url = "ssh://{}/{}".format(host, path)
+        else:
+            return "file://" + os.path.abspath(url).removesuffix(".git")
+
+    parsed_url = urlparse(url)
+    if parsed_url.scheme == "file":
+        return "file://" + os.path.abspath(parsed_url.path).removesuffix(".git")
+
+    host = parsed_url.hostname.lower() if parsed_url.hostname else ""
+    path = parsed_url.path.strip("/").removesuffix(".git")
+    if host in ["github.com", "www.github.com"]:
+        # github paths are case insensitive
+        host = "github.com"
+        path = path.lower()
+    return "{}/{}".format(host, path)
+
+
+class RepositoryMirror:
+    """
+    local bare mirror of a remote repository,
+    shared across analyses through cheap worktrees
+    """
+
+    def __init__(self, repository, cache_dir, partial_clone=False):
+        self.repository = repository
+        self.partial_clone = partial_clone
+        self.key = normalize_repository_url(repository)
+
+        digest = hashlib.sha256(self.key.encode()).hexdigest()[:16]
+        name = self.key.rsplit("/", 1)[-1] or "repository"
+        mirror_dir = join(cache_dir, MIRROR_DIR)
+        os.makedirs(mirror_dir, exist_ok=True)
+
+        self.path = join(mirror_dir, "{}-{}.git".format(name, digest))
+        self._lock_path = self.path + ".lock"
+        self.tag_index_path = self.path + ".tags.json"
+
+    @contextmanager
+    def _lock(self):
+        # serialize fetches and worktree bookkeeping across processes
+        with open(self._lock_path, "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def exists(self):
+        return os.path.isdir(self.path)
+
+    def update(self):
+        """clone the mirror on first use, incrementally fetch afterwards"""
+        with self._lock():
+            if not self.exists():
+                self._clone()
+            else:
+                Repo(self.path).git.fetch("origin", "--prune")
+            self._update_tag_index()
+
+    def _update_tag_index(self):
+        tag_index = TagIndex.load(self.tag_index_path) or TagIndex()
+        if tag_index.refresh(self.path) or not os.path.exists(self.tag_index_path):
+            tag_index.save(self.tag_index_path)
+
+    def tag_index(self):
+        """release tags as of the last update"""
+        with self._lock():
+            return TagIndex.load(self.tag_index_path) or TagIndex.build(self.path)
+
+    def _clone(self):
+        # clone next to the final location and move in place,
+        # so that an interrupted clone never leaves a half-baked mirror behind
+        temp_dir = tempfile.mkdtemp(dir=os.path.dirname(self.path))
+        try:
+            if self.partial_clone:
+                Repo.clone_from(self.repository, temp_dir, mirror=True, filter="blob:none")
+            else:
+                Repo.clone_from(self.repository, temp_dir, mirror=True)
+            os.rename(temp_dir, self.path)
+        except:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+            raise
+
+    def add_worktree(self, path, commit="HEAD", no_checkout=False):
+        with self._lock():
+            if self.partial_clone or no_checkout:
+                # do not pull in every blob of the tree just to populate the worktree
+                Repo(self.path).git.worktree("add", "--detach", "--force", "--no-checkout", path, commit)
+            else:
+                Repo(self.path).git.worktree("add", "--detach", "--force", path, commit)
+
+    def remove_worktree(self, path):
+        with self._lock():
+            repo = Repo(self.path)
+            try:
+                repo.git.worktree("remove", "--force", "--force", path)
+            except:
+                # worktree directory may already be gone
+                pass
+            repo.git.worktree("prune")
@@ -1,12 +1,32 @@
-from git import Repo
-from unidiff import PatchSet
-from version_differ.version_differ import get_commit_of_release
+from git import GitCommandError, Repo
 import tempfile
-from os.path import join, relpath
+from os.path import join
+from urllib.parse import urljoin
+import io
 import os
-from package_locator.directory import locate_subdir
-from depdive.common import LineDelta, process_whitespace
+import subprocess
+from package_locator.common import CARGO, COMPOSER, NPM, PYPI, RUBYGEMS
+from package_locator.directory import (
+    get_cargo_subdir,
+    get_composer_subdir,
+    get_npm_subdir,
+    get_pypi_subdir,
+    get_rubygems_subdir,
+    locate_subdir,
+    postprocess_subdir,
+)
+from depdive.common import LineDelta, LineTable
+from depdive.repository_cache import RepositoryMirror, normalize_repository_url
+from depdive.commit_graph import UnknownCommit, clear_commit_graph, get_commit_graph
+from depdive.git_session import close_git_session, get_git_session
+from depdive.diff_cache import CommitDiffCache
+from depdive.changed_lines import ChangedLines, CommitIds
+from depdive.diff_store import FileChangeStore
+from depdive.tag_index import TagIndex
+from depdive.diff_parser import HUNK_HEADER, DiffParser, parse_diff, parse_diff_stream, process_patch_filepath
+from array import array
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 
 
 class UncertainSubdir(Exception):
@@ -32,6 +52,8 @@ class FileReadError(Exception):
 
 
 class SingleCommitFileChangeData:
+    __slots__ = ("source_file", "target_file", "is_rename", "changed_lines")
+
     def __init__(self, file=None):
         self.source_file: str = file
         self.target_file: str = file
@@ -40,7 +62,9 @@ class SingleCommitFileChangeData:
 
 
 class MultipleCommitFileChangeData:
-    def __init__(self, filename):
+    __slots__ = ("filename", "is_rename", "old_name", "commits", "changed_lines")
+
+    def __init__(self, filename, commit_ids=None):
         self.filename: str = filename
 
         # keeps track if it is a renamed file
@@ -48,72 +72,250 @@ class MultipleCommitFileChangeData:
         self.old_name: str = None
 
         self.commits = set()
-        self.changed_lines: dict[str, dict[str, LineDelta]] = {}
+        # line -> commit -> LineDelta
+        self.changed_lines: ChangedLines = ChangedLines(commit_ids)
+
+
+def multiple_commit_file_to_record(f):
+    rows = {line: deltas.tobytes() for line, deltas in f.changed_lines.lines.items()}
+    return f.filename, f.is_rename, f.old_name, list(f.commits), rows
+
+
+def multiple_commit_file_from_record(record, commit_ids):
+    filename, is_rename, old_name, commits, rows = record
+    f = MultipleCommitFileChangeData(filename, commit_ids)
+    f.is_rename = is_rename
+    f.old_name = old_name
+    f.commits = set(commits)
+    for line, deltas in rows.items():
+        f.changed_lines.lines[line] = array("i", deltas)
+    return f
+
+
+def single_commit_file_to_record(f):
+    lines = [(line, delta.additions, delta.deletions) for line, delta in f.changed_lines.items()]
+    return None, f.source_file, f.target_file, f.is_rename, lines
+
+
+def single_commit_file_from_record(record):
+    return file_diffs_from_records([record])[None]
+
+
+def file_diffs_from_records(records, line_table=None):
+    """get_diff_files() output from diff cache records, lines identified through the given LineTable"""
+    files = {}
+    for path, source_file, target_file, is_rename, lines in records:
+        f = SingleCommitFileChangeData()
+        f.source_file = source_file
+        f.target_file = target_file
+        f.is_rename = is_rename
+        for line, additions, deletions in lines:
+            f.changed_lines[line_table.identity(line) if line_table else line] = LineDelta(additions, deletions)
+        files[path] = f
+    return files
+
 
+def get_doubledot_inbetween_commits(repo_path, commit_a, commit_b="", pathspecs=None):
+    """commits in commit_a..commit_b, newest first, only those changing pathspecs if given"""
+    session = get_git_session(repo_path)
+    if pathspecs:
+        # keep merges whose first-parent diff touches pathspecs, like unscoped diffs see them
+        commits = session.run(
+            "rev_list", "--full-history", "{}..{}".format(commit_a, commit_b), "--", *pathspecs
+        ).split("\n")
+        return [c for c in commits if c]
+
+    try:
+        return get_commit_graph(repo_path).range(commit_a, commit_b)
+    except UnknownCommit:
+        pass
 
-def get_doubledot_inbetween_commits(repo_path, commit_a, commit_b=""):
-    repo = Repo(repo_path)
-    commits = repo.iter_commits("{}..{}".format(commit_a, commit_b))
-    return [str(c) for c in commits]
+    commits = session.run("rev_list", "{}..{}".format(commit_a, commit_b)).split("\n")
+    return [c for c in commits if c]
 
 
 def get_all_commits_on_file(repo_path, filepath, start_commit=None, end_commit=None):
     # upto given commit
-    repo = Repo(repo_path)
+    session = get_git_session(repo_path)
 
     if start_commit and end_commit:
-        commits = repo.git.log(
-            "{}^..{}".format(start_commit, end_commit), "--pretty=%H", "--follow", "--", filepath
+        commits = session.run(
+            "log", "{}^..{}".format(start_commit, end_commit), "--pretty=%H", "--follow", "--", filepath
         ).split("\n")
     elif start_commit:
-        commits = repo.git.log("{}^..".format(start_commit), "--pretty=%H", "--follow", "--", filepath).split("\n")
+        commits = session.run("log", "{}^..".format(start_commit), "--pretty=%H", "--follow", "--", filepath).split(
+            "\n"
+        )
     elif end_commit:
-        commits = repo.git.log(end_commit, "--pretty=%H", "--follow", "--", filepath).split("\n")
+        commits = session.run("log", end_commit, "--pretty=%H", "--follow", "--", filepath).split("\n")
     else:
-        commits = repo.git.log("--pretty=%H", "--follow", "--", filepath).split("\n")
+        commits = session.run("log", "--pretty=%H", "--follow", "--", filepath).split("\n")
 
     return list(dict.fromkeys([c for c in commits if c]))
 
 
-def get_commit_diff(repo_path, commit, reverse=False):
+def get_commit_diff(repo_path, commit, reverse=False, pathspecs=None):
     """
     we do not use git show to get diffs from merge commit
     """
-    repo = Repo(repo_path)
+    session = get_git_session(repo_path)
+    paths = ["--"] + pathspecs if pathspecs else []
     try:
         if not reverse:
-            uni_diff_text = repo.git.diff(
+            uni_diff_text = session.run(
+                "diff",
                 "{}~".format(commit),
                 "{}".format(commit),
                 "--submodule=diff",
+                *paths,
                 ignore_blank_lines=True,
                 ignore_space_at_eol=True,
             )
         else:
-            uni_diff_text = repo.git.diff(
+            uni_diff_text = session.run(
+                "diff",
                 "{}".format(commit),
                 "{}~".format(commit),
                 "--submodule=diff",
+                *paths,
                 ignore_blank_lines=True,
                 ignore_space_at_eol=True,
             )
     except:
         # Case 1: first commit, no parent
-        uni_diff_text = repo.git.show(
-            "{}".format(commit), "--submodule=diff", ignore_blank_lines=True, ignore_space_at_eol=True
+        uni_diff_text = session.run(
+            "show", "{}".format(commit), "--submodule=diff", *paths, ignore_blank_lines=True, ignore_space_at_eol=True
         )
 
     return uni_diff_text
 
 
+def stream_diff(repo_path, command, *args):
+    """DiffParser fed line by line from the patch git writes out, without holding the whole patch"""
+    process = get_git_session(repo_path).run(
+        command, "--submodule=diff", *args, as_process=True, ignore_blank_lines=True, ignore_space_at_eol=True
+    )
+    diff = parse_diff_stream(process.proc.stdout)
+    process.wait()
+    return diff
+
+
+def parse_commit_diff(repo_path, commit, reverse=False, pathspecs=None):
+    """parse_diff() of get_commit_diff(), streamed from git"""
+    paths = ["--"] + pathspecs if pathspecs else []
+    if not get_git_session(repo_path).commit(commit).parents:
+        # first commit, no parent
+        return stream_diff(repo_path, "show", commit, *paths)
+    revisions = [commit, "{}~".format(commit)] if reverse else ["{}~".format(commit), commit]
+    return stream_diff(repo_path, "diff", *revisions, *paths)
+
+
+COMMIT_DIFF_MARKER = "\0"
+
+
+def start_commit_diff_log(repo_path, commits, reverse=False, pathspecs=None):
+    """git log process writing out the patches of the given commits, in the given order"""
+    args = [
+        "--no-walk=unsorted",
+        "--stdin",
+        "--patch",
+        "--diff-merges=first-parent",
+        "--format={}%H %P".format("%x00"),
+        "--submodule=diff",
+        "--ignore-blank-lines",
+        "--ignore-space-at-eol",
+    ]
+    if reverse:
+        args.append("-R")
+    if pathspecs:
+        args += ["--"] + pathspecs
+    process = get_git_session(repo_path).run("log", *args, as_process=True, istream=subprocess.PIPE)
+    process.proc.stdin.write("".join("{}\n".format(c) for c in commits).encode())
+    process.proc.stdin.close()
+    return process
+
+
+def new_commit_diff(parse):
+    return DiffParser() if parse else []
+
+
+def finish_commit_diff(diff, parse):
+    if parse:
+        return diff
+    if diff and not diff[0]:
+        # blank line between the commit header and the patch
+        diff = diff[1:]
+    return "\n".join(diff)
+
+
+def read_commit_diffs(stream, parse=False):
+    """yields (commit, parents, diff) for each commit in the output of start_commit_diff_log()"""
+    commit, parents, diff = None, None, None
+    for line in stream:
+        line = line.decode("utf-8", "surrogateescape").removesuffix("\n")
+        if line.startswith(COMMIT_DIFF_MARKER):
+            if commit:
+                yield commit, parents, finish_commit_diff(diff, parse)
+            commit, *parents = line.removeprefix(COMMIT_DIFF_MARKER).split()
+            diff = new_commit_diff(parse)
+        elif commit:
+            if parse:
+                diff.feed(line)
+            else:
+                diff.append(line)
+    if commit:
+        yield commit, parents, finish_commit_diff(diff, parse)
+
+
+def skipped_commit_diffs(pending, until, parse):
+    """empty diffs of the pending commits up to until, which git left out for not touching pathspecs"""
+    for commit in pending:
+        if commit == until:
+            break
+        yield commit, finish_commit_diff(new_commit_diff(parse), parse)
+
+
+def iter_commit_diffs(repo_path, commits, reverse=False, parse=False, pathspecs=None):
+    """
+    yields (commit, diff) for each of the given commits, in the given order,
+    streamed from a single git process.
+    each diff is the same as the one from get_commit_diff(),
+    or a DiffParser fed with it line by line as git writes it out if parse
+    """
+    if not commits:
+        return
+
+    process = start_commit_diff_log(repo_path, commits, reverse, pathspecs)
+
+    # get_commit_diff() falls back to the plain diff of a root commit, even in reverse
+    root_commits = []
+
+    # git leaves out commits that do not touch pathspecs, their diffs are empty
+    pending = iter(commits)
+
+    for commit, parents, diff in read_commit_diffs(process.proc.stdout, parse):
+        if pathspecs:
+            yield from skipped_commit_diffs(pending, commit, parse)
+        if reverse and not parents:
+            root_commits.append(commit)
+            continue
+        yield commit, diff
+    if pathspecs:
+        yield from skipped_commit_diffs(pending, None, parse)
+    process.wait()
+
+    yield from iter_commit_diffs(repo_path, root_commits, parse=parse, pathspecs=pathspecs)
+
+
 def get_commit_diff_for_file(repo_path, filepath, commit, reverse=False):
     """
     we do not use git show to get diffs from merge commit
     """
-    repo = Repo(repo_path)
+    session = get_git_session(repo_path)
     try:
         if not reverse:
-            uni_diff_text = repo.git.diff(
+            uni_diff_text = session.run(
+                "diff",
                 "{}~".format(commit),
                 "{}".format(commit),
                 "--submodule=diff",
@@ -123,7 +325,8 @@ def get_commit_diff_for_file(repo_path, filepath, commit, reverse=False):
                 ignore_space_at_eol=True,
             )
         else:
-            uni_diff_text = repo.git.diff(
+            uni_diff_text = session.run(
+                "diff",
                 "{}".format(commit),
                 "{}~".format(commit),
                 "--submodule=diff",
@@ -134,28 +337,42 @@ def get_commit_diff_for_file(repo_path, filepath, commit, reverse=False):
             )
     except:
         # in case of first commit, no parent
-        uni_diff_text = repo.git.show(
-            "{}".format(commit), "--submodule=diff", "--", filepath, ignore_blank_lines=True, ignore_space_at_eol=True
+        uni_diff_text = session.run(
+            "show",
+            "{}".format(commit),
+            "--submodule=diff",
+            "--",
+            filepath,
+            ignore_blank_lines=True,
+            ignore_space_at_eol=True,
         )
 
     return uni_diff_text
 
 
-def get_inbetween_commit_diff(repo_path, commit_a, commit_b):
-    repo = Repo(repo_path)
-    uni_diff_text = repo.git.diff(
+def get_inbetween_commit_diff(repo_path, commit_a, commit_b, pathspecs=None):
+    session = get_git_session(repo_path)
+    uni_diff_text = session.run(
+        "diff",
         "{}".format(commit_a),
         "{}".format(commit_b),
         "--submodule=diff",
+        *(["--"] + pathspecs if pathspecs else []),
         ignore_blank_lines=True,
         ignore_space_at_eol=True,
     )
     return uni_diff_text
 
 
+def parse_inbetween_commit_diff(repo_path, commit_a, commit_b, pathspecs=None):
+    """parse_diff() of get_inbetween_commit_diff(), streamed from git"""
+    return stream_diff(repo_path, "diff", commit_a, commit_b, *(["--"] + pathspecs if pathspecs else []))
+
+
 def get_inbetween_commit_diff_for_file(repo_path, filepath, commit_a, commit_b):
-    repo = Repo(repo_path)
-    uni_diff_text = repo.git.diff(
+    session = get_git_session(repo_path)
+    uni_diff_text = session.run(
+        "diff",
         "{}".format(commit_a),
         "{}".format(commit_b),
         "--submodule=diff",
@@ -167,18 +384,179 @@ def get_inbetween_commit_diff_for_file(repo_path, filepath, commit_a, commit_b):
     return uni_diff_text
 
 
-def get_repository_file_list(repo_path, commit):
-    repo = Repo(repo_path)
-    head = repo.head.object.hexsha
+# memoized file lists and blob ids, keyed by (repository path, commit sha)
+_repository_file_lists = {}
+_repository_blob_ids = {}
+
+
+def list_tree_entries(repo_path, commit):
+    """yields (mode, type, object id, path) for every entry in the tree of the given commit"""
+    output = get_git_session(repo_path).run("ls_tree", "-r", "-z", "--full-tree", commit)
+    for entry in output.split("\0"):
+        if entry:
+            info, path = entry.split("\t", 1)
+            mode, object_type, object_id = info.split(" ")
+            yield mode, object_type, object_id, path
+
 
-    repo.git.checkout(commit, force=True)
+def list_tree_files(repo_path, commit):
+    """
+    files in the tree of the given commit,
+    submodules are listed by their gitlink path unless
+    the submodule repository is available locally
+    """
     filelist = []
-    for root, dirs, files in os.walk(repo_path):
-        for file in files:
-            filelist.append(relpath(join(root, file), repo_path))
+    for mode, object_type, object_id, path in list_tree_entries(repo_path, commit):
+        if object_type == "commit":
+            submodule_path = join(repo_path, path)
+            if os.path.exists(join(submodule_path, ".git")) and valid_commit(submodule_path, object_id):
+                filelist += [join(path, f) for f in list_tree_files(submodule_path, object_id)]
+                continue
+        filelist.append(path)
+    return filelist
+
+
+def get_repository_file_list(repo_path, commit):
+    """file list of the given commit, read from the tree object without touching the working tree"""
+    commit = get_git_session(repo_path).commit(commit).hexsha
+    key = (os.path.realpath(repo_path), commit)
+    if key not in _repository_file_lists:
+        _repository_file_lists[key] = frozenset(list_tree_files(repo_path, commit))
+    return set(_repository_file_lists[key])
 
-    repo.git.checkout(head, force=True)
-    return set(filelist)
+
+def get_repository_blob_ids(repo_path, commit):
+    """path -> git blob id of the files in the tree of the given commit, submodules left out"""
+    commit = get_git_session(repo_path).commit(commit).hexsha
+    key = (os.path.realpath(repo_path), commit)
+    if key not in _repository_blob_ids:
+        _repository_blob_ids[key] = {
+            path: object_id
+            for mode, object_type, object_id, path in list_tree_entries(repo_path, commit)
+            if object_type == "blob"
+        }
+    return _repository_blob_ids[key]
+
+
+def clear_repository_file_list_cache(repo_path):
+    repo_path = os.path.realpath(repo_path)
+    for cache in [_repository_file_lists, _repository_blob_ids, _repository_symlinks]:
+        for key in [k for k in cache.keys() if k[0] == repo_path]:
+            cache.pop(key)
+
+
+SYMLINK_MODE = 0o120000
+TREE_MODE = "040000"
+MAX_SYMLINK_DEPTH = 40
+
+
+def read_file_at_commit(repo_path, filepath, commit):
+    """
+    content of filepath at the given commit, read from the object database.
+    symlinks are followed and files within a locally available submodule are read from the submodule
+    """
+    session = get_git_session(repo_path)
+    try:
+        root = session.commit(commit).tree
+        for depth in range(MAX_SYMLINK_DEPTH):
+            parts = filepath.split("/")
+            mode, object_id = TREE_MODE, root
+            for i, part in enumerate(parts):
+                mode, object_id = session.tree(object_id)[part]
+                if mode == GITLINK_MODE:
+                    submodule_path = join(repo_path, *parts[: i + 1])
+                    return read_file_at_commit(submodule_path, "/".join(parts[i + 1 :]), object_id)
+            if int(mode, 8) != SYMLINK_MODE:
+                return session.read_object(object_id)[2]
+            target = session.read_object(object_id)[2].decode()
+            filepath = os.path.normpath(join(os.path.dirname(filepath), target))
+    except:
+        raise FileReadError(filepath)
+    raise FileReadError(filepath)
+
+
+def read_file_lines_at_commit(repo_path, filepath, commit):
+    """same lines as reading a checked out file with readlines()"""
+    content = read_file_at_commit(repo_path, filepath, commit)
+    try:
+        return io.TextIOWrapper(io.BytesIO(content), encoding="utf-8").readlines()
+    except:
+        raise FileReadError(filepath)
+
+
+# memoized symlink targets, keyed by (repository path, commit sha)
+_repository_symlinks = {}
+
+
+def get_repository_symlinks(repo_path, commit):
+    """maps each symlink in the tree of the given commit to its link text"""
+    session = get_git_session(repo_path)
+    commit = session.commit(commit).hexsha
+    key = (os.path.realpath(repo_path), commit)
+    if key not in _repository_symlinks:
+        symlinks = {}
+        for mode, object_type, object_id, path in list_tree_entries(repo_path, commit):
+            if int(mode, 8) == SYMLINK_MODE:
+                symlinks[path] = session.read_object(object_id)[2].decode()
+        _repository_symlinks[key] = symlinks
+    return _repository_symlinks[key]
+
+
+def resolve_symlink(repo_path, filepath, commit):
+    """repository path that filepath points to at the given commit"""
+    symlinks = get_repository_symlinks(repo_path, commit)
+    for depth in range(MAX_SYMLINK_DEPTH):
+        if filepath not in symlinks:
+            break
+        filepath = os.path.normpath(join(os.path.dirname(filepath), symlinks[filepath]))
+    return filepath
+
+
+# package_locator's locator of each ecosystem,
+# with the file name suffixes it looks at and whether it reads their content
+PACKAGE_LOCATORS = {
+    CARGO: (lambda package, path, version: get_cargo_subdir(package, path), [("Cargo.toml", True)]),
+    NPM: (lambda package, path, version: get_npm_subdir(package, path), [("package.json", True)]),
+    COMPOSER: (lambda package, path, version: get_composer_subdir(package, path), [("composer.json", True)]),
+    RUBYGEMS: (get_rubygems_subdir, [(".gemspec", True), (".rb", False)]),
+    PYPI: (get_pypi_subdir, [(".py", False)]),
+}
+
+# memoized package directories, keyed by (repository, commit sha, ecosystem, package, version)
+_package_subdirs = {}
+
+
+def locate_package_subdir(repo_path, repository, ecosystem, package, commit, version=None):
+    """
+    package directory at the given commit, like package_locator's locate_subdir,
+    but run against the local clone: the locator walks a scratch directory holding
+    only the files it looks at, read from the tree of the commit, instead of a fresh clone
+    """
+    if ecosystem not in PACKAGE_LOCATORS:
+        return locate_subdir(ecosystem, package, repository, commit=commit, version=version)
+
+    commit = get_git_session(repo_path).commit(commit).hexsha
+    key = (normalize_repository_url(repository), commit, ecosystem, package, version)
+    if key not in _package_subdirs:
+        locator, suffixes = PACKAGE_LOCATORS[ecosystem]
+        with tempfile.TemporaryDirectory() as temp_dir:
+            for filepath in get_repository_file_list(repo_path, commit):
+                for suffix, read_content in suffixes:
+                    if filepath.endswith(suffix):
+                        fullpath = join(temp_dir, filepath)
+                        os.makedirs(os.path.dirname(fullpath), exist_ok=True)
+                        content = b""
+                        if read_content:
+                            try:
+                                content = read_file_at_commit(repo_path, filepath, commit)
+                            except FileReadError:
+                                # the locator skips manifests it cannot parse
+                                pass
+                        with open(fullpath, "wb") as f:
+                            f.write(content)
+                        break
+            _package_subdirs[key] = postprocess_subdir(locator(package, temp_dir, version))
+    return _package_subdirs[key]
 
 
 def is_same_commit(sha_a, sha_b):
@@ -186,37 +564,38 @@ def is_same_commit(sha_a, sha_b):
 
 
 def get_common_ancestor(repo_path, start_commit, end_commit):
+    """parent of the oldest commit in start_commit..end_commit"""
+    graph = get_commit_graph(repo_path)
     try:
-        cmd = "cd {path};git rev-parse $(git log --pretty=%H {start_commit}..{end_commit} | tail -1)^".format(
-            path=repo_path, start_commit=start_commit, end_commit=end_commit
-        )
-        with os.popen(cmd) as process:
-            lines = process.readlines()
-
-        assert len(lines) == 1
-        ca = lines[0].strip()
-        assert ca.isalnum()
+        commits = graph.range(start_commit, end_commit)
+        if not commits or not graph.first_parent(commits[-1]):
+            raise GitError
+        return graph.first_parent(commits[-1])
+    except UnknownCommit:
+        pass
 
-        return ca
+    session = get_git_session(repo_path)
+    try:
+        commits = session.run("log", "--pretty=%H", "{}..{}".format(start_commit, end_commit)).split("\n")
+        return session.commit(commits[-1]).parents[0]
     except:
         raise GitError
 
 
 def valid_commit(repo_path, commit):
-    repo = Repo(repo_path)
-    try:
-        repo.commit(commit)
-        return True
-    except:
-        return False
+    return get_git_session(repo_path).exists("{}^{{commit}}".format(commit))
 
 
 def sort_commits_by_commit_date(repo_path, commits):
-    repo = Repo(repo_path)
+    graph = get_commit_graph(repo_path)
+    if all(c in graph for c in commits):
+        return graph.sort_by_commit_date(commits)
+
+    session = get_git_session(repo_path)
     sorted_commits = []
     for c in commits:
-        c = repo.commit(c)
-        d = c.committed_date
+        c = session.commit(c)
+        d = c.committer_time
         sorted_commits.append((c, d))
     sorted_commits = sorted(sorted_commits, key=lambda x: x[1])
     sorted_commits = [x[0].hexsha for x in sorted_commits]
@@ -224,14 +603,255 @@ def sort_commits_by_commit_date(repo_path, commits):
 
 
 def get_file_add_commit(repo_path, filepath):
-    repo = Repo(repo_path)
-    commits = repo.git.log("--pretty=%H", "--diff-filter=A", "--", filepath).split("\n")
+    session = get_git_session(repo_path)
+    commits = session.run("log", "--pretty=%H", "--diff-filter=A", "--", filepath).split("\n")
     return commits[0]
 
 
+def get_submodule_url(repo_path, path, commits):
+    """url of the submodule at path as recorded in .gitmodules of the first of commits that has it"""
+    session = get_git_session(repo_path)
+    for commit in commits:
+        try:
+            paths = session.run(
+                "config", "--blob", "{}:.gitmodules".format(commit), "--get-regexp", r"^submodule\..*\.path$"
+            )
+        except GitCommandError:
+            continue
+        for line in paths.split("\n"):
+            key, _, value = line.partition(" ")
+            if value == path:
+                name = key.removeprefix("submodule.").removesuffix(".path")
+                try:
+                    return session.run(
+                        "config", "--blob", "{}:.gitmodules".format(commit), "submodule.{}.url".format(name)
+                    )
+                except GitCommandError:
+                    continue
+
+
+BLAME_RANGE_CONTEXT = 3
+
+
+def get_changed_line_ranges(repo_path, filepath, commit_a, commit_b, source=False):
+    """
+    1-indexed inclusive line ranges of filepath touched by the diff from commit_a to commit_b,
+    padded with a few context lines, on the commit_b side or on the commit_a side if source.
+    returns None if they cannot be told from the diff,
+    e.g., for binary files, files missing on either side, or no changes at all
+    """
+    try:
+        diff = get_git_session(repo_path).run(
+            "diff",
+            "--no-ext-diff",
+            "--no-renames",
+            "-U{}".format(BLAME_RANGE_CONTEXT),
+            commit_a,
+            commit_b,
+            "--",
+            filepath,
+        )
+    except GitCommandError:
+        return None
+
+    ranges = []
+    for line in diff.split("\n"):
+        if line.startswith(("new file mode", "deleted file mode", "Binary files")):
+            return None
+        m = HUNK_HEADER.match(line)
+        if not m:
+            continue
+        start, count = (m.group(1), m.group(2)) if source else (m.group(3), m.group(4))
+        start, count = int(start), int(count) if count is not None else 1
+        if count:
+            ranges.append((start, start + count - 1))
+    return ranges or None
+
+
+def parse_blame_porcelain_lines(blame):
+    """(commit, 1-indexed line number in the blamed file) of each line in git blame --porcelain output"""
+    lines = []
+    for line in blame.split("\n"):
+        if not line or line.startswith("\t"):
+            continue
+        fields = line.split(" ")
+        if len(fields[0]) == 40 and len(fields) in (3, 4) and fields[1].isdigit() and fields[2].isdigit():
+            lines.append((fields[0], int(fields[2])))
+    return lines
+
+
+def run_concurrently(function, arguments, workers=1):
+    """
+    calls function on each argument tuple over a pool of worker threads,
+    returns results in the order of arguments and raises the first error in that order.
+    the heavy lifting happens in git subprocesses, so threads are enough to keep the cores busy
+    """
+    if workers <= 1 or len(arguments) <= 1:
+        return [function(*args) for args in arguments]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(lambda args: function(*args), arguments))
+
+
+class RenameGraph:
+    """rename chains of file paths, each renamed file linked to its old name"""
+
+    def __init__(self):
+        # path -> old name
+        self.old_names: dict[str, str] = {}
+
+    def link(self, path, old_name):
+        self.old_names[path] = old_name
+
+    def chain(self, path):
+        """old names of path, newest first, up to a name renamed back to one already in the chain"""
+        seen, chain = {path}, []
+        while path in self.old_names and self.old_names[path] not in seen:
+            path = self.old_names[path]
+            seen.add(path)
+            chain.append(path)
+        return chain
+
+    def chains(self):
+        """
+        newest name -> its old names, for each rename chain.
+        a name reused after a rename is in the chain of each file that had it,
+        those files are not linked to one another
+        """
+        old_names = set(self.old_names.values())
+        chains = {path: self.chain(path) for path in self.old_names if path not in old_names}
+        linked = set(chains).union(*chains.values())
+        for path in self.old_names:
+            # names renamed back and forth, without a newer name
+            if path not in linked:
+                chains[path] = self.chain(path)
+                linked.add(path)
+                linked.update(chains[path])
+        return chains
+
+
+def merge_file_changes(merged, f):
+    """adds the changes of f to merged, for a commit on a line merged's delta takes precedence"""
+    for line, deltas in f.changed_lines.items():
+        changed_line = merged.changed_lines.setdefault(line)
+        for commit in deltas:
+            if commit not in changed_line:
+                changed_line[commit] = deltas[commit]
+    merged.commits |= f.commits
+
+
+def merge_renamed_files(files):
+    """
+    merges the change data of files along their rename chains, in place.
+    every old name of a chain then maps to the data object of the newest name,
+    holding the changes of the whole chain.
+    for a commit on a line, the newest name's delta takes precedence
+    """
+    graph = RenameGraph()
+    for f in list(files.keys()):
+        if files[f].is_rename and files[f].old_name:
+            graph.link(f, files[f].old_name)
+    chains = graph.chains()
+
+    # every chain is merged before old names map to newest names,
+    # so that a name reused in several chains brings only its own changes to each
+    for root, old_names in chains.items():
+        merged = files[root]
+        for path in old_names:
+            if path in files:
+                merge_file_changes(merged, files[path])
+        # set again, as an on-disk store may have spilled it while merging
+        files[root] = merged
+
+    for root, old_names in chains.items():
+        for path in old_names:
+            if isinstance(files, FileChangeStore):
+                # a reference to the root's entry, so that it stays the same object once spilled
+                files.alias(path, root)
+            else:
+                files[path] = files[root]
+
+
+NULL_OBJECT_ID = "0" * 40
+GITLINK_MODE = "160000"
+PREFETCH_BATCH_SIZE = 1000
+
+
+def parse_raw_diff_blob_ids(raw_diff):
+    """
+    collect blob ids from both sides of each entry in git's --raw output,
+    e.g., :100644 100644 <src_blob> <dst_blob> M\tpath
+    """
+    blob_ids = set()
+    for line in raw_diff.split("\n"):
+        if not line.startswith(":"):
+            continue
+        src_mode, dst_mode, src_blob, dst_blob = line[1:].split("\t")[0].split(" ")[:4]
+        if src_mode != GITLINK_MODE and src_blob != NULL_OBJECT_ID:
+            blob_ids.add(src_blob)
+        if dst_mode != GITLINK_MODE and dst_blob != NULL_OBJECT_ID:
+            blob_ids.add(dst_blob)
+    return blob_ids
+
+
+def get_commit_range_blob_ids(repo_path, revisions, paths=None):
+    """blobs on both sides of the first-parent diff of every commit in the given revisions"""
+    args = ["--raw", "--no-abbrev", "--format=", "--diff-merges=first-parent"] + revisions
+    if paths:
+        args += ["--"] + paths
+    return parse_raw_diff_blob_ids(get_git_session(repo_path).run("log", *args))
+
+
+def get_inbetween_commit_blob_ids(repo_path, commit_a, commit_b, paths=None):
+    args = ["--raw", "--no-abbrev", commit_a, commit_b]
+    if paths:
+        args += ["--"] + paths
+    return parse_raw_diff_blob_ids(get_git_session(repo_path).run("diff", *args))
+
+
+def prefetch_blobs(repo_path, blob_ids):
+    """
+    fetch missing blobs of a partial clone in batches,
+    instead of letting git lazily fetch them one by one.
+    git skips wanted objects that are already present locally
+    """
+    session = get_git_session(repo_path)
+    blob_ids = sorted(blob_ids)
+    for i in range(0, len(blob_ids), PREFETCH_BATCH_SIZE):
+        session.run(
+            "fetch",
+            "origin",
+            "--no-tags",
+            "--no-write-fetch-head",
+            "--recurse-submodules=no",
+            "--filter=blob:none",
+            *blob_ids[i : i + PREFETCH_BATCH_SIZE],
+            git_options={"c": "fetch.negotiationAlgorithm=noop"},
+        )
+
+
 class RepositoryDiff:
+    # blame only the changed line ranges of files at least this long,
+    # unless the changes are spread over too many ranges or most of the file
+    BLAME_RANGE_MIN_LINES = 1000
+    MAX_BLAME_RANGES = 200
+    MAX_BLAME_RANGE_FRACTION = 0.5
+
     def __init__(
-        self, ecosystem, package, repository, old_version, new_version, old_version_commit=None, new_version_commit=None
+        self,
+        ecosystem,
+        package,
+        repository,
+        old_version,
+        new_version,
+        old_version_commit=None,
+        new_version_commit=None,
+        cache_dir=None,
+        partial_clone=False,
+        bulk_diff=True,
+        line_table=None,
+        diff_memory_files=None,
+        scoped=False,
+        extra_paths=(),
     ):
         self.ecosystem = ecosystem
         self.package = package
@@ -239,9 +859,41 @@ class RepositoryDiff:
         self.old_version = old_version
         self.new_version = new_version
 
+        # local bare mirrors are kept under cache_dir and reused across analyses
+        self.cache_dir = cache_dir
+        self._mirror = None
+        self._tag_index = None
+
+        # clone without blobs, and fetch them on demand for the files we look into
+        self.partial_clone = partial_clone
+
+        # stream diffs of all commits in a range from a single git process
+        self.bulk_diff = bulk_diff
+
+        # limit commits, diffs and the worktree to the package directory,
+        # extra_paths and the targets of symlinks within the package directory
+        self.scoped = scoped
+        self.extra_paths = list(extra_paths)
+        self.pathspecs = None  # set once the package directory is located, None for the whole repository
+
+        # parsed per-commit diffs, persisted under cache_dir if given
+        self.diff_cache = CommitDiffCache(repository, cache_dir)
+
+        # if given, keep the change data of at most this many files of diff and single_diff in memory,
+        # and the rest in an on-disk store
+        self.diff_memory_files = diff_memory_files
+
+        # identities of changed lines, shared with the registry side of the analysis
+        self.lines: LineTable = line_table or LineTable()
+        # ids of the commits in the per-line tables of self.diff
+        self.commit_ids = CommitIds()
+
         self._temp_dir = None
         self.repo_path = None
 
+        # git process usage of the analysis, reported on cleanup
+        self.git_stats = None
+
         self.old_version_commit = old_version_commit
         self.new_version_commit = new_version_commit
 
@@ -250,6 +902,7 @@ class RepositoryDiff:
         self.common_ancestor_commit_new_and_old_version = None
 
         self.submodule_paths = []
+        self.materialized_submodules = set()
 
         self.commits = None
         self.reverse_commits = None
@@ -261,42 +914,136 @@ class RepositoryDiff:
         self.build_repository_diff()
 
     def get_commit_of_release(self, version):
-        repo = Repo(self.repo_path)
-        tags = repo.tags
-        c = get_commit_of_release(tags, self.package, version)
-        if c:
-            return c.hexsha
+        if self._tag_index is None:
+            self._tag_index = self._mirror.tag_index() if self._mirror else TagIndex.build(self.repo_path)
+        return self._tag_index.commit_of_release(self.package, version)
 
     def cleanup(self):
+        self._close_file_stores()
+        clear_repository_file_list_cache(self.repo_path)
+        clear_commit_graph(self.repo_path)
+        self.git_stats = close_git_session(self.repo_path)
+        if self._mirror:
+            self._mirror.remove_worktree(self.repo_path)
         self._temp_dir.cleanup()
 
+    def _clone_repository(self):
+        self._temp_dir = tempfile.TemporaryDirectory()
+        self.repo_path = self._temp_dir.name
+        if self.cache_dir:
+            self._mirror = RepositoryMirror(self.repository, self.cache_dir, partial_clone=self.partial_clone)
+            self._mirror.update()
+            # scoped worktrees are checked out sparsely once the package directory is known
+            self._mirror.add_worktree(self.repo_path, no_checkout=self.scoped)
+        elif self.partial_clone:
+            Repo.clone_from(self.repository, self.repo_path, filter="blob:none", no_checkout=True)
+        else:
+            Repo.clone_from(self.repository, self.repo_path, no_checkout=self.scoped)
+
+    def _scope_to_package_directory(self):
+        if not self.scoped:
+            return
+        subdir = (self.new_version_subdir or "").removeprefix("./").removesuffix("/")
+        if not subdir or (self.old_version_subdir or "").removeprefix("./").removesuffix("/") != subdir:
+            # whole repository
+            self.pathspecs = None
+        else:
+            paths = {subdir} | set(self.extra_paths)
+            for commit in [self.old_version_commit, self.new_version_commit]:
+                for link in get_repository_symlinks(self.repo_path, commit):
+                    if link.startswith(subdir + "/"):
+                        paths.add(resolve_symlink(self.repo_path, link, commit))
+            self.pathspecs = sorted(paths)
+            self.diff_cache = CommitDiffCache(self.repository, self.cache_dir, scope=self.pathspecs)
+
+        if not self.partial_clone:
+            session = get_git_session(self.repo_path)
+            if self.pathspecs:
+                session.run("sparse_checkout", "set", "--no-cone", *["/" + path for path in self.pathspecs])
+            session.run("checkout")
+
+    def _prefetch_commit_range_blobs(self):
+        if not self.partial_clone:
+            return
+        blob_ids = get_commit_range_blob_ids(
+            self.repo_path,
+            ["{}..{}".format(self.old_version_commit, self.new_version_commit)]
+            + ["{}..{}".format(self.new_version_commit, self.old_version_commit)],
+            self.pathspecs,
+        )
+        blob_ids |= get_inbetween_commit_blob_ids(
+            self.repo_path, self.old_version_commit, self.new_version_commit, self.pathspecs
+        )
+        prefetch_blobs(self.repo_path, blob_ids)
+
+    def _prefetch_file_history_blobs(self, filepaths, revisions):
+        if not self.partial_clone or not filepaths:
+            return
+        prefetch_blobs(self.repo_path, get_commit_range_blob_ids(self.repo_path, revisions, filepaths))
+
+    def _prefetch_commit_blobs(self, commits):
+        if not self.partial_clone or not commits:
+            return
+        prefetch_blobs(self.repo_path, get_commit_range_blob_ids(self.repo_path, ["--no-walk"] + commits))
+
     def _process_submodules(self):
-        repo = Repo(self.repo_path)
-        repo.submodule_update(recursive=True, init=True)
+        """
+        submodule paths at either version, read from the gitlinks in their trees.
+        submodules are not fetched here, see materialize_submodule
+        """
+        paths = set()
+        for commit in [self.old_version_commit, self.new_version_commit]:
+            for mode, object_type, object_id, path in list_tree_entries(self.repo_path, commit):
+                if object_type == "commit":
+                    paths.add(path)
+        self.submodule_paths = sorted(paths)
+
+    def get_submodule_path(self, filepath):
+        """path of the submodule filepath lies within, if any"""
+        for path in self.submodule_paths:
+            if filepath.startswith("{}/".format(path)):
+                return path
+
+    def materialize_submodule(self, path):
+        """
+        fetches the submodule at path into the working tree,
+        and re-diffs the commits that moved it,
+        so that the files within show up in the diffs and in the file list
+        """
+        if path in self.materialized_submodules:
+            return
+        self.materialized_submodules.add(path)
 
-        head = repo.head.object.hexsha
-        try:
-            repo.git.checkout(self.old_version_commit, force=True)
-            repo.submodule_update(recursive=True)
-            self.submodule_paths += [x.path for x in repo.submodules]
-        except:
-            pass
+        url = get_submodule_url(self.repo_path, path, [self.new_version_commit, self.old_version_commit])
+        if not url:
+            return
+        if url.startswith("./") or url.startswith("../"):
+            # relative to the superproject's remote
+            url = urljoin(self.repository.rstrip("/") + "/", url)
+
+        kwargs = {"filter": "blob:none"} if self.partial_clone else {}
         try:
-            repo.git.checkout(self.new_version_commit, force=True)
-            repo.submodule_update(recursive=True)
-            self.submodule_paths += [x.path for x in repo.submodules]
-        except:
-            pass
+            Repo.clone_from(url, join(self.repo_path, path), no_checkout=True, **kwargs).close()
+        except GitCommandError:
+            return
 
-        repo.git.checkout(head, force=True)
+        # diffs of commits that moved the submodule were taken without its content,
+        # such diffs are kept in memory only
+        session = get_git_session(self.repo_path)
+        for commit_a, commit_b, reverse in [
+            (self.old_version_commit, self.new_version_commit, False),
+            (self.new_version_commit, self.old_version_commit, True),
+        ]:
+            commits = session.run("rev_list", "--full-history", "{}..{}".format(commit_a, commit_b), "--", path)
+            for commit in commits.split():
+                self.diff_cache.discard(commit, reverse)
+        clear_repository_file_list_cache(self.repo_path)
 
-        self.submodule_paths = list(set(self.submodule_paths))
+        self._build_diffs()
 
     def build_repository_diff(self):
         if not self.repo_path:
-            self._temp_dir = tempfile.TemporaryDirectory()
-            self.repo_path = self._temp_dir.name
-            Repo.clone_from(self.repository, self.repo_path)
+            self._clone_repository()
 
         if (
             not self.old_version_commit
@@ -310,46 +1057,72 @@ class RepositoryDiff:
                 raise ReleaseCommitNotFound
 
         try:
-            self.old_version_subdir = locate_subdir(
-                self.ecosystem, self.package, self.repository, commit=self.old_version_commit, version=self.old_version
+            self.old_version_subdir = locate_package_subdir(
+                self.repo_path, self.repository, self.ecosystem, self.package, self.old_version_commit, self.old_version
             )
-            self.new_version_subdir = locate_subdir(
-                self.ecosystem, self.package, self.repository, commit=self.new_version_commit, version=self.new_version
+            self.new_version_subdir = locate_package_subdir(
+                self.repo_path, self.repository, self.ecosystem, self.package, self.new_version_commit, self.new_version
             )
         except:
-            self._temp_dir.cleanup()
+            self.cleanup()
             raise UncertainSubdir
 
         self.common_ancestor_commit_new_and_old_version = get_common_ancestor(
             self.repo_path, self.old_version_commit, self.new_version_commit
         )
 
+        self._scope_to_package_directory()
         self._process_submodules()
 
+        self._build_diffs()
+
+    def _file_store(self, encode, decode):
+        """dict, or FileChangeStore if diff_memory_files is set, for change data of many files"""
+        if not self.diff_memory_files:
+            return {}
+        return FileChangeStore(encode, decode, self.diff_memory_files)
+
+    def _close_file_stores(self):
+        for files in [self.diff, self.single_diff]:
+            if isinstance(files, FileChangeStore):
+                files.close()
+
+    def _build_diffs(self):
+        self._close_file_stores()
         self.commits = set(
-            get_doubledot_inbetween_commits(self.repo_path, self.old_version_commit, self.new_version_commit)
+            get_doubledot_inbetween_commits(
+                self.repo_path, self.old_version_commit, self.new_version_commit, self.pathspecs
+            )
         )
         self.reverse_commits = set(
-            get_doubledot_inbetween_commits(self.repo_path, self.new_version_commit, self.old_version_commit)
+            get_doubledot_inbetween_commits(
+                self.repo_path, self.new_version_commit, self.old_version_commit, self.pathspecs
+            )
         )
 
         self.new_version_filelist = get_repository_file_list(self.repo_path, self.new_version_commit)
 
-        self.diff = self.get_commit_diff_stats_from_repo(self.repo_path, list(self.commits), list(self.reverse_commits))
+        self._prefetch_commit_range_blobs()
+        self.diff = self.get_commit_diff_stats_from_repo(
+            self.repo_path,
+            list(self.commits),
+            list(self.reverse_commits),
+            files=self._file_store(
+                multiple_commit_file_to_record, lambda record: multiple_commit_file_from_record(record, self.commit_ids)
+            ),
+        )
 
-        self.single_diff = self.get_diff_files(
-            get_inbetween_commit_diff(self.repo_path, self.old_version_commit, self.new_version_commit)
+        self.single_diff = self._file_store(single_commit_file_to_record, single_commit_file_from_record)
+        diff = parse_inbetween_commit_diff(
+            self.repo_path, self.old_version_commit, self.new_version_commit, self.pathspecs
         )
+        self.single_diff.update(file_diffs_from_records(diff.records(), self.lines))
 
-    def get_full_file_single_diff(self, filepath):
+    def get_full_file_single_diff(self, filepath, commit=None):
         single_diff = SingleCommitFileChangeData(filepath)
-        try:
-            with open(join(self.repo_path, filepath), "r") as f:
-                lines = f.readlines()
-        except:
-            raise FileReadError(filepath)
+        lines = read_file_lines_at_commit(self.repo_path, filepath, commit or self.new_version_commit)
         for l in lines:
-            l = process_whitespace(l)
+            l = self.lines(l)
             if l:
                 single_diff.changed_lines[l] = single_diff.changed_lines.get(l, LineDelta())
                 single_diff.changed_lines[l].additions += 1
@@ -365,17 +1138,18 @@ class RepositoryDiff:
         if filepath in self.diff and add_commit in self.diff[filepath].commits:
             return
 
-        single_diff = self.get_full_file_single_diff(filepath)
+        single_diff = self.get_full_file_single_diff(filepath, end_commit)
 
+        self._prefetch_commit_blobs(commits)
         diff = self.get_commit_diff_stats_from_repo(self.repo_path, commits)
         if filepath in diff:
-            self.diff[filepath] = self.diff.get(filepath, MultipleCommitFileChangeData(filepath))
+            self.diff[filepath] = self.diff.get(filepath, MultipleCommitFileChangeData(filepath, self.commit_ids))
             for line in diff[filepath].changed_lines.keys():
-                self.diff[filepath].changed_lines[line] = self.diff[filepath].changed_lines.get(line, {})
+                changed_line = self.diff[filepath].changed_lines.setdefault(line)
                 for commit in diff[filepath].changed_lines[line].keys():
-                    if commit not in self.diff[filepath].changed_lines[line]:
+                    if commit not in changed_line:
                         self.diff[filepath].commits.add(commit)
-                        self.diff[filepath].changed_lines[line][commit] = diff[filepath].changed_lines[line]
+                        changed_line[commit] = diff[filepath].changed_lines[line][commit]
             self.commits |= self.diff[filepath].commits
 
         self.single_diff[filepath] = single_diff
@@ -413,16 +1187,15 @@ class RepositoryDiff:
         if commits:
             commits = commits[1:] if commits[0] == new_version_commit else commits
             for commit in commits:
-                diff = self.get_diff_files(get_commit_diff(self.repo_path, commit))
+                diff = self.get_commit_diff_files(commit)
                 commit_outside_boundary = True  # assume this commit is outside the actual boundary
                 if filepath in diff:
                     commit_diff = diff[filepath].changed_lines
                     for line in commit_diff.keys():
-                        p_line = process_whitespace(line)
-                        if p_line in phantom_lines.keys():
-                            phantom_lines[p_line].subtract(commit_diff[line])
-                            if phantom_lines[p_line].additions == 0:
-                                phantom_lines.pop(p_line)
+                        if line in phantom_lines.keys():
+                            phantom_lines[line].subtract(commit_diff[line])
+                            if phantom_lines[line].additions == 0:
+                                phantom_lines.pop(line)
                                 new_version_commit = commit
                                 commit_outside_boundary = False
                 if commit_outside_boundary or not phantom_lines:
@@ -455,121 +1228,160 @@ class RepositoryDiff:
 
         return False
 
-    def get_commit_diff_stats_from_repo(self, repo_path, commits, reverse_commits=[]):
-        files = {}
-        for commit in commits + reverse_commits:
-            diff = self.get_diff_files(get_commit_diff(repo_path, commit, reverse=commit in reverse_commits))
+    def _iter_commit_diffs(self, repo_path, commits, reverse=False):
+        """yields (commit, DiffParser) of each of the given commits"""
+        if self.bulk_diff:
+            yield from iter_commit_diffs(repo_path, commits, reverse=reverse, parse=True, pathspecs=self.pathspecs)
+        else:
+            for commit in commits:
+                yield commit, parse_commit_diff(repo_path, commit, reverse=reverse, pathspecs=self.pathspecs)
+
+    def get_commit_diff_files(self, commit, reverse=False):
+        records = self.diff_cache.get(commit, reverse)
+        if records is None:
+            diff = parse_commit_diff(self.repo_path, commit, reverse=reverse, pathspecs=self.pathspecs)
+            records = diff.records()
+            self.diff_cache.put(commit, records, reverse, persist=not diff.moves_submodule)
+        return file_diffs_from_records(records, self.lines)
+
+    def _iter_commit_file_diffs(self, repo_path, commits, reverse_commits):
+        """
+        yields (commit, get_diff_files() output) in the given order,
+        only the commits missing from the diff cache are diffed and parsed
+        """
+        for batch, reverse in [(commits, False), (reverse_commits, True)]:
+            missing = [c for c in batch if not self.diff_cache.contains(c, reverse)]
+            stream = self._iter_commit_diffs(repo_path, missing, reverse)
+            missing = set(missing)
+            streamed = {}
+            for commit in batch:
+                records = None if commit in missing else self.diff_cache.get(commit, reverse)
+                if records is None:
+                    if commit in missing:
+                        while commit not in streamed:
+                            c, diff = next(stream)
+                            streamed[c] = diff
+                        diff = streamed.pop(commit)
+                    else:
+                        # evicted in the meantime
+                        diff = parse_commit_diff(repo_path, commit, reverse=reverse, pathspecs=self.pathspecs)
+                    records = diff.records()
+                    self.diff_cache.put(commit, records, reverse, persist=not diff.moves_submodule)
+                yield commit, file_diffs_from_records(records, self.lines)
+
+    def get_commit_diff_stats_from_repo(self, repo_path, commits, reverse_commits=[], files=None):
+        """change data of each file over the given commits, collected into files if given"""
+        if files is None:
+            files = {}
+        for commit, diff in self._iter_commit_file_diffs(repo_path, commits, reverse_commits):
             for file in diff.keys():
-                files[file] = files.get(file, MultipleCommitFileChangeData(file))
+                files[file] = files.get(file, MultipleCommitFileChangeData(file, self.commit_ids))
                 if diff[file].is_rename:
                     files[file].is_rename = True
                     files[file].old_name = diff[file].source_file
                 for line in diff[file].changed_lines.keys():
-                    files[file].changed_lines[line] = files[file].changed_lines.get(line, {})
-                    assert commit not in files[file].changed_lines[line]
+                    changed_line = files[file].changed_lines.setdefault(line)
+                    assert commit not in changed_line
                     files[file].commits.add(commit)
-                    files[file].changed_lines[line][commit] = diff[file].changed_lines[line]
-
-        def recurring_merge_rename(f, merged_files):
-            merged_files.add(f)
-            if files[f].is_rename and files[f].old_name in files.keys() and files[f].old_name not in merged_files:
-                old_f = files[f].old_name
-                files[old_f] = recurring_merge_rename(old_f, merged_files)
-                for l in files[old_f].changed_lines.keys():
-                    if l not in files[f].changed_lines:
-                        files[f].changed_lines[l] = files[old_f].changed_lines[l]
-                    else:
-                        for c in files[old_f].changed_lines[l]:
-                            if c not in files[f].changed_lines[l]:
-                                files[f].changed_lines[l][c] = files[old_f].changed_lines[l][c]
-                files[f].commits |= files[old_f].commits
-            return files[f]
-
-        # converge with old name in the case of renamed files
-        for f in files.keys():
-            files[f] = recurring_merge_rename(f, set())
-
-        def get_all_old_names(f, merged_files):
-            merged_files.add(f)
-            if f not in files or not files[f].is_rename or files[f].old_name in merged_files:
-                return []
-            else:
-                return [files[f].old_name] + get_all_old_names(files[f].old_name, merged_files)
+                    changed_line[commit] = diff[file].changed_lines[line]
 
-        rename_map = {}
-        all_old_names = set()
-        for f in files.keys():
-            rename_map[f] = set(get_all_old_names(f, set()))
-            all_old_names |= rename_map[f]
-
-        for f in list(files.keys()):
-            if f not in all_old_names and rename_map[f]:
-                for old_f in rename_map[f]:
-                    files[old_f] = files[f]
+        # converge with old names in the case of renamed files
+        merge_renamed_files(files)
 
         return files
 
     def process_patch_filepath(self, filepath):
-        filepath = filepath.removeprefix("a/")
-        filepath = filepath.removeprefix("b/")
-        if filepath == "/dev/null":
-            filepath = None
-        return filepath
+        return process_patch_filepath(filepath)
 
     def get_diff_files(self, uni_diff_text):
-        patch_set = PatchSet(uni_diff_text)
-        files = {}
-
-        for patched_file in patch_set:
-            f = SingleCommitFileChangeData()
-            f.source_file = self.process_patch_filepath(patched_file.source_file)
-            f.target_file = self.process_patch_filepath(patched_file.target_file)
-
-            f.is_rename = patched_file.is_rename
-
-            add_lines = [
-                process_whitespace(line.value.strip()) for hunk in patched_file for line in hunk if line.is_added
-            ]
-
-            del_lines = [
-                process_whitespace(line.value.strip()) for hunk in patched_file for line in hunk if line.is_removed
-            ]
-
-            for line in del_lines:
-                if line:
-                    f.changed_lines[line] = f.changed_lines.get(line, LineDelta())
-                    f.changed_lines[line].deletions += 1
+        return file_diffs_from_records(parse_diff(uni_diff_text).records(), self.lines)
 
-            for line in add_lines:
-                if line:
-                    f.changed_lines[line] = f.changed_lines.get(line, LineDelta())
-                    f.changed_lines[line].additions += 1
+    def _blame_line_ranges(self, filepath, commit_a, commit_b, line_count, source=False):
+        """
+        line ranges to restrict the blame of a large file to,
+        None to blame the whole file when the changes are too spread out or cannot be located
+        """
+        if line_count < self.BLAME_RANGE_MIN_LINES:
+            return None
+        ranges = get_changed_line_ranges(self.repo_path, filepath, commit_a, commit_b, source=source)
+        if (
+            not ranges
+            or len(ranges) > self.MAX_BLAME_RANGES
+            or sum(end - start + 1 for start, end in ranges) > line_count * self.MAX_BLAME_RANGE_FRACTION
+        ):
+            return None
+        return ranges
 
-            files[patched_file.path] = f
+    def _changed_outside_ranges(self, filepath, filelines, ranges, added=False):
+        """
+        whether a commit deletes, or adds if added, a line of filelines outside ranges,
+        e.g., a line deleted and added back, which the net diff of the range does not show
+        """
+        changed_lines = self.diff[filepath].changed_lines if filepath in self.diff else {}
+        inside = [False] * len(filelines)
+        for start, end in ranges:
+            for i in range(start - 1, min(end, len(filelines))):
+                inside[i] = True
+        for i, line in enumerate(filelines):
+            if not inside[i] and line in changed_lines:
+                if any((delta.additions if added else delta.deletions) > 0 for delta in changed_lines[line].values()):
+                    return True
+        return False
 
-        return files
+    def _reverse_blame(self, filepath, start_commit, new_version_commit, filelines):
+        """commit of each line of filepath at start_commit, as given by git blame --reverse"""
+        line_count = len(filelines)
+        ranges = self._blame_line_ranges(filepath, start_commit, new_version_commit, line_count, source=True)
+        if ranges and self._changed_outside_ranges(filepath, filelines, ranges):
+            # the removal commits of such lines are only found by blaming the whole file
+            ranges = None
+        if ranges:
+            try:
+                blame = get_git_session(self.repo_path).run(
+                    "blame",
+                    "--reverse",
+                    "--porcelain",
+                    *["-L{},{}".format(start, end) for start, end in ranges],
+                    "{}..{}".format(start_commit, new_version_commit),
+                    "--",
+                    filepath,
+                    stdout_as_string=False,
+                )
+                blame = parse_blame_porcelain_lines(blame.decode("utf-8", "surrogateescape"))
+                if len(blame) == sum(end - start + 1 for start, end in ranges):
+                    return [(c, i - 1) for c, i in blame]
+            except GitCommandError:
+                pass
+            # fall back to the whole file
 
-    def git_blame_delete(self, filepath, start_commit, new_version_commit):
         try:
-            with open(join(self.repo_path, filepath), "r") as f:
-                filelines = f.readlines()
+            blame = get_git_session(self.repo_path).run(
+                "blame",
+                "--reverse",
+                "-l",
+                "{}..{}".format(start_commit, new_version_commit),
+                "--",
+                filepath,
+                stdout_as_string=False,
+            )
+            blame = io.TextIOWrapper(io.BytesIO(blame), encoding="utf-8", errors="surrogateescape").readlines()
         except:
-            raise FileReadError(filepath)
-        filelines = [process_whitespace(l.strip()) for l in filelines]
+            blame = []
 
-        cmd = "cd {path};git blame --reverse -l {start_commit}..{end_commit} {fname}".format(
-            path=self.repo_path, start_commit=start_commit, end_commit=new_version_commit, fname=filepath
-        )
-        with os.popen(cmd) as process:
-            blame = process.readlines()
-
-        if not len(blame) == len(filelines):
+        if not len(blame) == line_count:
             raise GitError
 
         blame = [line.split(" ")[0] for line in blame]
         blame = [line.removeprefix("^") for line in blame]
+        return [(c, i) for i, c in enumerate(blame)]
+
+    def git_blame_delete(self, filepath, start_commit, new_version_commit):
+        self._prefetch_file_history_blobs([filepath], ["{}..{}".format(start_commit, new_version_commit)])
+        filelines = read_file_lines_at_commit(self.repo_path, filepath, start_commit)
+        filelines = [self.lines(l) for l in filelines]
+
         blame_map = defaultdict(list)
-        for i, c in enumerate(blame):
+        for c, i in self._reverse_blame(filepath, start_commit, new_version_commit, filelines):
             blame_map[c] += [i]
 
         def find_removal_commit(line, candidate_commits):
@@ -613,9 +1425,55 @@ class RepositoryDiff:
                     pass
         return c2c
 
+    def _forward_blame_line_ranges(self, filepath, commit):
+        """
+        lines added since the common ancestor of the versions,
+        only if all commits on the file we are interested in come after it
+        """
+        start_commit = self.common_ancestor_commit_new_and_old_version
+        if not start_commit or filepath not in self.diff:
+            return None
+        if self.diff[filepath].commits - set(get_doubledot_inbetween_commits(self.repo_path, start_commit, commit)):
+            # e.g., full file history for files newly included in the package
+            return None
+        try:
+            filelines = [self.lines(l) for l in read_file_lines_at_commit(self.repo_path, filepath, commit)]
+        except FileReadError:
+            return None
+        ranges = self._blame_line_ranges(filepath, start_commit, commit, len(filelines))
+        if ranges and self._changed_outside_ranges(filepath, filelines, ranges, added=True):
+            # the commits adding such lines back are only found by blaming the whole file
+            return None
+        return ranges
+
     def git_blame(self, filepath, commit):
+        self._prefetch_file_history_blobs([filepath], [commit])
+        session = get_git_session(self.repo_path)
+
+        blame = None
+        ranges = self._forward_blame_line_ranges(filepath, commit)
+        if ranges:
+            try:
+                blame = session.blame(commit, filepath, L=["{},{}".format(start, end) for start, end in ranges])
+            except GitCommandError:
+                # fall back to the whole file
+                pass
+        if blame is None:
+            blame = session.blame(commit, filepath)
+
         c2c = defaultdict(list)  # commit to code
-        repo = Repo(self.repo_path)
-        for commit, lines in repo.blame(commit, filepath):
+        for commit, lines in blame:
             c2c[commit.hexsha] += list(lines)
         return c2c
+
+    def git_blame_files(self, filepaths, commit, workers=1):
+        """git_blame of each of filepaths, blamed concurrently, results in the order of filepaths"""
+        self._prefetch_file_history_blobs(filepaths, [commit])
+        return run_concurrently(self.git_blame, [(f, commit) for f in filepaths], workers)
+
+    def git_blame_delete_files(self, filepaths, start_commit, new_version_commit, workers=1):
+        """git_blame_delete of each of filepaths, blamed concurrently, results in the order of filepaths"""
+        self._prefetch_file_history_blobs(filepaths, ["{}..{}".format(start_commit, new_version_commit)])
+        return run_concurrently(
+            self.git_blame_delete, [(f, start_commit, new_version_commit) for f in filepaths], workers
+        )
@@ -0,0 +1,104 @@
+import fcntl
+import json
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+from os.path import join
+from package_locator.locator import get_repository_url_and_subdir
+
+RESOLUTION_CACHE_FILE = "repositories.json"
+DEFAULT_RESOLUTION_TTL = 7 * 24 * 60 * 60
+
+
+class RepositoryResolutionCache:
+    """
+    package -> (repository url, package directory), keyed by (ecosystem, package),
+    as resolved from registry metadata by package_locator.
+
+    resolutions are kept under cache_dir for ttl seconds and shared across analyses.
+    a mapping file, {ecosystem: {package: {"repository": url, "directory": subdir}}},
+    can be preloaded for runs without network access, its entries never expire
+    """
+
+    def __init__(self, cache_dir=None, ttl=DEFAULT_RESOLUTION_TTL, mapping_file=None):
+        self.ttl = ttl
+        self.path = None
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+            self.path = join(cache_dir, RESOLUTION_CACHE_FILE)
+            self._lock_path = self.path + ".lock"
+
+        self._mapping = {}
+        if mapping_file:
+            with open(mapping_file) as f:
+                for ecosystem, packages in json.load(f).items():
+                    for package, location in packages.items():
+                        self._mapping[(ecosystem, package)] = (location["repository"], location.get("directory"))
+
+        self.hits = 0
+        self.misses = 0
+
+    @contextmanager
+    def _lock(self):
+        # serialize read-modify-write of the cache file across processes
+        with open(self._lock_path, "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    @staticmethod
+    def _key(ecosystem, package):
+        return "{}/{}".format(ecosystem, package)
+
+    def _read(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except:
+            # no cache yet, or unreadable
+            return {}
+
+    def _write(self, entries):
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(self.path))
+        with os.fdopen(fd, "w") as f:
+            json.dump(entries, f)
+        os.replace(temp_path, self.path)
+
+    def get(self, ecosystem, package):
+        """(repository, directory), None if not cached or expired"""
+        if (ecosystem, package) in self._mapping:
+            return self._mapping[(ecosystem, package)]
+        if not self.path:
+            return None
+        entry = self._read().get(self._key(ecosystem, package))
+        if not entry or time.time() - entry["resolved_at"] > self.ttl:
+            return None
+        return entry["repository"], entry["directory"]
+
+    def put(self, ecosystem, package, repository, directory):
+        if not self.path:
+            return
+        with self._lock():
+            entries = self._read()
+            entries[self._key(ecosystem, package)] = {
+                "repository": repository,
+                "directory": directory,
+                "resolved_at": time.time(),
+            }
+            self._write(entries)
+
+    def resolve(self, ecosystem, package, refresh=False):
+        """(repository, directory) of the package, from the cache unless refresh or expired"""
+        if not refresh:
+            location = self.get(ecosystem, package)
+            if location:
+                self.hits += 1
+                return location
+
+        self.misses += 1
+        repository, directory = get_repository_url_and_subdir(ecosystem, package)
+        self.put(ecosystem, package, repository, directory)
+        return repository, directory
@@ -0,0 +1,106 @@
+import bisect
+import json
+import os
+import re
+import tempfile
+from git import Repo
+
+# tag name, the object it points to, and the commit an annotated tag peels to
+TAG_REF_FORMAT = "%(refname:strip=2)%00%(objectname)%00%(*objectname)"
+
+# the heuristics of version_differ's get_commit_of_release,
+# all of them only ever match tags that end with the version
+RELEASE_TAG_PATTERNS = [
+    # 1. Ensure the version part does not follow any digit between 1-9,
+    # e.g., to distinguish betn 0.1.8 vs 10.1.8
+    r"^(?:.*[^1-9])?{version}$",
+    # 2. check if and only if crate name and version string is present
+    # besides non-alphanumeric, e.g., to distinguish guppy vs guppy-summaries
+    r"^.*{package}\W*-?_?v?-?_?\W*{version}$",
+    r"^.*{version}\W*-?_?v?-?_?\W*{package}$",
+]
+
+
+def read_tag_refs(repo_path):
+    """tag name -> (tag object or commit, peeled commit), from a single git for-each-ref"""
+    tags = {}
+    for line in Repo(repo_path).git.for_each_ref("refs/tags", format=TAG_REF_FORMAT).split("\n"):
+        if not line:
+            continue
+        name, object_id, peeled = line.split("\0")
+        tags[name] = (object_id, peeled or object_id)
+    return tags
+
+
+class TagIndex:
+    """
+    release tags of a repository, tag name -> peeled commit.
+
+    tags are looked up by the version they end with, through their lowercased names
+    sorted back to front, so that package-prefixed tags (pkg-v1.2.3, @scope/pkg@1.2.3)
+    of a version are found with a binary search rather than matching every tag.
+    kept next to a repository mirror, so that analyses of the same repository share it
+    """
+
+    def __init__(self, tags=None):
+        # tag name -> (tag object or commit, peeled commit)
+        self.tags: dict[str, tuple] = tags or {}
+        self._suffixes = None
+
+    @classmethod
+    def build(cls, repo_path):
+        return cls(read_tag_refs(repo_path))
+
+    @classmethod
+    def load(cls, path):
+        """stored index, None if there is none or it is unreadable"""
+        try:
+            with open(path) as f:
+                return cls({name: tuple(refs) for name, refs in json.load(f).items()})
+        except:
+            return None
+
+    def save(self, path):
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, "w") as f:
+            json.dump(self.tags, f)
+        os.replace(temp_path, path)
+
+    def refresh(self, repo_path):
+        """bring the index up to date with the tags of the repository, returns whether any tag changed"""
+        tags = read_tag_refs(repo_path)
+        if tags == self.tags:
+            return False
+        self.tags = tags
+        self._suffixes = None
+        return True
+
+    def _reversed_names(self):
+        if self._suffixes is None:
+            self._suffixes = sorted((name.strip().lower()[::-1], name) for name in self.tags)
+        return self._suffixes
+
+    def tags_ending_with(self, suffix):
+        """names of tags whose lowercased name ends with suffix"""
+        reversed_suffix = suffix[::-1]
+        suffixes = self._reversed_names()
+        names = []
+        for i in range(bisect.bisect_left(suffixes, (reversed_suffix,)), len(suffixes)):
+            reversed_name, name = suffixes[i]
+            if not reversed_name.startswith(reversed_suffix):
+                break
+            names.append(name)
+        return names
+
+    def commit_of_release(self, package, version):
+        """peeled commit of the release tag of the version, the same as version_differ's get_commit_of_release"""
+        version = version.strip()
+        names = self.tags_ending_with(version)
+
+        version_formatted_for_regex = version.replace(".", "\\.")
+        package = package.lower()
+        for pattern in RELEASE_TAG_PATTERNS:
+            pattern = re.compile(pattern.format(package=package, version=version_formatted_for_regex))
+            names = [name for name in names if pattern.match(name.strip().lower())]
+            if len(names) == 1:
+                return self.tags[names[0]][1]
@@ -0,0 +1,108 @@
+import os
+import pytest
+from git import Repo
+
+GIT_ENV = {
+    "GIT_AUTHOR_NAME": "depdive",
+    "GIT_AUTHOR_EMAIL": "depdive@example.com",
+    "GIT_COMMITTER_NAME": "depdive",
+    "GIT_COMMITTER_EMAIL": "depdive@example.com",
+}
+
+
+class LocalRepository:
+    """small git repository on disk for tests that must not hit the network"""
+
+    def __init__(self, path):
+        self.path = str(path)
+        self.repo = Repo.init(self.path)
+        self.repo.git.config("uploadpack.allowfilter", "true")
+        self.repo.git.config("uploadpack.allowanysha1inwant", "true")
+        self._tick = 0
+
+    @property
+    def url(self):
+        return "file://" + self.path
+
+    def write(self, filepath, content):
+        fullpath = os.path.join(self.path, filepath)
+        os.makedirs(os.path.dirname(fullpath), exist_ok=True)
+        with open(fullpath, "w") as f:
+            f.write(content)
+
+    def remove(self, filepath):
+        self.repo.git.rm(filepath)
+
+    def _env(self):
+        # deterministic, strictly increasing commit dates
+        self._tick += 1
+        date = "{} +0000".format(1600000000 + self._tick * 60)
+        return dict(GIT_ENV, GIT_AUTHOR_DATE=date, GIT_COMMITTER_DATE=date)
+
+    def commit(self, message, files=None):
+        for filepath, content in (files or {}).items():
+            self.write(filepath, content)
+        self.repo.git.add("-A")
+        with self.repo.git.custom_environment(**self._env()):
+            self.repo.git.commit("-m", message, "--allow-empty")
+        return self.repo.head.commit.hexsha
+
+    def commit_tree(self, tree, parent, message):
+        """commit that no ref points to"""
+        with self.repo.git.custom_environment(**self._env()):
+            return self.repo.git.commit_tree(tree, "-p", parent, "-m", message)
+
+    def merge(self, branch, message):
+        with self.repo.git.custom_environment(**self._env()):
+            self.repo.git.merge("--no-ff", "-m", message, branch)
+        return self.repo.head.commit.hexsha
+
+
+@pytest.fixture
+def make_local_repository(tmp_path):
+    return lambda name: LocalRepository(tmp_path / name)
+
+
+@pytest.fixture
+def local_repository(make_local_repository):
+    return make_local_repository("upstream")
+
+
+def build_cargo_repository(local_repository):
+    """
+    history of a small crate:
+    0.1.0 -> feature branch merged back, a rename and a deletion -> 0.2.0 -> one more commit
+    """
+    r = local_repository
+    r.commit(
+        "init",
+        {
+            "Cargo.toml": '[package]\nname = "demo"\nversion = "0.1.0"\n',
+            "src/lib.rs": "pub fn one() -> u32 {\n    1\n}\n",
+            "src/util.rs": "pub fn util() {}\n",
+            "assets/big.txt": "".join("big line {}\n".format(i) for i in range(200)),
+            "README.md": "demo\n",
+        },
+    )
+    r.commit("grow big file", {"assets/big.txt": "".join("big line {}\n".format(i) for i in range(300))})
+    r.commit("release 0.1.0")
+    r.repo.create_tag("v0.1.0")
+
+    r.repo.git.checkout("-b", "feature")
+    r.commit("add two", {"src/lib.rs": "pub fn one() -> u32 {\n    1\n}\n\npub fn two() -> u32 {\n    2\n}\n"})
+    r.repo.git.checkout("-")
+    r.commit("docs", {"README.md": "demo\n\nsome docs\n"})
+    r.repo.git.mv("src/util.rs", "src/helpers.rs")
+    r.commit("rename util", {"src/helpers.rs": "pub fn util() {}\npub fn helper() {}\n"})
+    r.merge("feature", "merge feature")
+    r.remove("README.md")
+    r.commit("drop readme", {"Cargo.toml": '[package]\nname = "demo"\nversion = "0.2.0"\n'})
+    r.repo.create_tag("v0.2.0")
+
+    r.commit("after release", {"src/lib.rs": "pub fn one() -> u32 {\n    1\n}\n"})
+    return r
+
+
+@pytest.fixture
+def cargo_repository(local_repository):
+    return build_cargo_repository(local_repository)
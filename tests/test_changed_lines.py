@@ -0,0 +1,36 @@
+from depdive.changed_lines import ChangedLines, CommitIds
+from depdive.common import LineDelta
+
+
+def test_changed_lines():
+    commit_ids = CommitIds()
+    lines = ChangedLines(commit_ids)
+    a, b, c = "a" * 40, "b" * 40, "c" * 40
+
+    lines.setdefault("x = 1")[a] = LineDelta(1, 0)
+    lines.setdefault("x = 1")[b] = LineDelta(0, 1)
+    lines["y = 2"] = {c: LineDelta(2, 1)}
+
+    assert list(lines.keys()) == ["x = 1", "y = 2"]
+    assert "x = 1" in lines and "z" not in lines
+    assert list(lines["x = 1"].keys()) == [a, b]
+    assert a in lines["x = 1"] and c not in lines["x = 1"] and "d" * 40 not in lines["x = 1"]
+    assert (lines["x = 1"][b].additions, lines["x = 1"][b].deletions) == (0, 1)
+    assert lines.get("z", {}) == {}
+
+    # updates go to the table, returned deltas are copies
+    lines["x = 1"][a] = LineDelta(3, 0)
+    lines["x = 1"][a].additions += 1
+    assert lines["x = 1"][a].additions == 3
+    del lines["x = 1"][a]
+    assert list(lines["x = 1"].keys()) == [b]
+
+    # copied between files of the same diff and across diffs
+    renamed = ChangedLines(commit_ids)
+    renamed["x = 1"] = lines["x = 1"]
+    lines["x = 1"][c] = LineDelta(1, 1)
+    assert list(renamed["x = 1"].keys()) == [b]
+    other = ChangedLines()
+    other["y = 2"] = lines["y = 2"]
+    assert {k: (v.additions, v.deletions) for k, v in other["y = 2"].items()} == {c: (2, 1)}
+    assert commit_ids.commits == [a, b, c]
@@ -0,0 +1,45 @@
+from depdive.commit_graph import CommitGraph, UnknownCommit
+from depdive.repository_diff import get_common_ancestor, get_doubledot_inbetween_commits
+from git import Repo
+import pytest
+
+
+def test_commit_graph_queries(cargo_repository):
+    repo = Repo(cargo_repository.path)
+    graph = CommitGraph(cargo_repository.path)
+    assert len(graph) == len(list(repo.iter_commits("--all")))
+
+    for a, b in [("v0.1.0", "v0.2.0"), ("v0.2.0", "v0.1.0"), ("feature", "v0.2.0"), ("v0.1.0", "HEAD")]:
+        assert graph.range(a, b) == [c.hexsha for c in repo.iter_commits("{}..{}".format(a, b), date_order=True)]
+
+    assert graph.is_ancestor("v0.1.0", "v0.2.0")
+    assert graph.is_ancestor("feature", "v0.2.0")
+    assert not graph.is_ancestor("v0.2.0", "feature")
+
+    merge = repo.commit("v0.2.0~1")
+    assert graph.first_parent(merge.hexsha) == merge.parents[0].hexsha
+    assert graph.committer_time("v0.2.0") == repo.commit("v0.2.0").committed_date
+    assert graph.authors[graph.lookup("v0.2.0")] == "depdive <depdive@example.com>"
+
+    # the ancestor cache is bounded by bytes, not by a fixed count
+    assert graph.max_cached_ancestors == CommitGraph.MAX_ANCESTOR_CACHE_BYTES // (len(graph) // 8 + 64)
+    graph.max_cached_ancestors = 2
+    graph._ancestors.clear()
+    for commit in graph.commits:
+        graph.ancestors(graph.lookup(commit))
+        assert len(graph._ancestors) <= 2
+    assert graph.range("v0.1.0", "v0.2.0") == [c.hexsha for c in repo.iter_commits("v0.1.0..v0.2.0", date_order=True)]
+
+
+def test_commit_graph_unknown_commit(cargo_repository):
+    repo = Repo(cargo_repository.path)
+    dangling = cargo_repository.commit_tree("v0.2.0^{tree}", "v0.1.0", "dangling")
+
+    graph = CommitGraph(cargo_repository.path)
+    assert dangling not in graph
+    with pytest.raises(UnknownCommit):
+        graph.range("v0.1.0", dangling)
+
+    # repository_diff falls back to git for commits outside the graph
+    assert get_doubledot_inbetween_commits(cargo_repository.path, "v0.1.0", dangling) == [dangling]
+    assert get_common_ancestor(cargo_repository.path, "v0.1.0", dangling) == repo.commit("v0.1.0").hexsha
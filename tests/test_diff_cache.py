@@ -0,0 +1,77 @@
+from depdive.diff_cache import CommitDiffCache
+from depdive.repository_diff import RepositoryDiff
+from package_locator.common import CARGO
+import os
+import time
+
+
+def test_commit_diff_cache(tmp_path):
+    repository = "https://github.com/nasifimtiazohi/depdive"
+    records = [("a.py", "a.py", "a.py", False, [("import os", 1, 0), ("x = 1", 2, 1)])]
+
+    cache = CommitDiffCache(repository, str(tmp_path))
+    assert cache.get("a" * 40) is None
+    cache.put("a" * 40, records)
+    cache.put("a" * 40, [], reverse=True)
+
+    # persisted across instances, reverse diffs are kept apart
+    cache = CommitDiffCache(repository, str(tmp_path))
+    assert cache.get("a" * 40) == records
+    assert cache.get("a" * 40, reverse=True) == []
+    assert cache.get("b" * 40) is None
+    assert (cache.hits, cache.misses) == (2, 1)
+
+    # other repositories do not share entries
+    assert CommitDiffCache(repository + "-fork", str(tmp_path)).get("a" * 40) is None
+
+
+def test_commit_diff_cache_eviction(tmp_path):
+    repository = "https://github.com/nasifimtiazohi/depdive"
+    records = [("a.py", "a.py", "a.py", False, [(os.urandom(64).hex(), i, 0) for i in range(20)])]
+
+    cache = CommitDiffCache(repository, str(tmp_path), max_disk_bytes=10**9)
+    for c in "abcd":
+        cache.put(c * 40, records)
+    entry_size = os.path.getsize(cache._entry_path("a" * 40, False))
+
+    # touch the oldest entry, so it is no longer the least recently used one
+    past = time.time() - 100
+    for i, c in enumerate("bcd"):
+        os.utime(cache._entry_path(c * 40, False), (past + i, past + i))
+    CommitDiffCache(repository, str(tmp_path)).get("a" * 40)
+
+    cache = CommitDiffCache(repository, str(tmp_path), max_disk_bytes=entry_size * 4)
+    cache.put("e" * 40, records)
+    assert [cache.contains(c * 40) for c in "abcde"] == [True, False, False, True, True]
+
+
+def test_commit_diff_cache_concurrent_eviction(tmp_path, monkeypatch):
+    repository = "https://github.com/nasifimtiazohi/depdive"
+    CommitDiffCache(repository, str(tmp_path)).put("a" * 40, [])
+    cache = CommitDiffCache(repository, str(tmp_path))
+
+    # another process evicts the entry right after it is read
+    utime = os.utime
+
+    def evicted_utime(path, *args):
+        os.remove(path)
+        utime(path, *args)
+
+    monkeypatch.setattr(os, "utime", evicted_utime)
+    assert cache.get("a" * 40) == []
+
+
+def test_repository_diff_reuses_cached_commit_diffs(cargo_repository, tmp_path):
+    cache_dir = str(tmp_path / "cache")
+    first = RepositoryDiff(CARGO, "demo", cargo_repository.url, "0.1.0", "0.2.0", cache_dir=cache_dir)
+    assert first.diff_cache.hits == 0
+    first.cleanup()
+
+    second = RepositoryDiff(CARGO, "demo", cargo_repository.url, "0.1.0", "0.2.0", cache_dir=cache_dir)
+    assert second.diff_cache.misses == 0
+    assert second.diff_cache.hits == len(second.commits) + len(second.reverse_commits)
+    assert second.diff.keys() == first.diff.keys()
+    for f in first.diff.keys():
+        assert second.diff[f].commits == first.diff[f].commits
+        assert second.diff[f].changed_lines.keys() == first.diff[f].changed_lines.keys()
+    second.cleanup()
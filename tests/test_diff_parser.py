@@ -0,0 +1,109 @@
+from depdive.common import process_whitespace
+from depdive.diff_parser import parse_diff, process_patch_filepath
+from depdive.repository_diff import (
+    get_commit_diff,
+    get_inbetween_commit_diff,
+    parse_commit_diff,
+    parse_inbetween_commit_diff,
+)
+from unidiff import PatchSet
+import os
+
+
+def unidiff_records(uni_diff_text):
+    """the former get_diff_files(), over a unidiff PatchSet"""
+    records = {}
+    for patched_file in PatchSet(uni_diff_text):
+        changed_lines = {}
+        for line in [line for hunk in patched_file for line in hunk if line.is_removed]:
+            line = process_whitespace(line.value.strip())
+            if line:
+                changed_lines.setdefault(line, [0, 0])[1] += 1
+        for line in [line for hunk in patched_file for line in hunk if line.is_added]:
+            line = process_whitespace(line.value.strip())
+            if line:
+                changed_lines.setdefault(line, [0, 0])[0] += 1
+        records[patched_file.path] = (
+            patched_file.path,
+            process_patch_filepath(patched_file.source_file),
+            process_patch_filepath(patched_file.target_file),
+            patched_file.is_rename,
+            [(line, a, d) for line, (a, d) in changed_lines.items()],
+        )
+    return list(records.values())
+
+
+def test_diff_parser_matches_unidiff(local_repository):
+    r = local_repository
+    r.commit(
+        "init",
+        {
+            "a.txt": "".join("line  {}\n".format(i) for i in range(50)),
+            "move.txt": "moved\nfile\nwith a few\nmore lines\n",
+            "gone.txt": "to be\ndeleted\n",
+            "crlf.txt": "a\r\nb\r\n",
+            "tail.txt": "no newline",
+        },
+    )
+    os.makedirs(os.path.join(r.path, "moved dir"))
+    r.repo.git.mv("move.txt", "moved dir/move me.txt")
+    r.remove("gone.txt")
+    with open(os.path.join(r.path, "blob.bin"), "wb") as f:
+        f.write(b"\0\1\2")
+    os.chmod(os.path.join(r.path, "crlf.txt"), 0o755)
+    r.commit(
+        "change",
+        {
+            # hunk lines that look like file headers
+            "a.txt": "-- not a header\n++ nor this\n" + "".join("line {}\n".format(i) for i in range(10, 50, 2)),
+            "moved dir/move me.txt": "moved\nfile\nwith a few\nmore lines\nand changed\n",
+            "crlf.txt": "a\r\nc\r\n",
+            "tail.txt": "no newline\nstill",
+            "empty.txt": "",
+        },
+    )
+    uni_diff_text = r.repo.git.show("HEAD", "--format=%H%n%n    diff --git a/x b/x%n")
+
+    parsed = parse_diff(uni_diff_text)
+    assert parsed.records() == unidiff_records(uni_diff_text)
+    assert not parsed.moves_submodule
+    assert [path for path, *_ in parsed.records()] == [
+        "a.txt",
+        "blob.bin",
+        "crlf.txt",
+        "empty.txt",
+        "gone.txt",
+        "moved dir/move me.txt",
+        "tail.txt",
+    ]
+
+
+def test_diff_parser_large_diff(local_repository):
+    r = local_repository
+    lines = ["    value_{} = compute({},  {})\n".format(i, i % 97, i % 13) for i in range(60000)]
+    r.commit("init", {"big.py": "".join(lines)})
+    for i in range(0, len(lines), 3):
+        lines[i] = "    value_{} = recompute({})\n".format(i, i)
+    r.commit("rewrite", {"big.py": "".join(lines), "other.py": "".join(lines[:20000])})
+    uni_diff_text = r.repo.git.diff("HEAD~", "HEAD")
+    assert len(uni_diff_text) > 2**20
+
+    assert parse_diff(uni_diff_text).records() == unidiff_records(uni_diff_text)
+
+
+def test_streamed_git_diff(local_repository):
+    r = local_repository
+    r.commit("init", {"a.txt": "a\nb\n", "sub/b.txt": "b\n"})
+    r.commit("change", {"a.txt": "a\nc\n", "sub/b.txt": "b\nd\n"})
+    root, head = r.repo.git.rev_list("HEAD").split()[::-1]
+
+    for commit in [root, head]:
+        for reverse in [False, True]:
+            for pathspecs in [None, ["sub"]]:
+                expected = parse_diff(get_commit_diff(r.path, commit, reverse, pathspecs)).records()
+                assert parse_commit_diff(r.path, commit, reverse, pathspecs).records() == expected
+    assert (
+        parse_inbetween_commit_diff(r.path, root, head, ["sub"]).records()
+        == parse_diff(get_inbetween_commit_diff(r.path, root, head, ["sub"])).records()
+    )
+    assert [path for path, *_ in parse_inbetween_commit_diff(r.path, root, head).records()] == ["a.txt", "sub/b.txt"]
@@ -0,0 +1,110 @@
+from depdive.diff_store import FileChangeStore
+from depdive.changed_lines import CommitIds
+from depdive.repository_diff import (
+    MultipleCommitFileChangeData,
+    RepositoryDiff,
+    merge_renamed_files,
+    multiple_commit_file_from_record,
+    multiple_commit_file_to_record,
+)
+from package_locator.common import CARGO
+
+
+def test_file_change_store():
+    store = FileChangeStore(lambda f: f, lambda record: list(record), max_memory_files=2)
+    for path in "abcd":
+        store[path] = [path]
+    assert list(store.keys()) == ["a", "b", "c", "d"]
+    assert store.writes == 2
+
+    # changed in place while in memory, then written back when spilled
+    store["a"].append("changed")
+    assert store.reads == 1
+    store["b"], store["c"], store["d"]
+    assert store["a"] == ["a", "changed"]
+
+    del store["a"]
+    assert "a" not in store and len(store) == 3
+    assert store.get("a") is None
+    store.close()
+
+
+def test_file_change_store_aliases():
+    store = FileChangeStore(lambda f: f, lambda record: list(record), max_memory_files=2)
+    store["new"] = ["new"]
+    store.alias("old", "new")
+    store.alias("older", "old")
+    for path in "abc":
+        store[path] = [path]
+    assert store.writes > 0
+
+    # the same object through every alias, once read back from disk as well
+    store["older"].append("changed")
+    assert store["new"] is store["old"] is store["older"]
+    store["a"], store["b"], store["c"]
+    assert store["old"] == ["new", "changed"]
+    assert store["new"] is store["older"]
+
+    # set again through an alias, as in get_full_file_history()
+    store["old"] = store.get("old")
+    store["new"].append("again")
+    assert store["old"] == ["new", "changed", "again"]
+
+    del store["new"]
+    assert store["old"] is store["older"] and store["older"] == ["new", "changed", "again"]
+    # aliases follow the entry of their path
+    store["old"] = ["replaced"]
+    assert store["older"] == ["replaced"]
+    assert list(store.keys()) == ["old", "older", "a", "b", "c"]
+    store.close()
+
+
+def test_merge_renamed_files_in_store():
+    commit_ids = CommitIds()
+    store = FileChangeStore(
+        multiple_commit_file_to_record,
+        lambda record: multiple_commit_file_from_record(record, commit_ids),
+        max_memory_files=2,
+    )
+    for path, old_name in [("c", "b"), ("b", "a"), ("x", None), ("y", None)]:
+        f = MultipleCommitFileChangeData(path, commit_ids)
+        f.is_rename, f.old_name = old_name is not None, old_name
+        f.commits.add(path)
+        store[path] = f
+    merge_renamed_files(store)
+    assert store["a"].commits == {"b", "c"}
+
+    # later changes through an old name reach the other names, once spilled as well
+    store["x"], store["y"]
+    store["a"].commits.add("later")
+    store["x"], store["y"]
+    assert store["b"].commits == store["c"].commits == {"b", "c", "later"}
+    store.close()
+
+
+def test_repository_diff_spills_file_changes(cargo_repository):
+    def changes(files):
+        return {
+            path: (
+                f.commits,
+                {l: {c: (d.additions, d.deletions) for c, d in v.items()} for l, v in f.changed_lines.items()},
+            )
+            for path, f in files.items()
+        }
+
+    in_memory = RepositoryDiff(CARGO, "demo", cargo_repository.url, "0.1.0", "0.2.0")
+    spilled = RepositoryDiff(CARGO, "demo", cargo_repository.url, "0.1.0", "0.2.0", diff_memory_files=2)
+    assert spilled.diff.writes > 0
+    assert changes(spilled.diff) == changes(in_memory.diff)
+
+    def single_changes(files):
+        return {path: (f.source_file, f.target_file, f.changed_lines.keys()) for path, f in files.items()}
+
+    assert single_changes(spilled.single_diff) == single_changes(in_memory.single_diff)
+
+    start_commit = spilled.common_ancestor_commit_new_and_old_version
+    assert spilled.git_blame_delete("README.md", start_commit, spilled.new_version_commit) == {
+        spilled.new_version_commit: ["demo"]
+    }
+    in_memory.cleanup()
+    spilled.cleanup()
@@ -0,0 +1,57 @@
+from depdive.git_session import GitObjectNotFound, close_git_session, get_git_session
+from depdive.repository_diff import (
+    get_common_ancestor,
+    get_repository_file_list,
+    sort_commits_by_commit_date,
+    valid_commit,
+)
+from git import Repo
+import pytest
+
+
+def test_git_session_lookups(cargo_repository):
+    repo = Repo(cargo_repository.path)
+    session = get_git_session(cargo_repository.path)
+    assert get_git_session(cargo_repository.path + "/") is session
+
+    merge = repo.commit("v0.2.0~1")
+    commit = session.commit("v0.2.0~1")
+    assert commit.hexsha == merge.hexsha
+    assert commit.parents == [p.hexsha for p in merge.parents]
+    assert commit.tree == merge.tree.hexsha
+    assert commit.committer_time == merge.committed_date
+    assert commit.author == "depdive <depdive@example.com>"
+
+    tree = session.tree(commit.tree)
+    assert tree["src"][0] == "040000"
+    assert tree["Cargo.toml"] == ("100644", merge.tree["Cargo.toml"].hexsha)
+
+    assert session.read_object("v0.1.0:Cargo.toml")[2] == b'[package]\nname = "demo"\nversion = "0.1.0"\n'
+    assert session.exists("v0.1.0", "commit")
+    assert not session.exists("v0.1.0:Cargo.toml", "commit")
+    with pytest.raises(GitObjectNotFound):
+        session.resolve("no-such-tag")
+
+    stats = close_git_session(cargo_repository.path)
+    assert stats["persistent_spawns"] == 2
+    assert stats["saved_spawns"] == stats["lookups"] - 2
+
+
+def test_git_session_helpers(cargo_repository):
+    repo_path = cargo_repository.path
+    repo = Repo(repo_path)
+    commits = [c.hexsha for c in repo.iter_commits("v0.1.0..v0.2.0")]
+
+    assert valid_commit(repo_path, "v0.1.0")
+    assert not valid_commit(repo_path, "^v0.1.0")
+    assert sort_commits_by_commit_date(repo_path, commits) == sorted(
+        commits, key=lambda c: repo.commit(c).committed_date
+    )
+    assert get_common_ancestor(repo_path, "v0.1.0", "v0.2.0") == repo.commit("v0.1.0").hexsha
+    get_repository_file_list(repo_path, "v0.2.0")
+
+    # ranges and dates come from the commit graph, built by one git log,
+    # all other lookups above went through a single pair of cat-file processes
+    stats = close_git_session(repo_path)
+    assert stats["persistent_spawns"] == 2
+    assert stats["command_spawns"] == 2
@@ -0,0 +1,270 @@
+from depdive import archive_diff, registry_diff
+from depdive.common import git_blob_id
+from depdive.registry_diff import (
+    BINARY,
+    GENERATED,
+    OVERSIZED,
+    SUMMARIZED,
+    TAR_ARCHIVE,
+    RegistryArtifactCache,
+    RegistryFileFilter,
+    RegistryMirror,
+    get_registry_version_diff,
+)
+from package_locator.common import CARGO, NPM
+import io
+import json
+import tarfile
+
+
+def make_crate(version, files):
+    data = io.BytesIO()
+    with tarfile.open(fileobj=data, mode="w:gz") as t:
+        for name, content in files.items():
+            if isinstance(content, str):
+                content = content.encode()
+            info = tarfile.TarInfo("demo-{}/{}".format(version, name))
+            info.size = len(content)
+            t.addfile(info, io.BytesIO(content))
+    return data.getvalue()
+
+
+def crate_files(version, sha, lib):
+    return {
+        ".cargo_vcs_info.json": json.dumps({"git": {"sha1": sha}}),
+        "Cargo.toml": "[package]\nname = 'demo'\nversion = '{}'\n".format(version),
+        "src/lib.rs": lib,
+        "README.md": "demo\n",
+    }
+
+
+def test_registry_artifact_cache(tmp_path, monkeypatch):
+    crates = {
+        "1.0.0": make_crate("1.0.0", crate_files("1.0.0", "a" * 40, "fn a() {}\n")),
+        "1.1.0": make_crate("1.1.0", crate_files("1.1.0", "b" * 40, "fn a() {}\nfn b() {}\n")),
+        "1.2.0": make_crate("1.2.0", crate_files("1.2.0", "c" * 40, "fn b() {}\n")),
+    }
+    downloads = []
+
+    class Response:
+        def __init__(self, content):
+            self.content = content
+
+        def raise_for_status(self):
+            pass
+
+    def get(url):
+        downloads.append(url)
+        return Response(crates[url.rsplit("/", 2)[-2]])
+
+    monkeypatch.setattr(registry_diff.requests, "get", get)
+    cache_dir = str(tmp_path / "cache")
+
+    diff = get_registry_version_diff(CARGO, "demo", "1.0.0", "1.1.0", cache_dir=cache_dir)
+    assert (diff.old_version_git_sha, diff.new_version_git_sha) == ("a" * 40, "b" * 40)
+    assert set(diff.diff.keys()) == {"Cargo.toml", "src/lib.rs"}
+    assert [line.strip() for line in diff.diff["src/lib.rs"].added_lines] == ["fn b() {}"]
+    assert diff.new_version_filelist == {"Cargo.toml", "src/lib.rs", "README.md"}
+    assert ".cargo_vcs_info.json" in diff.old_version_filelist
+
+    # 1.1.0 is shared by the next update, and downloaded only once
+    diff = get_registry_version_diff(CARGO, "demo", "1.1.0", "1.2.0", cache_dir=cache_dir)
+    assert [line.strip() for line in diff.diff["src/lib.rs"].removed_lines] == ["fn a() {}"]
+    assert len(downloads) == 3
+
+    cache = RegistryArtifactCache(cache_dir)
+    assert cache.get(CARGO, "demo", "1.1.0")["git_sha"] == "b" * 40
+    assert cache.get(CARGO, "demo", "2.0.0") is None
+
+    # another version with the very same artifact shares its entry
+    metadata = cache.put(CARGO, "demo", "1.1.0-copy", crates["1.1.0"], TAR_ARCHIVE)
+    assert metadata == cache.get(CARGO, "demo", "1.1.0")
+
+    # least recently used artifacts are evicted first
+    cache.get(CARGO, "demo", "1.0.0")
+    cache.max_disk_bytes = 1
+    cache.evict()
+    assert cache.get(CARGO, "demo", "1.1.0") is None
+    assert cache.get(CARGO, "demo", "1.2.0") is None
+
+
+def test_registry_mirror(tmp_path, monkeypatch):
+    def get(url):
+        raise AssertionError("no network access")
+
+    monkeypatch.setattr(registry_diff.requests, "get", get)
+
+    mirror = tmp_path / "mirror"
+    (mirror / "Cargo" / "demo").mkdir(parents=True)
+    (mirror / "Cargo" / "demo" / "1.0.0.crate").write_bytes(make_crate("1.0.0", crate_files("1.0.0", "a" * 40, "")))
+    (mirror / "Cargo" / "demo" / "1.1.0.crate").write_bytes(make_crate("1.1.0", crate_files("1.1.0", "b" * 40, "")))
+
+    (mirror / "npm" / "@scope" / "demo").mkdir(parents=True)
+    for version, git_head in [("1.0.0", "c" * 40), ("1.1.0", "d" * 40)]:
+        package_json = json.dumps({"name": "@scope/demo", "version": version, "gitHead": git_head})
+        (mirror / "npm" / "@scope" / "demo" / "{}.tgz".format(version)).write_bytes(
+            make_crate(version, {"package.json": package_json, "index.js": "module.exports = 1;\n"})
+        )
+
+    diff = get_registry_version_diff(CARGO, "demo", "1.0.0", "1.1.0", registry_mirror=str(mirror))
+    assert (diff.old_version_git_sha, diff.new_version_git_sha) == ("a" * 40, "b" * 40)
+    assert set(diff.diff.keys()) == {"Cargo.toml"}
+
+    diff = get_registry_version_diff(
+        NPM, "@scope/demo", "1.0.0", "1.1.0", cache_dir=str(tmp_path / "cache"), registry_mirror=str(mirror)
+    )
+    # only cargo records the git sha, npm's gitHead is left alone as in version_differ
+    assert (diff.old_version_git_sha, diff.new_version_git_sha) == (None, None)
+    assert set(diff.diff.keys()) == {"package.json"}
+    assert diff.new_version_filelist == {"package.json", "index.js"}
+
+    # versions missing from the mirror
+    diff = get_registry_version_diff(NPM, "@scope/demo", "1.0.0", "2.0.0", registry_mirror=str(mirror))
+    assert diff.diff is None
+    assert RegistryMirror(str(mirror)).artifact_path("pypi", "demo", "1.0.0") is None
+
+
+def test_streaming_registry_diff(tmp_path, monkeypatch):
+    old_files = crate_files("1.0.0", "a" * 40, "fn a() {}\nfn b() {}\n")
+    old_files.update(
+        {
+            "Cargo.toml.orig": "[package]\nname = 'demo'\n",
+            "src/old/util.rs": "fn u() {}\nfn v() {}\nfn w() {}\n",
+            "src/helper.rs": "fn h() {}\nfn i() {}\nfn j() {}\n",
+            'src/say "hi".rs': "fn hi() {}\n",
+            "removed.rs": "fn r() {}\n",
+            "logo.png": "\0png",
+            ".rustfmt.toml": "edition = '2018'\n",
+        }
+    )
+    new_files = crate_files("1.1.0", "b" * 40, "fn a() {}\nfn c() {}\n")
+    new_files.update(
+        {
+            "Cargo.toml.orig": "[package]\nname = 'demo'\nedition = '2018'\n",
+            "src/new/util.rs": "fn u() {}\nfn v() {}\nfn x() {}\n",
+            "src/helpers/mod.rs": "fn h() {}\nfn i() {}\nfn k() {}\n",
+            'src/say "hi".rs': "fn hi() {}\nfn bye() {}\n",
+            "added.rs": "fn n() {}\n\n",
+            "logo.png": "\0png2",
+            ".rustfmt.toml": "edition = '2018'\n",
+        }
+    )
+    mirror = tmp_path / "mirror"
+    (mirror / "Cargo" / "demo").mkdir(parents=True)
+    (mirror / "Cargo" / "demo" / "1.0.0.crate").write_bytes(make_crate("1.0.0", old_files))
+    (mirror / "Cargo" / "demo" / "1.1.0.crate").write_bytes(make_crate("1.1.0", new_files))
+
+    extracted = get_registry_version_diff(CARGO, "demo", "1.0.0", "1.1.0", registry_mirror=str(mirror))
+    reads = []
+    iter_archive_members = archive_diff.iter_archive_members
+    monkeypatch.setattr(
+        archive_diff, "iter_archive_members", lambda *args: reads.append(args) or iter_archive_members(*args)
+    )
+    streamed = get_registry_version_diff(CARGO, "demo", "1.0.0", "1.1.0", registry_mirror=str(mirror), streaming=True)
+    # each archive is read once
+    assert len(reads) == 2
+    cached = get_registry_version_diff(
+        CARGO, "demo", "1.0.0", "1.1.0", cache_dir=str(tmp_path / "cache"), registry_mirror=str(mirror), streaming=True
+    )
+
+    for diff in [streamed, cached]:
+        assert (diff.old_version_git_sha, diff.new_version_git_sha) == ("a" * 40, "b" * 40)
+        assert diff.old_version_filelist == extracted.old_version_filelist
+        assert diff.new_version_filelist == extracted.new_version_filelist
+        assert set(diff.diff.keys()) == set(extracted.diff.keys())
+        for f in diff.diff:
+            for attribute in ["source_file", "target_file", "is_rename", "loc_added", "loc_removed"]:
+                assert getattr(diff.diff[f], attribute) == getattr(extracted.diff[f], attribute)
+            assert [l.strip() for l in diff.diff[f].added_lines] == [l.strip() for l in extracted.diff[f].added_lines]
+            assert [l.strip() for l in diff.diff[f].removed_lines] == [
+                l.strip() for l in extracted.diff[f].removed_lines
+            ]
+    assert streamed.diff["Cargo.toml"].added_lines == ["edition = '2018'\n"]
+    assert streamed.diff["src/new/util.rs"].source_file == "src/old/util.rs"
+    # renames are detected by git, not only between files of the same name
+    assert streamed.diff["src/helpers/mod.rs"].source_file == "src/helper.rs"
+    assert [f for f in streamed.diff if "say" in f]
+    # files are identified as git blobs, the same in every mode
+    assert streamed.new_version_blobs == extracted.new_version_blobs == cached.new_version_blobs
+    assert streamed.old_version_blobs == extracted.old_version_blobs
+    assert streamed.new_version_blobs["added.rs"] == git_blob_id(b"fn n() {}\n\n")
+    assert streamed.new_version_blobs["Cargo.toml"] == git_blob_id(new_files["Cargo.toml.orig"].encode())
+
+
+def test_registry_file_filter(tmp_path):
+    def package(version, files):
+        files = dict(files, **{"package.json": json.dumps({"name": "demo", "version": version})})
+        return make_crate(version, files)
+
+    old_files = {
+        "index.js": "module.exports = 1;\n",
+        "dist/demo.min.js": "var a=1;\n",
+        "package-lock.json": "{}\n",
+        "data.bin": b"\0\1\2\n",
+        "latin.txt": b"caf\xe9\n",
+        "big.js": "",
+    }
+    new_files = {
+        "index.js": "module.exports = 2;\n",
+        "dist/demo.min.js": "var a=2;\n",
+        "dist/demo.min.js.map": "{}\n",
+        "package-lock.json": '{"lockfileVersion": 2}\n',
+        "data.bin": b"\0\1\3\n",
+        "latin.txt": b"caf\xe9s\n",
+        "logo.png": b"\x89PNG\r\n\x1a\n\0",
+        "big.js": "x = 1;\n" * 10 + "y = '{}';\n".format("y" * 3000),
+    }
+    mirror = tmp_path / "mirror"
+    (mirror / "npm" / "demo").mkdir(parents=True)
+    (mirror / "npm" / "demo" / "1.0.0.tgz").write_bytes(package("1.0.0", old_files))
+    (mirror / "npm" / "demo" / "1.1.0.tgz").write_bytes(package("1.1.0", new_files))
+
+    # by default, only the registry's generated files are left out, none for npm
+    for streaming in [False, True]:
+        diff = get_registry_version_diff(
+            NPM, "demo", "1.0.0", "1.1.0", registry_mirror=str(mirror), streaming=streaming
+        )
+        assert set(diff.diff.keys()) == {
+            "index.js",
+            "package.json",
+            "dist/demo.min.js",
+            "dist/demo.min.js.map",
+            "package-lock.json",
+            "latin.txt",
+            "big.js",
+        }
+        assert diff.summarized_files == {}
+
+    # binary files are told from their bytes, the same in every mode
+    file_filter = RegistryFileFilter.for_ecosystem(NPM, summarize=True)
+    for streaming in [False, True]:
+        diff = get_registry_version_diff(
+            NPM, "demo", "1.0.0", "1.1.0", registry_mirror=str(mirror), streaming=streaming, file_filter=file_filter
+        )
+        assert set(diff.diff.keys()) == {"index.js", "package.json"}
+        assert {f: s.reason for f, s in diff.summarized_files.items()} == {
+            "dist/demo.min.js": SUMMARIZED,
+            "dist/demo.min.js.map": SUMMARIZED,
+            "package-lock.json": SUMMARIZED,
+            "data.bin": BINARY,
+            "latin.txt": BINARY,
+            "logo.png": BINARY,
+            "big.js": OVERSIZED,
+        }
+        assert (diff.summarized_files["big.js"].loc_added, diff.summarized_files["big.js"].loc_removed) == (11, 0)
+        # still checked for being phantom files
+        assert "dist/demo.min.js.map" in diff.new_version_filelist
+        assert "logo.png" in diff.new_version_filelist
+
+    # configured rules
+    file_filter = RegistryFileFilter.for_ecosystem(NPM, generated=["/dist/*"], max_changed_lines=2)
+    diff = get_registry_version_diff(
+        NPM, "demo", "1.0.0", "1.1.0", registry_mirror=str(mirror), file_filter=file_filter
+    )
+    assert set(diff.diff.keys()) == {"index.js", "package.json", "package-lock.json", "latin.txt"}
+    assert {f: s.reason for f, s in diff.summarized_files.items()} == {
+        "dist/demo.min.js": GENERATED,
+        "dist/demo.min.js.map": GENERATED,
+        "big.js": OVERSIZED,
+    }
+    assert "dist/demo.min.js.map" not in diff.new_version_filelist
@@ -0,0 +1,38 @@
+from depdive.repository_cache import RepositoryMirror, normalize_repository_url
+from git import Repo
+import os
+
+
+def test_normalize_repository_url():
+    assert normalize_repository_url("https://github.com/tokio-rs/tokio") == "github.com/tokio-rs/tokio"
+    assert normalize_repository_url("https://github.com/Tokio-rs/tokio.git/") == "github.com/tokio-rs/tokio"
+    assert normalize_repository_url("git@github.com:tokio-rs/tokio.git") == "github.com/tokio-rs/tokio"
+    assert normalize_repository_url("https://gitlab.com/Foo/Bar") == "gitlab.com/Foo/Bar"
+    assert normalize_repository_url("file:///tmp/repo.git") == "file:///tmp/repo"
+
+
+def test_repository_mirror(local_repository, tmp_path):
+    first = local_repository.commit("first", {"a.txt": "a\n"})
+
+    mirror = RepositoryMirror(local_repository.url, str(tmp_path / "cache"))
+    assert not mirror.exists()
+    mirror.update()
+    assert mirror.exists()
+
+    worktree = str(tmp_path / "worktree")
+    os.makedirs(worktree)
+    mirror.add_worktree(worktree)
+    assert Repo(worktree).head.commit.hexsha == first
+    assert os.path.isfile(os.path.join(worktree, "a.txt"))
+
+    # later runs reuse the same mirror and only fetch new commits
+    second = local_repository.commit("second", {"b.txt": "b\n"})
+    same_mirror = RepositoryMirror(local_repository.url + "/", str(tmp_path / "cache"))
+    assert same_mirror.path == mirror.path
+    same_mirror.update()
+    assert Repo(mirror.path).commit(second)
+    assert Repo(worktree).commit(second)
+
+    mirror.remove_worktree(worktree)
+    assert not os.path.exists(worktree)
+    assert worktree not in Repo(mirror.path).git.worktree("list")
@@ -1,6 +1,9 @@
 from depdive.repository_diff import *
+from depdive.common import LineDelta, LineTable, git_blob_id
 from package_locator.common import CARGO, PYPI, NPM
+import os
 import tempfile
+import pytest
 from git import Repo
 
 
@@ -184,3 +187,414 @@ def test_repository_common_ancestor():
 
 
 # TODO: get file_commit_stats for rename file
+
+
+def test_repository_diff_partial_clone(cargo_repository):
+    full = RepositoryDiff(CARGO, "demo", cargo_repository.url, "0.1.0", "0.2.0")
+    partial = RepositoryDiff(CARGO, "demo", cargo_repository.url, "0.1.0", "0.2.0", partial_clone=True)
+    assert get_repository_diff_stats(partial.diff) == get_repository_diff_stats(full.diff)
+    assert set(partial.single_diff.keys()) == set(full.single_diff.keys())
+
+    c2c = partial.git_blame("src/lib.rs", partial.new_version_commit)
+    assert {c: list(l) for c, l in c2c.items()} == {
+        c: list(l) for c, l in full.git_blame("src/lib.rs", full.new_version_commit).items()
+    }
+
+    # blobs outside the analyzed range are never fetched
+    repo = Repo(partial.repo_path)
+    old_big_blob = repo.git.rev_parse("v0.1.0~2:assets/big.txt")
+    missing = repo.git.rev_list("--objects", "--missing=print", "--all").split("\n")
+    assert "?" + old_big_blob in missing
+
+    full.cleanup()
+    partial.cleanup()
+
+
+def test_repository_file_list_from_tree(cargo_repository, make_local_repository):
+    repo_path = cargo_repository.path
+    head = cargo_repository.repo.head.commit.hexsha
+    cargo_repository.write("src/lib.rs", "uncommitted change\n")
+
+    assert get_repository_file_list(repo_path, "v0.1.0") == {
+        "Cargo.toml",
+        "README.md",
+        "assets/big.txt",
+        "src/lib.rs",
+        "src/util.rs",
+    }
+    assert get_repository_file_list(repo_path, "v0.2.0") == {
+        "Cargo.toml",
+        "assets/big.txt",
+        "src/helpers.rs",
+        "src/lib.rs",
+    }
+
+    # working tree is never touched
+    assert cargo_repository.repo.head.commit.hexsha == head
+    with open(os.path.join(repo_path, "src/lib.rs")) as f:
+        assert f.read() == "uncommitted change\n"
+
+    # submodules are listed by their gitlink path when not checked out
+    submodule = make_local_repository("submodule")
+    submodule.commit("init", {"sub.c": "int sub;\n"})
+    cargo_repository.repo.git(c="protocol.file.allow=always").submodule("add", submodule.url, "vendor/sub")
+    commit = cargo_repository.commit("add submodule")
+    assert "vendor/sub/sub.c" in get_repository_file_list(repo_path, commit)
+    with tempfile.TemporaryDirectory() as clone_path:
+        Repo.clone_from(cargo_repository.url, clone_path)
+        files = get_repository_file_list(clone_path, commit)
+        assert "vendor/sub" in files and ".gitmodules" in files
+
+
+def test_repository_blob_ids(cargo_repository):
+    repo_path = cargo_repository.path
+    blobs = get_repository_blob_ids(repo_path, "v0.2.0")
+    assert set(blobs.keys()) == get_repository_file_list(repo_path, "v0.2.0")
+    for path, blob in blobs.items():
+        assert blob == cargo_repository.repo.git.rev_parse("v0.2.0:{}".format(path))
+        assert blob == git_blob_id(cargo_repository.repo.git.show("v0.2.0:{}".format(path)).encode() + b"\n")
+
+
+def test_repository_read_file_at_commit(cargo_repository):
+    repo_path = cargo_repository.path
+    os.symlink("../Cargo.toml", os.path.join(repo_path, "src/manifest"))
+    os.symlink("src/manifest", os.path.join(repo_path, "manifest"))
+    commit = cargo_repository.commit("symlinks", {"crlf.txt": "a\r\nb\r\n"})
+    cargo_repository.repo.git.checkout("v0.1.0")
+
+    assert read_file_lines_at_commit(repo_path, "src/lib.rs", "v0.2.0") == [
+        "pub fn one() -> u32 {\n",
+        "    1\n",
+        "}\n",
+        "\n",
+        "pub fn two() -> u32 {\n",
+        "    2\n",
+        "}\n",
+    ]
+    assert read_file_lines_at_commit(repo_path, "crlf.txt", commit) == ["a\n", "b\n"]
+    assert read_file_at_commit(repo_path, "manifest", commit) == read_file_at_commit(repo_path, "Cargo.toml", commit)
+    with pytest.raises(FileReadError):
+        read_file_at_commit(repo_path, "src/helpers.rs", "v0.1.0")
+
+    assert resolve_symlink(repo_path, "manifest", commit) == "Cargo.toml"
+    assert resolve_symlink(repo_path, "src/manifest", commit) == "Cargo.toml"
+    assert resolve_symlink(repo_path, "src/lib.rs", commit) == "src/lib.rs"
+
+    # checked out version stays as is
+    assert cargo_repository.repo.head.commit.hexsha == cargo_repository.repo.commit("v0.1.0").hexsha
+
+
+def test_repository_git_blame_delete_without_checkout(cargo_repository):
+    repo_diff = RepositoryDiff(CARGO, "demo", cargo_repository.url, "0.1.0", "0.2.0")
+    head = Repo(repo_diff.repo_path).head.commit.hexsha
+    drop_readme = Repo(repo_diff.repo_path).commit("v0.2.0").hexsha
+
+    c2c = repo_diff.git_blame_delete(
+        "README.md", repo_diff.common_ancestor_commit_new_and_old_version, repo_diff.new_version_commit
+    )
+    assert dict(c2c) == {drop_readme: ["demo"]}
+    assert Repo(repo_diff.repo_path).head.commit.hexsha == head
+    repo_diff.cleanup()
+
+
+def test_repository_bulk_commit_diff(cargo_repository):
+    repo_path = cargo_repository.path
+    commits = get_doubledot_inbetween_commits(repo_path, "v0.1.0", "v0.2.0")
+    root = Repo(repo_path).git.rev_list("--max-parents=0", "HEAD")
+    all_commits = list(get_doubledot_inbetween_commits(repo_path, root)) + [root]
+
+    streamed = dict(iter_commit_diffs(repo_path, all_commits))
+    assert list(streamed.keys()) == all_commits
+    for commit in all_commits:
+        assert streamed[commit] == get_commit_diff(repo_path, commit) or commit == root
+
+    repo_diff = RepositoryDiff(CARGO, "demo", cargo_repository.url, "0.1.0", "0.2.0")
+    for forward, reverse in [(commits, []), (commits[:2], commits[2:] + [root]), ([root], commits)]:
+        repo_diff.bulk_diff = True
+        bulk = repo_diff.get_commit_diff_stats_from_repo(repo_path, forward, reverse)
+        repo_diff.bulk_diff = False
+        serial = repo_diff.get_commit_diff_stats_from_repo(repo_path, forward, reverse)
+        assert bulk.keys() == serial.keys()
+        for f in bulk.keys():
+            assert bulk[f].commits == serial[f].commits
+            assert bulk[f].is_rename == serial[f].is_rename and bulk[f].old_name == serial[f].old_name
+            assert {
+                l: {c: (d.additions, d.deletions) for c, d in v.items()} for l, v in bulk[f].changed_lines.items()
+            } == {l: {c: (d.additions, d.deletions) for c, d in v.items()} for l, v in serial[f].changed_lines.items()}
+    repo_diff.cleanup()
+
+
+def test_repository_concurrent_blame(cargo_repository):
+    repo_diff = RepositoryDiff(CARGO, "demo", cargo_repository.url, "0.1.0", "0.2.0", partial_clone=True)
+    files = ["Cargo.toml", "src/lib.rs", "src/helpers.rs", "assets/big.txt"]
+    new_version_commit = repo_diff.new_version_commit
+
+    serial = repo_diff.git_blame_files(files, new_version_commit, workers=1)
+    concurrent = repo_diff.git_blame_files(files, new_version_commit, workers=4)
+    assert [list(c2c.items()) for c2c in concurrent] == [list(c2c.items()) for c2c in serial]
+
+    start_commit = repo_diff.common_ancestor_commit_new_and_old_version
+    files = ["Cargo.toml", "README.md", "src/lib.rs"]
+    serial = repo_diff.git_blame_delete_files(files, start_commit, new_version_commit, workers=1)
+    concurrent = repo_diff.git_blame_delete_files(files, start_commit, new_version_commit, workers=4)
+    assert [list(c2c.items()) for c2c in concurrent] == [list(c2c.items()) for c2c in serial]
+    assert dict(concurrent[1]) == {new_version_commit: ["demo"]}
+
+    # errors surface as in the serial path
+    with pytest.raises(FileReadError):
+        repo_diff.git_blame_delete_files(["src/lib.rs", "no/such/file"], start_commit, new_version_commit, workers=4)
+    repo_diff.cleanup()
+
+
+def test_repository_line_range_blame(make_local_repository):
+    r = make_local_repository("ranges")
+    lines = ["line {}\n".format(i) for i in range(1, 61)]
+    r.commit("init", {"Cargo.toml": '[package]\nname = "demo"\nversion = "0.1.0"\n', "big.txt": "".join(lines)})
+    r.repo.create_tag("v0.1.0")
+    lines[9] = "changed 10\n"
+    r.commit("change", {"big.txt": "".join(lines)})
+    del lines[39]
+    r.commit("delete", {"big.txt": "".join(lines), "Cargo.toml": '[package]\nname = "demo"\nversion = "0.2.0"\n'})
+    r.repo.create_tag("v0.2.0")
+
+    assert get_changed_line_ranges(r.path, "big.txt", "v0.1.0", "v0.2.0") == [(7, 13), (37, 42)]
+    assert get_changed_line_ranges(r.path, "big.txt", "v0.1.0", "v0.2.0", source=True) == [(7, 13), (37, 43)]
+    assert get_changed_line_ranges(r.path, "Cargo.toml", "v0.2.0", "v0.2.0") is None
+
+    results = []
+    for min_lines in [10, 10**6]:
+        repo_diff = RepositoryDiff(CARGO, "demo", r.url, "0.1.0", "0.2.0")
+        repo_diff.BLAME_RANGE_MIN_LINES = min_lines
+        start_commit = repo_diff.common_ancestor_commit_new_and_old_version
+        added = repo_diff.git_blame("big.txt", repo_diff.new_version_commit)
+        removed = repo_diff.git_blame_delete("big.txt", start_commit, repo_diff.new_version_commit)
+        results.append((added, removed))
+        repo_diff.cleanup()
+
+    ranged, whole = results
+    assert sum(len(l) for l in ranged[0].values()) == 13 < sum(len(l) for l in whole[0].values())
+    # lines outside the changed ranges are blamed to commits before the old version, and filtered out later
+    changes = set(get_doubledot_inbetween_commits(r.path, "v0.1.0", "v0.2.0"))
+    assert {c: l for c, l in ranged[0].items() if c in changes} == {c: l for c, l in whole[0].items() if c in changes}
+    assert ranged[1] == whole[1]
+    assert list(ranged[1].values()) == [["line 10"], ["line 40"]]
+
+
+def test_repository_line_range_blame_delete_and_add_back(make_local_repository):
+    r = make_local_repository("ranges")
+    lines = ["line {}\n".format(i) for i in range(1, 61)]
+    r.commit("init", {"Cargo.toml": '[package]\nname = "demo"\nversion = "0.1.0"\n', "big.txt": "".join(lines)})
+    r.repo.create_tag("v0.1.0")
+    lines[9] = "changed 10\n"
+    r.commit("change", {"big.txt": "".join(lines)})
+    delete_commit = r.commit("delete", {"big.txt": "".join(lines[:39] + lines[40:])})
+    add_back_commit = r.commit(
+        "add back", {"big.txt": "".join(lines), "Cargo.toml": '[package]\nname = "demo"\nversion = "0.2.0"\n'}
+    )
+    r.repo.create_tag("v0.2.0")
+
+    # line 40 is not in the net changes between the versions
+    assert get_changed_line_ranges(r.path, "big.txt", "v0.1.0", "v0.2.0", source=True) == [(7, 13)]
+
+    results = []
+    for min_lines in [10, 10**6]:
+        repo_diff = RepositoryDiff(CARGO, "demo", r.url, "0.1.0", "0.2.0")
+        repo_diff.BLAME_RANGE_MIN_LINES = min_lines
+        start_commit = repo_diff.common_ancestor_commit_new_and_old_version
+        results.append(
+            (
+                repo_diff.git_blame_delete("big.txt", start_commit, repo_diff.new_version_commit),
+                repo_diff.git_blame("big.txt", repo_diff.new_version_commit),
+            )
+        )
+        repo_diff.cleanup()
+
+    (ranged, ranged_added), (whole, whole_added) = results
+    assert ranged == whole
+    assert ranged[delete_commit] == ["line 40"]
+    assert ranged_added == whole_added
+    assert whole_added[add_back_commit] == ["line 40"]
+
+
+def test_repository_lazy_submodule(make_local_repository, tmp_path):
+    submodule = make_local_repository("submodule")
+    submodule.commit("init", {"sub.c": "int sub;\n"})
+    r = make_local_repository("super")
+    r.commit("init", {"Cargo.toml": '[package]\nname = "demo"\nversion = "0.1.0"\n'})
+    r.repo.git(c="protocol.file.allow=always").submodule("add", submodule.url, "vendor/sub")
+    r.commit("add submodule")
+    r.repo.create_tag("v0.1.0")
+    submodule.commit("grow", {"sub.c": "int sub;\nint more;\n"})
+    r.repo.git(c="protocol.file.allow=always").submodule("update", "--remote", "vendor/sub")
+    bump = r.commit("bump", {"Cargo.toml": '[package]\nname = "demo"\nversion = "0.2.0"\n'})
+    r.repo.create_tag("v0.2.0")
+
+    cache_dir = str(tmp_path / "cache")
+    for i in range(2):
+        repo_diff = RepositoryDiff(CARGO, "demo", r.url, "0.1.0", "0.2.0", cache_dir=cache_dir)
+        assert repo_diff.submodule_paths == ["vendor/sub"]
+        assert repo_diff.get_submodule_path("vendor/sub/sub.c") == "vendor/sub"
+        assert repo_diff.get_submodule_path("vendor/subway.c") is None
+
+        # nothing is fetched until asked for
+        assert not os.path.exists(os.path.join(repo_diff.repo_path, "vendor/sub/.git"))
+        assert "vendor/sub/sub.c" not in repo_diff.diff
+        assert "vendor/sub" in repo_diff.new_version_filelist
+
+        repo_diff.materialize_submodule("vendor/sub")
+        assert repo_diff.diff["vendor/sub/sub.c"].commits == {bump}
+        assert list(repo_diff.diff["vendor/sub/sub.c"].changed_lines.keys()) == ["int more;"]
+        assert "vendor/sub/sub.c" in repo_diff.single_diff
+        assert "vendor/sub/sub.c" in repo_diff.new_version_filelist
+        repo_diff.cleanup()
+
+
+def test_repository_hashed_line_identities(cargo_repository):
+    lines = LineTable()
+    assert lines("  pub fn   one() {  ") == "pub fn one() {"
+    assert lines("pub fn one() {") is lines(" pub  fn one() {")
+    assert lines("    ") == ""
+
+    text = RepositoryDiff(CARGO, "demo", cargo_repository.url, "0.1.0", "0.2.0")
+    hashed_lines = LineTable(hashed=True)
+    hashed = RepositoryDiff(CARGO, "demo", cargo_repository.url, "0.1.0", "0.2.0", line_table=hashed_lines)
+
+    def counters(diff):
+        return {
+            f: {l: {c: (d.additions, d.deletions) for c, d in v.items()} for l, v in diff[f].changed_lines.items()}
+            for f in diff.keys()
+        }
+
+    assert counters(hashed.diff) == {
+        f: {hashed_lines.identity(l): v for l, v in changed_lines.items()}
+        for f, changed_lines in counters(text.diff).items()
+    }
+    assert all(isinstance(l, int) for f in hashed.diff.values() for l in f.changed_lines)
+
+    start_commit = text.common_ancestor_commit_new_and_old_version
+    assert hashed.git_blame_delete("README.md", start_commit, hashed.new_version_commit) == {
+        hashed.new_version_commit: [hashed_lines("demo")]
+    }
+    text.cleanup()
+    hashed.cleanup()
+
+
+def test_merge_renamed_files():
+    def file_change(path, old_name, commit, line):
+        f = MultipleCommitFileChangeData(path)
+        f.is_rename, f.old_name = old_name is not None, old_name
+        f.commits.add(commit)
+        f.changed_lines[line] = {commit: LineDelta(1, 0)}
+        return f
+
+    # a.rs -> b.rs -> c.rs, while d.rs is not renamed
+    files = {
+        "c.rs": file_change("c.rs", "b.rs", "3" * 40, "fn c()"),
+        "d.rs": file_change("d.rs", None, "4" * 40, "fn d()"),
+        "b.rs": file_change("b.rs", "a.rs", "2" * 40, "fn b()"),
+        "a.rs": file_change("a.rs", None, "1" * 40, "fn a()"),
+    }
+    merge_renamed_files(files)
+    assert files["a.rs"] is files["b.rs"] is files["c.rs"]
+    assert files["c.rs"].filename == "c.rs"
+    assert files["c.rs"].commits == {"1" * 40, "2" * 40, "3" * 40}
+    assert set(files["c.rs"].changed_lines.keys()) == {"fn a()", "fn b()", "fn c()"}
+    assert files["d.rs"].commits == {"4" * 40}
+
+    # b.rs -> a.rs, then a new b.rs -> z.rs, the two files stay apart
+    files = {
+        "a.rs": file_change("a.rs", "b.rs", "1" * 40, "fn a()"),
+        "b.rs": file_change("b.rs", None, "2" * 40, "fn b()"),
+        "z.rs": file_change("z.rs", "b.rs", "3" * 40, "fn z()"),
+    }
+    merge_renamed_files(files)
+    assert files["a.rs"] is not files["z.rs"]
+    assert files["a.rs"].commits == {"1" * 40, "2" * 40}
+    assert files["z.rs"].commits == {"2" * 40, "3" * 40}
+    assert "fn z()" not in files["a.rs"].changed_lines and "fn a()" not in files["z.rs"].changed_lines
+
+    # renamed back and forth
+    files = {
+        "a.rs": file_change("a.rs", "b.rs", "1" * 40, "fn a()"),
+        "b.rs": file_change("b.rs", "a.rs", "2" * 40, "fn b()"),
+    }
+    merge_renamed_files(files)
+    assert files["a.rs"] is files["b.rs"]
+    assert files["a.rs"].commits == {"1" * 40, "2" * 40}
+
+    # long rename chains, with the oldest name no longer in the diff
+    files = {"f{}".format(i): file_change("f{}".format(i), "f{}".format(i - 1), str(i), "line") for i in range(1, 5000)}
+    merge_renamed_files(files)
+    assert files["f0"] is files["f4999"]
+    assert len(files["f1"].changed_lines["line"]) == 4999
+
+
+def test_repository_scoped_to_package_directory(make_local_repository):
+    r = make_local_repository("workspace")
+    r.commit(
+        "init",
+        {
+            "LICENSE": "MIT\n",
+            "shared/build.rs": "fn main() {}\n",
+            "crates/demo/Cargo.toml": '[package]\nname = "demo"\nversion = "0.1.0"\n',
+            "crates/demo/src/lib.rs": "pub fn one() {}\n",
+            "crates/other/Cargo.toml": '[package]\nname = "other"\nversion = "0.1.0"\n',
+        },
+    )
+    os.symlink("../../shared/build.rs", os.path.join(r.path, "crates/demo/build.rs"))
+    r.commit("link build script")
+    r.repo.create_tag("v0.1.0")
+    other_only = r.commit("other", {"crates/other/src/lib.rs": "pub fn other() {}\n"})
+    r.commit("build", {"shared/build.rs": "fn main() {\n    build();\n}\n"})
+    r.commit("license", {"LICENSE": "MIT\nyear\n"})
+    r.commit(
+        "demo",
+        {
+            "crates/demo/Cargo.toml": '[package]\nname = "demo"\nversion = "0.2.0"\n',
+            "crates/demo/src/lib.rs": "pub fn two() {}\n",
+            "crates/other/src/lib.rs": "pub fn other() -> u32 {\n    2\n}\n",
+        },
+    )
+    r.repo.create_tag("v0.2.0")
+
+    whole = RepositoryDiff(CARGO, "demo", r.url, "0.1.0", "0.2.0")
+    scoped = RepositoryDiff(CARGO, "demo", r.url, "0.1.0", "0.2.0", scoped=True, extra_paths=["LICENSE"])
+    assert scoped.pathspecs == ["LICENSE", "crates/demo", "shared/build.rs"]
+    assert scoped.commits == whole.commits - {other_only}
+    assert set(scoped.diff.keys()) == set(whole.diff.keys()) - {"crates/other/src/lib.rs"}
+    for f in scoped.diff.keys():
+        assert scoped.diff[f].commits == whole.diff[f].commits
+    assert set(scoped.single_diff.keys()) == set(whole.single_diff.keys()) - {"crates/other/src/lib.rs"}
+
+    commits = sorted(whole.commits)
+    streamed = dict(iter_commit_diffs(r.path, commits, pathspecs=scoped.pathspecs))
+    assert list(streamed.keys()) == commits
+    assert streamed[other_only] == ""
+    for commit in commits:
+        assert streamed[commit] == get_commit_diff(r.path, commit, pathspecs=scoped.pathspecs)
+
+    # sparse worktree
+    assert os.path.exists(os.path.join(scoped.repo_path, "crates/demo/src/lib.rs"))
+    assert not os.path.exists(os.path.join(scoped.repo_path, "crates/other"))
+    whole.cleanup()
+    scoped.cleanup()
+
+
+def test_locate_package_subdir(make_local_repository):
+    r = make_local_repository("packages")
+    first = r.commit(
+        "init",
+        {
+            "package.json": '{"name": "root"}\n',
+            "packages/demo/package.json": '{"name": "@scope/demo"}\n',
+            "packages/broken/package.json": "{",
+            "crates/demo/Cargo.toml": '[package]\nname = "demo"\n',
+        },
+    )
+    r.repo.git.mv("packages/demo", "packages/moved")
+    second = r.commit("move")
+
+    for ecosystem, package, commit in [(NPM, "demo", first), (NPM, "demo", second), (CARGO, "demo", second)]:
+        subdir = locate_package_subdir(r.path, r.url, ecosystem, package, commit)
+        assert subdir == locate_subdir(ecosystem, package, r.url, commit=commit)
+    assert locate_package_subdir(r.path, r.url, NPM, "demo", second) == "./packages/moved"
@@ -0,0 +1,34 @@
+from depdive import repository_resolution
+from depdive.repository_resolution import RepositoryResolutionCache
+from package_locator.common import CARGO, NPM
+import json
+
+
+def test_repository_resolution_cache(tmp_path, monkeypatch):
+    resolved = []
+
+    def resolve(ecosystem, package):
+        resolved.append((ecosystem, package))
+        return "https://github.com/owner/{}".format(package), "./"
+
+    monkeypatch.setattr(repository_resolution, "get_repository_url_and_subdir", resolve)
+    cache_dir = str(tmp_path / "cache")
+
+    cache = RepositoryResolutionCache(cache_dir)
+    assert cache.resolve(CARGO, "demo") == ("https://github.com/owner/demo", "./")
+    # persisted across instances
+    assert RepositoryResolutionCache(cache_dir).resolve(CARGO, "demo") == ("https://github.com/owner/demo", "./")
+    assert resolved == [(CARGO, "demo")]
+
+    # expired, or refreshed explicitly
+    RepositoryResolutionCache(cache_dir, ttl=-1).resolve(CARGO, "demo")
+    RepositoryResolutionCache(cache_dir).resolve(CARGO, "demo", refresh=True)
+    assert resolved == [(CARGO, "demo")] * 3
+
+    # preloaded mapping, without resolving at all
+    mapping = tmp_path / "mapping.json"
+    mapping.write_text(json.dumps({NPM: {"@scope/pkg": {"repository": "https://example.com/pkg", "directory": "./p"}}}))
+    cache = RepositoryResolutionCache(mapping_file=str(mapping))
+    assert cache.resolve(NPM, "@scope/pkg") == ("https://example.com/pkg", "./p")
+    assert (cache.hits, cache.misses) == (1, 0)
+    assert len(resolved) == 3
@@ -0,0 +1,51 @@
+from depdive.repository_cache import RepositoryMirror
+from depdive.tag_index import TagIndex
+from git import Repo
+from version_differ.version_differ import get_commit_of_release
+import os
+
+TAGS = ["v0.1.8", "10.1.8", "guppy-0.2.0", "guppy-summaries-0.2.0", "@scope/pkg@1.0.0", "pkg-v1.0.0", "V2.0.0", "3.0"]
+
+
+def test_tag_index(local_repository):
+    r = local_repository
+    # tagger of annotated tags
+    r.repo.git.config("user.name", "depdive")
+    r.repo.git.config("user.email", "depdive@example.com")
+    for i, tag in enumerate(TAGS):
+        r.commit(tag)
+        if i % 2:
+            r.repo.create_tag(tag, message="release {}".format(tag))
+        else:
+            r.repo.create_tag(tag)
+
+    index = TagIndex.build(r.path)
+    assert sorted(index.tags_ending_with("0.1.8")) == ["10.1.8", "v0.1.8"]
+    for package in ["guppy", "guppy-summaries", "pkg", "other"]:
+        for version in ["0.1.8", "10.1.8", "0.2.0", "1.0.0", "2.0.0", "3.0", "0", " 3.0 "]:
+            expected = get_commit_of_release(r.repo.tags, package, version)
+            assert index.commit_of_release(package, version) == (expected.hexsha if expected else None)
+
+    # annotated tags are peeled to their commit
+    assert index.commit_of_release("pkg", "10.1.8") == r.repo.tags["10.1.8"].commit.hexsha
+
+
+def test_tag_index_shared_through_mirror(local_repository, tmp_path):
+    r = local_repository
+    first = r.commit("first")
+    r.repo.create_tag("v1.0.0")
+
+    mirror = RepositoryMirror(r.url, str(tmp_path / "cache"))
+    mirror.update()
+    assert os.path.exists(mirror.tag_index_path)
+    assert mirror.tag_index().commit_of_release("demo", "1.0.0") == first
+
+    # refreshed along with the fetch
+    second = r.commit("second")
+    r.repo.create_tag("v1.1.0")
+    saved = os.path.getmtime(mirror.tag_index_path)
+    assert RepositoryMirror(r.url, str(tmp_path / "cache")).tag_index().commit_of_release("demo", "1.1.0") is None
+    mirror.update()
+    assert mirror.tag_index().commit_of_release("demo", "1.1.0") == second
+    assert os.path.getmtime(mirror.tag_index_path) >= saved
+    assert Repo(mirror.path).tags["v1.1.0"].commit.hexsha == second